@@ -0,0 +1,281 @@
+import math
+import statistics
+from collections import Counter
+
+try:
+    import numpy as np  # opcional: sem ele a análise roda em Python puro (mesmo resultado, mais devagar)
+except ImportError:
+    np = None
+
+# 🆕 NOVO: Análise do histórico de saídas
+#
+# Para cada linha e dia, ordena as saídas pelo horário e mede o intervalo entre um carro e o anterior
+# (headway). Compara com o intervalo configurado da linha:
+#   - atrasado   → intervalo maior que o configurado + tolerância (buraco na linha)
+#   - adiantado  → intervalo menor que o configurado - tolerância (carros encavalados)
+#   - pontual    → dentro da tolerância
+# Cada intervalo conta para o carro que saiu no fim dele (e para o motorista desse carro).
+#
+# Quando a saída foi confirmada com horário (migração 6), mede também o atraso real:
+# momento da confirmação - horário marcado. Saída atrasada = atraso maior que a tolerância.
+
+INTERVALO_PADRAO = 8
+LIMITE_HISTOGRAMA = 30  # minutos; intervalos maiores entram na última faixa
+
+
+def montar_colunas(lotes):
+    """Junta lotes de registros (SaidaCarro, como vêm de exportar_registros) em colunas, com linha e motorista como códigos
+
+    Retorna {'linhas': [nomes], 'motoristas': [nomes], 'linha', 'motorista', 'dia', 'segundos', 'confirmada',
+    'atraso'} (atraso em segundos, None quando a saída não tem horário de confirmação).
+    """
+    codigos_linha = {}
+    codigos_motorista = {}
+    colunas = {'linha': [], 'motorista': [], 'dia': [], 'segundos': [], 'confirmada': [], 'atraso': []}
+
+    for lote in lotes:
+        for registro in lote:
+            horario = registro.horario_saida
+            if horario is None or registro.data_trabalho is None:
+                continue
+            if hasattr(horario, 'total_seconds'):
+                segundos = int(horario.total_seconds())
+            else:
+                segundos = horario.hour * 3600 + horario.minute * 60 + horario.second
+
+            colunas['linha'].append(codigos_linha.setdefault(registro.linha or '', len(codigos_linha)))
+            colunas['motorista'].append(codigos_motorista.setdefault(registro.nome_motorista or '', len(codigos_motorista)))
+            colunas['dia'].append(registro.data_trabalho.toordinal())
+            colunas['segundos'].append(segundos)
+            colunas['confirmada'].append(1 if registro.saida_confirmada else 0)
+            colunas['atraso'].append(registro.atraso_segundos)
+
+    colunas['linhas'] = list(codigos_linha)
+    colunas['motoristas'] = list(codigos_motorista)
+    return colunas
+
+
+def percentil(ordenados, p):
+    """Percentil com interpolação linear (mesma conta do numpy.percentile)"""
+    posicao = (len(ordenados) - 1) * p / 100
+    abaixo = math.floor(posicao)
+    acima = min(abaixo + 1, len(ordenados) - 1)
+    return ordenados[abaixo] + (ordenados[acima] - ordenados[abaixo]) * (posicao - abaixo)
+
+
+def analisar(colunas, intervalos_por_linha, tolerancia=2):
+    """Distribuição dos intervalos por linha e pontualidade por motorista
+
+    `intervalos_por_linha`: {linha: minutos configurados}; linha fora do dict usa INTERVALO_PADRAO.
+    """
+    esperados = [intervalos_por_linha.get(nome, INTERVALO_PADRAO) for nome in colunas['linhas']]
+    if np is not None:
+        parciais = _analisar_numpy(colunas, esperados, tolerancia)
+    else:
+        parciais = _analisar_python(colunas, esperados, tolerancia)
+
+    por_linha = []
+    for codigo, nome in enumerate(colunas['linhas']):
+        dados = parciais['linhas'][codigo]
+        por_linha.append({
+            'linha': nome,
+            'saidas': dados['saidas'],
+            'confirmadas': dados['confirmadas'],
+            'intervalo_configurado': esperados[codigo],
+            'intervalo_sugerido': round(dados['mediana']) if dados['intervalos'] else None,
+            'intervalos': dados['intervalos'],
+            'intervalo_medio': _arredondar(dados['media']),
+            'intervalo_mediano': _arredondar(dados['mediana']),
+            'intervalo_p10': _arredondar(dados['p10']),
+            'intervalo_p90': _arredondar(dados['p90']),
+            'desvio_padrao': _arredondar(dados['desvio']),
+            'taxa_atraso': _taxa(dados['atrasados'], dados['intervalos']),
+            'taxa_adiantado': _taxa(dados['adiantados'], dados['intervalos']),
+            'histograma_minutos': dados['histograma'],
+            'saidas_com_atraso_medido': dados['atrasos_medidos'],
+            'atraso_medio_minutos': _arredondar(dados['atraso_medio']),
+            'atraso_mediano_minutos': _arredondar(dados['atraso_mediano']),
+            'taxa_saida_atrasada': _taxa(dados['saidas_atrasadas'], dados['atrasos_medidos'])
+        })
+    por_linha.sort(key=lambda item: -item['saidas'])
+
+    por_motorista = []
+    for codigo, nome in enumerate(colunas['motoristas']):
+        dados = parciais['motoristas'][codigo]
+        por_motorista.append({
+            'motorista': nome,
+            'saidas': dados['saidas'],
+            'taxa_confirmacao': _taxa(dados['confirmadas'], dados['saidas']),
+            'intervalos': dados['intervalos'],
+            'taxa_pontualidade': _taxa(dados['pontuais'], dados['intervalos']),
+            'desvio_medio_minutos': _arredondar(dados['soma_desvio'] / dados['intervalos'])
+            if dados['intervalos'] else None,
+            'atraso_medio_minutos': _arredondar(dados['soma_atraso'] / dados['atrasos_medidos'])
+            if dados['atrasos_medidos'] else None,
+            'taxa_saida_atrasada': _taxa(dados['saidas_atrasadas'], dados['atrasos_medidos'])
+        })
+    por_motorista.sort(key=lambda item: -item['saidas'])
+
+    return {
+        'total_saidas': len(colunas['segundos']),
+        'tolerancia_minutos': tolerancia,
+        'motor': 'numpy' if np is not None else 'python',
+        'por_linha': por_linha,
+        'por_motorista': por_motorista
+    }
+
+
+def _analisar_numpy(colunas, esperados, tolerancia):
+    """Tudo em arrays: uma ordenação, uma diferença e contagens com bincount"""
+    linha = np.asarray(colunas['linha'], dtype=np.int64)
+    motorista = np.asarray(colunas['motorista'], dtype=np.int64)
+    dia = np.asarray(colunas['dia'], dtype=np.int64)
+    segundos = np.asarray(colunas['segundos'], dtype=np.int64)
+    confirmada = np.asarray(colunas['confirmada'], dtype=np.int64)
+    atraso = np.asarray([np.nan if a is None else a for a in colunas['atraso']], dtype=np.float64) / 60.0
+    total_linhas = len(colunas['linhas'])
+    total_motoristas = len(colunas['motoristas'])
+
+    ordem = np.lexsort((segundos, dia, linha))
+    linha, motorista, dia = linha[ordem], motorista[ordem], dia[ordem]
+    segundos, confirmada, atraso = segundos[ordem], confirmada[ordem], atraso[ordem]
+
+    # Atraso real (só saídas confirmadas com horário)
+    medido = ~np.isnan(atraso)
+    linha_medida, motorista_medido, atraso_medido = linha[medido], motorista[medido], atraso[medido]
+    saida_atrasada = atraso_medido > tolerancia
+
+    # Intervalo só entre carros da mesma linha no mesmo dia
+    mesmo_grupo = (linha[1:] == linha[:-1]) & (dia[1:] == dia[:-1])
+    intervalos = ((segundos[1:] - segundos[:-1]) / 60.0)[mesmo_grupo]
+    linha_intervalo = linha[1:][mesmo_grupo]
+    motorista_intervalo = motorista[1:][mesmo_grupo]
+
+    esperado = np.asarray(esperados, dtype=np.float64)[linha_intervalo]
+    atrasado = intervalos > esperado + tolerancia
+    adiantado = intervalos < esperado - tolerancia
+    pontual = ~(atrasado | adiantado)
+    faixas = np.minimum(intervalos.astype(np.int64), LIMITE_HISTOGRAMA)
+
+    saidas_linha = np.bincount(linha, minlength=total_linhas)
+    confirmadas_linha = np.bincount(linha, weights=confirmada, minlength=total_linhas)
+
+    linhas = []
+    for codigo in range(total_linhas):
+        da_linha = linha_intervalo == codigo
+        valores = intervalos[da_linha]
+        dados = {'saidas': int(saidas_linha[codigo]), 'confirmadas': int(confirmadas_linha[codigo]),
+                 'intervalos': int(valores.size)}
+        if valores.size:
+            p10, mediana, p90 = np.percentile(valores, (10, 50, 90))
+            dados.update(media=float(valores.mean()), mediana=float(mediana), p10=float(p10), p90=float(p90),
+                         desvio=float(valores.std()), atrasados=int(atrasado[da_linha].sum()),
+                         adiantados=int(adiantado[da_linha].sum()),
+                         histograma=np.bincount(faixas[da_linha], minlength=LIMITE_HISTOGRAMA + 1).tolist())
+        else:
+            dados.update(_linha_sem_intervalos())
+
+        atrasos = atraso_medido[linha_medida == codigo]
+        dados.update(atrasos_medidos=int(atrasos.size),
+                     atraso_medio=float(atrasos.mean()) if atrasos.size else None,
+                     atraso_mediano=float(np.median(atrasos)) if atrasos.size else None,
+                     saidas_atrasadas=int((atrasos > tolerancia).sum()))
+        linhas.append(dados)
+
+    contagens = {
+        'saidas': np.bincount(motorista, minlength=total_motoristas),
+        'confirmadas': np.bincount(motorista, weights=confirmada, minlength=total_motoristas),
+        'intervalos': np.bincount(motorista_intervalo, minlength=total_motoristas),
+        'pontuais': np.bincount(motorista_intervalo, weights=pontual, minlength=total_motoristas),
+        'soma_desvio': np.bincount(motorista_intervalo, weights=intervalos - esperado, minlength=total_motoristas),
+        'atrasos_medidos': np.bincount(motorista_medido, minlength=total_motoristas),
+        'soma_atraso': np.bincount(motorista_medido, weights=atraso_medido, minlength=total_motoristas),
+        'saidas_atrasadas': np.bincount(motorista_medido, weights=saida_atrasada, minlength=total_motoristas)
+    }
+    motoristas = [{
+        'saidas': int(contagens['saidas'][codigo]),
+        'confirmadas': int(contagens['confirmadas'][codigo]),
+        'intervalos': int(contagens['intervalos'][codigo]),
+        'pontuais': int(contagens['pontuais'][codigo]),
+        'soma_desvio': float(contagens['soma_desvio'][codigo]),
+        'atrasos_medidos': int(contagens['atrasos_medidos'][codigo]),
+        'soma_atraso': float(contagens['soma_atraso'][codigo]),
+        'saidas_atrasadas': int(contagens['saidas_atrasadas'][codigo])
+    } for codigo in range(total_motoristas)]
+
+    return {'linhas': linhas, 'motoristas': motoristas}
+
+
+def _analisar_python(colunas, esperados, tolerancia):
+    """Mesma conta do _analisar_numpy, registro a registro"""
+    ordem = sorted(range(len(colunas['segundos'])),
+                   key=lambda i: (colunas['linha'][i], colunas['dia'][i], colunas['segundos'][i]))
+
+    linhas = [{'saidas': 0, 'confirmadas': 0, 'valores': [], 'atrasados': 0, 'adiantados': 0,
+               'atrasos': [], 'saidas_atrasadas': 0}
+              for _ in colunas['linhas']]
+    motoristas = [{'saidas': 0, 'confirmadas': 0, 'intervalos': 0, 'pontuais': 0, 'soma_desvio': 0.0,
+                   'atrasos_medidos': 0, 'soma_atraso': 0.0, 'saidas_atrasadas': 0}
+                  for _ in colunas['motoristas']]
+
+    anterior = None
+    for i in ordem:
+        linha, motorista = colunas['linha'][i], colunas['motorista'][i]
+        linhas[linha]['saidas'] += 1
+        linhas[linha]['confirmadas'] += colunas['confirmada'][i]
+        motoristas[motorista]['saidas'] += 1
+        motoristas[motorista]['confirmadas'] += colunas['confirmada'][i]
+
+        if colunas['atraso'][i] is not None:
+            atraso = colunas['atraso'][i] / 60.0
+            linhas[linha]['atrasos'].append(atraso)
+            motoristas[motorista]['atrasos_medidos'] += 1
+            motoristas[motorista]['soma_atraso'] += atraso
+            if atraso > tolerancia:
+                linhas[linha]['saidas_atrasadas'] += 1
+                motoristas[motorista]['saidas_atrasadas'] += 1
+
+        if anterior is not None and colunas['linha'][anterior] == linha and colunas['dia'][anterior] == colunas['dia'][i]:
+            intervalo = (colunas['segundos'][i] - colunas['segundos'][anterior]) / 60.0
+            esperado = esperados[linha]
+            linhas[linha]['valores'].append(intervalo)
+            motoristas[motorista]['intervalos'] += 1
+            motoristas[motorista]['soma_desvio'] += intervalo - esperado
+            if intervalo > esperado + tolerancia:
+                linhas[linha]['atrasados'] += 1
+            elif intervalo < esperado - tolerancia:
+                linhas[linha]['adiantados'] += 1
+            else:
+                motoristas[motorista]['pontuais'] += 1
+        anterior = i
+
+    for dados in linhas:
+        valores = sorted(dados.pop('valores'))
+        dados['intervalos'] = len(valores)
+        if valores:
+            faixas = Counter(min(int(v), LIMITE_HISTOGRAMA) for v in valores)
+            dados.update(media=statistics.fmean(valores), mediana=percentil(valores, 50),
+                         p10=percentil(valores, 10), p90=percentil(valores, 90), desvio=statistics.pstdev(valores),
+                         histograma=[faixas.get(f, 0) for f in range(LIMITE_HISTOGRAMA + 1)])
+        else:
+            dados.update(_linha_sem_intervalos())
+
+        atrasos = sorted(dados.pop('atrasos'))
+        dados.update(atrasos_medidos=len(atrasos),
+                     atraso_medio=statistics.fmean(atrasos) if atrasos else None,
+                     atraso_mediano=percentil(atrasos, 50) if atrasos else None)
+
+    return {'linhas': linhas, 'motoristas': motoristas}
+
+
+def _linha_sem_intervalos():
+    return {'media': None, 'mediana': None, 'p10': None, 'p90': None, 'desvio': None,
+            'atrasados': 0, 'adiantados': 0, 'histograma': [0] * (LIMITE_HISTOGRAMA + 1)}
+
+
+def _arredondar(valor):
+    return round(valor, 2) if valor is not None else None
+
+
+def _taxa(parte, total):
+    return round(parte / total, 4) if total else None
\ No newline at end of file
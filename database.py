@@ -1,8 +1,390 @@
+import base64
+import json
+import os
+import queue
+import re
+import threading
+import unicodedata
+import time as relogio
+from collections import OrderedDict
+from contextlib import contextmanager
 import mysql.connector
-from datetime import datetime, time, timedelta
+from datetime import datetime, date, time, timedelta
+from logs import AMOSTRAR, configurar_logging, obter_logger
+from serializacao import Fragmento, codificar
+
+logger = obter_logger('database')
+
+
+def para_time(horario):
+    """Converte o horário vindo do MySQL (TIME chega como timedelta) para datetime.time"""
+    if isinstance(horario, timedelta):
+        total_seconds = int(horario.total_seconds())
+        return time(total_seconds // 3600, (total_seconds % 3600) // 60, 0)
+    return horario
+
+
+def para_timedelta(horario):
+    """Converte datetime.time para timedelta (o mesmo tipo que o MySQL devolve para TIME)"""
+    if isinstance(horario, time):
+        return timedelta(hours=horario.hour, minutes=horario.minute, seconds=horario.second)
+    return horario
+
+
+def codificar_cursor(valores):
+    """🆕 NOVO: Token opaco da próxima página (base64 de uma lista JSON com a posição)"""
+    return base64.urlsafe_b64encode(json.dumps(valores, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def decodificar_cursor(token, quantidade):
+    """Lê o token de `codificar_cursor`; ValueError se estiver corrompido"""
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except Exception:
+        raise ValueError("Cursor inválido")
+    if not isinstance(valores, list) or len(valores) != quantidade:
+        raise ValueError("Cursor inválido")
+    return valores
+
+
+def ids_do_lote(ids):
+    """🆕 NOVO: Ids de um pedido em lote como inteiros, sem repetidos e na ordem recebida (ValueError se inválido)"""
+    return list(dict.fromkeys(int(i) for i in ids))
+
+
+def normalizar_termos(texto):
+    """🆕 NOVO: 'João da Silva' → ['joao', 'da', 'silva'] (minúsculas, sem acento, só letras e números)"""
+    sem_acento = unicodedata.normalize('NFKD', str(texto or '')).encode('ascii', 'ignore').decode('ascii')
+    return [termo[:60] for termo in re.findall(r'[a-z0-9]+', sem_acento.lower())]
+
+
+# 🆕 Colunas de saida_carros na ordem dos campos de SaidaCarro (use no lugar de SELECT *)
+COLUNAS_SAIDA = ("id, nome_fiscal, data_trabalho, linha, numero_carro, nome_motorista, horario_saida, "
+                 "data_registro, saida_confirmada, horario_confirmacao, atraso_segundos")
+
+
+class SaidaCarro:
+    """🆕 NOVO: Um registro de saida_carros (uma linha de SELECT COLUNAS_SAIDA)
+
+    Usa __slots__ (sem dict por objeto) e é tratado como imutável: para mudar um campo,
+    `alterado()` devolve um registro novo. Por isso o JSON de `para_json()` (e os bytes de
+    `para_json_bytes()`) é montado uma vez só e reaproveitado em todas as leituras do quadro.
+    """
+
+    __slots__ = ('id', 'nome_fiscal', 'data_trabalho', 'linha', 'numero_carro', 'nome_motorista',
+                 'horario_saida', 'data_registro', 'saida_confirmada', 'horario_confirmacao', 'atraso_segundos',
+                 '_json', '_json_bytes')
+
+    CAMPOS = __slots__[:-2]
+
+    def __init__(self, id, nome_fiscal, data_trabalho, linha, numero_carro, nome_motorista, horario_saida,
+                 data_registro=None, saida_confirmada=0, horario_confirmacao=None, atraso_segundos=None):
+        self.id = id
+        self.nome_fiscal = nome_fiscal
+        self.data_trabalho = data_trabalho
+        self.linha = linha
+        self.numero_carro = numero_carro
+        self.nome_motorista = nome_motorista
+        self.horario_saida = horario_saida  # TIME do MySQL: timedelta
+        self.data_registro = data_registro
+        self.saida_confirmada = saida_confirmada
+        self.horario_confirmacao = horario_confirmacao
+        self.atraso_segundos = atraso_segundos
+        self._json = None
+        self._json_bytes = None
+
+    def __repr__(self):
+        return f"SaidaCarro(id={self.id}, linha={self.linha!r}, carro={self.numero_carro!r}, horario={self.horario_saida})"
+
+    def alterado(self, **campos):
+        """Cópia com os campos informados trocados (ex.: alterado(saida_confirmada=1))"""
+        return SaidaCarro(*[campos[nome] if nome in campos else getattr(self, nome) for nome in self.CAMPOS])
+
+    def para_json(self):
+        """Dict enviado ao navegador - montado na primeira chamada e reaproveitado (não altere o dict)"""
+        if self._json is None:
+            saida_confirmada = bool(self.saida_confirmada)
+            self._json = {
+                "id": self.id,
+                "fiscal": self.nome_fiscal,
+                "data": self.data_trabalho.strftime('%Y-%m-%d') if self.data_trabalho else None,
+                "linha": self.linha,
+                "numero": self.numero_carro,
+                "motorista": self.nome_motorista,
+                "horario": str(self.horario_saida) if self.horario_saida else None,
+                "saida_confirmada": saida_confirmada,
+                # SAIU ou AGUARDANDO (quem decide se o horário passou é o painel, no navegador)
+                "status": "SAIU" if saida_confirmada else "AGUARDANDO",
+                "horario_confirmacao": (self.horario_confirmacao.strftime('%H:%M:%S')
+                                        if self.horario_confirmacao else None),
+                "atraso_minutos": round(self.atraso_segundos / 60, 1) if self.atraso_segundos is not None else None
+            }
+        return self._json
+
+    def para_json_bytes(self):
+        """O mesmo de `para_json()`, já codificado - pedaço pronto para serializacao.montar"""
+        if self._json_bytes is None:
+            self._json_bytes = Fragmento(codificar(self.para_json()))
+        return self._json_bytes
+
+
+def ler_saidas(linhas):
+    """Linhas cruas de SELECT COLUNAS_SAIDA → lista de SaidaCarro"""
+    return [SaidaCarro(*linha) for linha in linhas]
+
+
+class ConexaoDoPool:
+    """🆕 NOVO: Embrulha uma conexão do pool - `close()` devolve ao pool em vez de fechar o socket.
+
+    Assim todo o código que já faz `conexao = self.connect()` ... `conexao.close()`
+    continua igual e passa a reaproveitar as conexões.
+    """
+
+    def __init__(self, pool, conexao_real):
+        self._pool = pool
+        self._conexao = conexao_real
+        self._devolvida = False
+
+    def __getattr__(self, nome):
+        return getattr(self._conexao, nome)
+
+    def close(self):
+        if not self._devolvida:
+            self._devolvida = True
+            self._pool.devolver(self._conexao)
+
+    def descartar(self):
+        """🆕 NOVO: Fecha de verdade (ex.: resultado sem buffer lido pela metade) - não volta ao pool"""
+        if not self._devolvida:
+            self._devolvida = True
+            self._pool.devolver(self._conexao, descartar=True)
+
+    def __del__(self):
+        # Rede de segurança: caminhos de erro que esquecem o close() não podem vazar vagas do pool
+        self.close()
+
+
+class PoolConexoes:
+    """🆕 NOVO: Pool de conexões MySQL com limite de tamanho, health check e limpeza de ociosas
+
+    - `tamanho_maximo`: nunca abre mais que isso ao mesmo tempo (quem chegar depois espera)
+    - `tempo_espera`: quanto tempo esperar por uma conexão livre antes de dar erro
+    - `tempo_ocioso_maximo`: conexões paradas há mais tempo que isso são fechadas
+    - `intervalo_health_check`: conexões ociosas há mais tempo que isso levam um ping antes de sair do pool
+    """
+
+    def __init__(self, config, tamanho_maximo=5, tempo_espera=10, tempo_ocioso_maximo=300,
+                 intervalo_health_check=30):
+        self.config = config
+        self.tamanho_maximo = tamanho_maximo
+        self.tempo_espera = tempo_espera
+        self.tempo_ocioso_maximo = tempo_ocioso_maximo
+        self.intervalo_health_check = intervalo_health_check
+
+        self.condicao = threading.Condition()
+        self.ociosas = []  # lista de (conexao, momento_em_que_voltou_ao_pool)
+        self.em_uso = 0
+
+        # Métricas
+        self.criadas = 0
+        self.descartadas = 0
+        self.retiradas = 0
+        self.esperas = 0
+        self.tempo_espera_total = 0.0
+        self.tempo_espera_maximo = 0.0
+
+    def obter(self):
+        """Retira uma conexão saudável do pool (ou cria uma nova, se couber)"""
+        inicio = relogio.monotonic()
+        prazo = inicio + self.tempo_espera
+
+        with self.condicao:
+            self.reciclar_ociosas()
+            teve_que_esperar = False
+
+            while not self.ociosas and self.em_uso >= self.tamanho_maximo:
+                restante = prazo - relogio.monotonic()
+                if restante <= 0:
+                    raise mysql.connector.errors.PoolError(
+                        f"Nenhuma conexão livre no pool após {self.tempo_espera}s")
+                teve_que_esperar = True
+                self.condicao.wait(restante)
+
+            if self.ociosas:
+                conexao, devolvida_em = self.ociosas.pop()
+            else:
+                conexao, devolvida_em = None, None
+            self.em_uso += 1
+
+            espera = relogio.monotonic() - inicio
+            self.retiradas += 1
+            if teve_que_esperar:
+                self.esperas += 1
+            self.tempo_espera_total += espera
+            self.tempo_espera_maximo = max(self.tempo_espera_maximo, espera)
+
+        # Conexão (nova ou checagem) fora do lock para não travar o pool inteiro
+        try:
+            if conexao is not None and not self.conexao_saudavel(conexao, devolvida_em):
+                self.fechar_silenciosamente(conexao)
+                conexao = None
+
+            if conexao is None:
+                conexao = mysql.connector.connect(**self.config)
+                with self.condicao:
+                    self.criadas += 1
+        except Exception:
+            with self.condicao:
+                self.em_uso -= 1
+                self.condicao.notify()
+            raise
+
+        return ConexaoDoPool(self, conexao)
+
+    def conexao_saudavel(self, conexao, devolvida_em):
+        """Health check na retirada: só faz ping se a conexão ficou parada por um tempo"""
+        if relogio.monotonic() - devolvida_em < self.intervalo_health_check:
+            return True
+        try:
+            conexao.ping(reconnect=False)
+            return True
+        except Exception:
+            logger.warning("🔌 Conexão do pool não respondeu ao ping, abrindo outra")
+            return False
+
+    def devolver(self, conexao, descartar=False):
+        """Recebe a conexão de volta; descarta se estiver quebrada (ou se pedirem)"""
+        reaproveitar = not descartar
+        try:
+            # Nada de transação pela metade indo para o próximo usuário
+            # (`in_transaction` é controlado pelo cliente, não custa ida ao banco)
+            if reaproveitar and conexao.in_transaction:
+                conexao.rollback()
+        except Exception:
+            reaproveitar = False
+
+        if not reaproveitar:
+            self.fechar_silenciosamente(conexao)
+
+        with self.condicao:
+            self.em_uso -= 1
+            if reaproveitar:
+                self.ociosas.append((conexao, relogio.monotonic()))
+            else:
+                self.descartadas += 1
+            self.condicao.notify()
+
+    def reciclar_ociosas(self):
+        """Fecha conexões paradas há mais que `tempo_ocioso_maximo` (chamar com a condição travada)"""
+        agora = relogio.monotonic()
+        manter = []
+        for conexao, devolvida_em in self.ociosas:
+            if agora - devolvida_em > self.tempo_ocioso_maximo:
+                self.fechar_silenciosamente(conexao)
+                self.descartadas += 1
+            else:
+                manter.append((conexao, devolvida_em))
+        self.ociosas = manter
+
+    def fechar_silenciosamente(self, conexao):
+        try:
+            conexao.close()
+        except Exception:
+            pass
+
+    def metricas(self):
+        """Números do pool para o endpoint /metricas-pool"""
+        with self.condicao:
+            return {
+                'tamanho_maximo': self.tamanho_maximo,
+                'em_uso': self.em_uso,
+                'ociosas': len(self.ociosas),
+                'criadas': self.criadas,
+                'descartadas': self.descartadas,
+                'retiradas': self.retiradas,
+                'esperas': self.esperas,
+                'tempo_espera_medio_ms': round(1000 * self.tempo_espera_total / self.retiradas, 2) if self.retiradas else 0.0,
+                'tempo_espera_maximo_ms': round(1000 * self.tempo_espera_maximo, 2)
+            }
+
+
+SESSAO_PADRAO = 'padrao'
+
+
+class ExportacoesEsgotadas(Exception):
+    """🆕 NOVO: Todas as vagas de exportação (EXPORTACOES_SIMULTANEAS) estão em uso"""
+
+
+class LinhaSemVaga(Exception):
+    """🆕 NOVO: A linha não aceita mais um carro (fora do horário de operação ou capacidade esgotada)"""
+
+
+class EstadoSessao:
+    """🆕 NOVO: Estado de uma sessão do quadro (um ponto com seu fiscal, data, intervalos e cache)
+
+    Cada ponto rodando o quadro tem a sua; quem não informa sessão usa a 'padrao'.
+    O lock é da sessão: pontos diferentes não esperam um pelo outro.
+    """
+
+    def __init__(self, id_sessao):
+        self.id = id_sessao
+        self.fiscal_atual = None
+        self.data_atual = None
+        self.linha_atual = None  # Sempre será None agora
+        self.intervalo_atual = 8  # Intervalo padrão em minutos (MANTIDO para compatibilidade)
+
+        # Intervalos específicos por linha - 🆕 só os que a sessão alterou; o resto vem da tabela linhas
+        self.intervalos_por_linha = {}
+
+        self.lock = threading.RLock()
+        self.cache_quadro = None
+        self.cache_geracao = 0
+        self.versao_quadro = 0
+        self.ultimo_uso = relogio.monotonic()
+
+
+def campo_da_sessao(nome):
+    """Atributo do DatabaseManager que, na verdade, é da sessão da requisição atual (ver usar_sessao)"""
+    return property(lambda self: getattr(self.sessao_atual(), nome),
+                    lambda self, valor: setattr(self.sessao_atual(), nome, valor))
 
 
 class DatabaseManager:
+    # 🆕 Paginação do histórico (/listar-todos e /consultar)
+    TAMANHO_PAGINA_PADRAO = int(os.environ.get('TAMANHO_PAGINA', 100))
+    TAMANHO_PAGINA_MAXIMO = 500
+
+    # 🆕 SQL das consultas mais frequentes. Quem consulta e o verificar_indices (EXPLAIN) usam o MESMO texto,
+    # assim a verificação vale para a consulta que roda de verdade (índice e ORDER BY)
+    SQL_QUADRO_SESSAO = f"""SELECT {COLUNAS_SAIDA} FROM saida_carros 
+                 WHERE nome_fiscal = %s AND data_trabalho = %s
+                 ORDER BY linha ASC, horario_saida ASC"""
+    SQL_PENDENTES_LINHA = """SELECT id, numero_carro, horario_saida FROM saida_carros 
+                              WHERE nome_fiscal = %s AND data_trabalho = %s 
+                              AND linha = %s AND saida_confirmada = FALSE
+                              ORDER BY horario_saida ASC"""
+    SQL_RESUMO_PERIODO = """SELECT data_trabalho, linha, nome_fiscal, total_saidas, confirmadas, 
+                            soma_intervalos_segundos, quantidade_intervalos 
+                     FROM resumo_diario 
+                     WHERE data_trabalho >= %s AND data_trabalho <= %s"""
+    ORDEM_HISTORICO = " ORDER BY data_trabalho DESC, horario_saida ASC, id ASC"
+    ORDEM_EXPORTACAO = " ORDER BY data_trabalho ASC, horario_saida ASC, id ASC"
+
+    # 🆕 Máximo de carros/ids por requisição nos endpoints em lote (/adicionar-lote, /confirmar-saida-lote...)
+    MAX_LOTE = 200
+
+    # 🆕 Estado do quadro: cada um destes é da sessão em uso na thread (self.fiscal_atual = fiscal da sessão
+    # de quem fez a requisição). Trocar de sessão só com usar_sessao / na_sessao.
+    fiscal_atual = campo_da_sessao('fiscal_atual')
+    data_atual = campo_da_sessao('data_atual')
+    linha_atual = campo_da_sessao('linha_atual')
+    intervalo_atual = campo_da_sessao('intervalo_atual')
+    intervalos_por_linha = campo_da_sessao('intervalos_por_linha')
+    lock = campo_da_sessao('lock')
+    cache_quadro = campo_da_sessao('cache_quadro')
+    cache_geracao = campo_da_sessao('cache_geracao')
+    versao_quadro = campo_da_sessao('versao_quadro')
+
     def __init__(self):
         self.config = {
             'host': 'prancheta-db.cgz4mmcgy3ns.us-east-1.rds.amazonaws.com',
@@ -10,135 +392,669 @@ class DatabaseManager:
             'password': 'awsm1944',
             'database': 'prancheta_db',
         }
-        self.fiscal_atual = None
-        self.data_atual = None
-        self.linha_atual = None  # Sempre será None agora
-        self.intervalo_atual = 8  # Intervalo padrão em minutos (MANTIDO para compatibilidade)
 
-        # 🆕 NOVO: Intervalos específicos por linha
-        self.intervalos_por_linha = {
-            'Centro x Vila Verde': 8,  # Padrão 8 minutos
-            'Centro x Rasa': 8  # Padrão 8 minutos
-        }
+        # 🆕 NOVO: Pool de conexões (abrir conexão TCP+TLS com o RDS era o custo principal de cada requisição)
+        self.pool = PoolConexoes(
+            self.config,
+            tamanho_maximo=int(os.environ.get('DB_POOL_TAMANHO', 5)),
+            tempo_espera=int(os.environ.get('DB_POOL_ESPERA', 10)),
+            tempo_ocioso_maximo=int(os.environ.get('DB_POOL_OCIOSO', 300))
+        )
+
+        # 🆕 NOVO: Exportações (/exportar, /analise) seguram a conexão durante todo o download, no ritmo do
+        # cliente. Por isso usam conexão própria, fora do pool, e no máximo EXPORTACOES_SIMULTANEAS de cada vez:
+        # cliente lento exportando não tira conexão do quadro.
+        self.vagas_exportacao = threading.BoundedSemaphore(int(os.environ.get('EXPORTACOES_SIMULTANEAS', 2)))
+
+        # 🆕 NOVO: Sessões do quadro por id (cookie/cabeçalho da requisição), cada uma com seu EstadoSessao.
+        # A sessão de quem está sendo atendido fica num threading.local (ver usar_sessao).
+        self.sessoes = {SESSAO_PADRAO: EstadoSessao(SESSAO_PADRAO)}
+        self.lock_sessoes = threading.Lock()
+        self.local = threading.local()
+        self.max_sessoes = int(os.environ.get('MAX_SESSOES', 20))
+
+        # 🆕 NOVO: Fotos das sessões para sessoes_ativas, gravadas por uma thread só (gravar_sessoes),
+        # fora do lock da sessão: banco lento não segura as requisições do quadro
+        self.fila_sessoes = queue.Queue()
+        self.gravador_sessoes = None
+
+        # 🆕 NOVO: O servidor atende várias requisições ao mesmo tempo (pool de threads).
+        # Toda alteração do estado da sessão e toda definição de horário passa pelo lock da sessão (self.lock),
+        # para dois carros não receberem o mesmo horário nem o cabeçalho mudar no meio de uma conta.
+
+        # 🆕 NOVO: Cache do quadro da sessão (o que /listar-por-linha mostra), em self.cache_quadro
+        # Guarda {'chave': (fiscal, data), 'registros': [...], 'por_linha': {linha: [...]}, 'por_id': {...}}
+        # e é trocado inteiro a cada mudança, então quem está lendo nunca vê um quadro pela metade.
+        # self.cache_geracao muda a cada invalidação, para uma leitura antiga não sobrescrever o cache novo.
+
+        # 🆕 NOVO: Versão do quadro (self.versao_quadro, por sessão) - sobe a cada alteração (carros,
+        # intervalos, cabeçalho). Vira o ETag dos endpoints de polling. O id da instância entra junto para um
+        # restart do servidor (versão volta a 0) nunca bater com uma versão antiga do navegador.
+        # versao_global soma as alterações de todas as sessões (validade do cache das estatísticas).
+        self.id_instancia = format(int(relogio.time() * 1000), 'x')
+        self.versao_global = 0
+
+        # 🆕 NOVO: Quem quer saber das alterações do quadro (ex.: canal /eventos do servidor).
+        # Cada ouvinte é chamado como ouvinte(tipo, dados, versao, id_sessao) e NÃO pode bloquear.
+        self.ouvintes_mutacao = []
+
+        # 🆕 NOVO: Cache das estatísticas por (data_inicio, data_fim), o mais antigo sai primeiro (LRU).
+        # Período só com dias fechados não expira (muda só quando o resumo desses dias é refeito);
+        # período com o dia aberto vale enquanto o quadro não mudar e por no máximo ESTATISTICAS_TTL segundos.
+        self.cache_estatisticas = OrderedDict()
+        self.cache_estatisticas_maximo = 128
+        self.cache_estatisticas_ttl = int(os.environ.get('ESTATISTICAS_TTL', 60))
+        self.cache_estatisticas_geracao = 0
+        self.lock_estatisticas = threading.Lock()
+
+        # 🆕 NOVO: Cadastro de linhas (tabela linhas) em memória: {nome: config}, na ordem de exibição.
+        # Carregado no primeiro uso e descartado a cada alteração pelo /linhas; None = ainda não carregado.
+        self.cache_linhas = None
+        self.cache_linhas_geracao = 0
+        self.ultimas_linhas = None  # última leitura que deu certo, para quando o banco falhar
+        self.lock_linhas = threading.Lock()
 
     def connect(self):
-        return mysql.connector.connect(**self.config)
+        """Retorna uma conexão do pool (feche com `close()` normalmente, ela volta para o pool)"""
+        return self.pool.obter()
+
+    # ========== 🆕 SESSÕES ==========
+
+    def usar_sessao(self, id_sessao):
+        """Escolhe a sessão das próximas chamadas NESTA thread (cria se ainda não existe)
+
+        Retorna False se o limite de sessões (MAX_SESSOES) foi atingido.
+        """
+        id_sessao = id_sessao or SESSAO_PADRAO
+        with self.lock_sessoes:
+            estado = self.sessoes.get(id_sessao)
+            if estado is None:
+                if len(self.sessoes) >= self.max_sessoes:
+                    # Abre espaço tirando sessões sem cabeçalho e paradas há mais de um minuto
+                    limite = relogio.monotonic() - 60
+                    for vazia in [i for i, e in self.sessoes.items()
+                                  if i != SESSAO_PADRAO and not e.fiscal_atual and e.ultimo_uso < limite]:
+                        del self.sessoes[vazia]
+                if len(self.sessoes) >= self.max_sessoes:
+                    logger.warning(f"⚠️ Limite de {self.max_sessoes} sessões atingido, recusando '{id_sessao}'")
+                    return False
+                estado = self.sessoes[id_sessao] = EstadoSessao(id_sessao)
+                logger.info(f"🗂️ Nova sessão: {id_sessao}")
+            estado.ultimo_uso = relogio.monotonic()
+        self.local.sessao = estado
+        return True
+
+    def sessao_atual(self):
+        """EstadoSessao em uso nesta thread (a 'padrao' se nenhuma foi escolhida)"""
+        estado = getattr(self.local, 'sessao', None)
+        return estado if estado is not None else self.sessoes[SESSAO_PADRAO]
+
+    @contextmanager
+    def na_sessao(self, estado):
+        """Executa um trecho em outra sessão e volta para a anterior"""
+        anterior = getattr(self.local, 'sessao', None)
+        self.local.sessao = estado
+        try:
+            yield estado
+        finally:
+            self.local.sessao = anterior
+
+    def listar_sessoes(self):
+        """Cópia da lista de sessões (para percorrer sem segurar o lock)"""
+        with self.lock_sessoes:
+            return list(self.sessoes.values())
+
+    def datas_sessoes_abertas(self):
+        """Datas (texto) com quadro aberto em alguma sessão - essas são lidas ao vivo nas estatísticas"""
+        return tuple(sorted({str(e.data_atual) for e in self.listar_sessoes() if e.fiscal_atual and e.data_atual}))
 
     def cabecalho_prancheta(self, nome_fiscal, data_atual):
-        """Cabeçalho simplificado - apenas fiscal e data"""
-        self.fiscal_atual = nome_fiscal
-        self.data_atual = data_atual
-        self.linha_atual = None  # Linha será definida por carro
+        """Cabeçalho simplificado - apenas fiscal e data
+
+        🆕 O mesmo quadro (fiscal + data) não pode ficar aberto em duas sessões: ValueError.
+        """
+        estado = self.sessao_atual()
+        with self.lock:
+            with self.lock_sessoes:
+                for outra in self.sessoes.values():
+                    if outra is not estado and \
+                            (outra.fiscal_atual, str(outra.data_atual)) == (nome_fiscal, str(data_atual)):
+                        raise ValueError(f"O quadro de {nome_fiscal} em {data_atual} já está aberto na sessão '{outra.id}'")
+
+                self.fiscal_atual = nome_fiscal
+                self.data_atual = data_atual
+            self.linha_atual = None  # Linha será definida por carro
+            self.invalidar_cache_quadro('sessao_alterada', {'fiscal': nome_fiscal, 'data': data_atual})
+            self.salvar_sessao()
+
+        logger.info(f"Cabeçalho definido: {nome_fiscal} - {data_atual}")
+
+    def obter_cabecalho(self):
+        """🆕 NOVO: Retorna (fiscal, data) lidos juntos, sem risco de pegar metade de um cabeçalho novo"""
+        with self.lock:
+            return self.fiscal_atual, self.data_atual
+
+    def salvar_sessao(self):
+        """🆕 NOVO: Grava cabeçalho e intervalos da sessão atual em sessoes_ativas (sem cabeçalho: apaga)
+
+        Aqui só se tira a foto do estado, sob o lock da sessão, e ela entra na fila na mesma ordem das
+        alterações; o REPLACE/DELETE fica com a thread gravar_sessoes. Falha na gravação não desfaz a
+        alteração - a sessão só não volta sozinha depois de um restart.
+        """
+        estado = self.sessao_atual()
+        with self.lock:
+            self.fila_sessoes.put((estado.id, estado.fiscal_atual, estado.data_atual, estado.intervalo_atual,
+                                   json.dumps(estado.intervalos_por_linha, ensure_ascii=False)))
+
+        with self.lock_sessoes:
+            if self.gravador_sessoes is None:
+                self.gravador_sessoes = threading.Thread(target=self.gravar_sessoes, name='gravador-sessoes',
+                                                         daemon=True)
+                self.gravador_sessoes.start()
+
+    def gravar_sessoes(self):
+        """🆕 NOVO: Thread que grava em sessoes_ativas as fotos de salvar_sessao, na ordem da fila"""
+        while True:
+            fotos = [self.fila_sessoes.get()]
+            while True:
+                try:
+                    fotos.append(self.fila_sessoes.get_nowait())
+                except queue.Empty:
+                    break
+
+            # Várias fotos da mesma sessão acumuladas: só a mais nova importa
+            ultimas = {foto[0]: foto for foto in fotos}
+            conexao = None
+            try:
+                conexao = self.connect()
+                cursor = conexao.cursor()
+                for id_sessao, fiscal, data, intervalo, intervalos in ultimas.values():
+                    if fiscal and data:
+                        cursor.execute(
+                            """REPLACE INTO sessoes_ativas
+                               (id_sessao, nome_fiscal, data_trabalho, intervalo_atual, intervalos_por_linha, atualizado_em)
+                               VALUES (%s, %s, %s, %s, %s, NOW())""",
+                            (id_sessao, fiscal, data, intervalo, intervalos))
+                    else:
+                        cursor.execute("DELETE FROM sessoes_ativas WHERE id_sessao = %s", (id_sessao,))
+                conexao.commit()
+                cursor.close()
+                conexao.close()
+            except Exception as e:
+                logger.warning(f"⚠️ Não foi possível salvar a(s) sessão(ões) {', '.join(ultimas)}: {str(e)}")
+                if conexao is not None:
+                    conexao.close()  # volta ao pool, que desfaz a transação pela metade
+
+    def carregar_sessoes_salvas(self):
+        """🆕 NOVO: Restaura as sessões de sessoes_ativas (início do servidor) e já monta o quadro de cada uma
+
+        Os quadros de todas as sessões vêm numa consulta só. Retorna quantas sessões voltaram.
+        """
+        inicio = relogio.monotonic()
+        try:
+            conexao = self.connect()
+            cursor = conexao.cursor()
+
+            cursor.execute("""SELECT id_sessao, nome_fiscal, data_trabalho, intervalo_atual, intervalos_por_linha
+                              FROM sessoes_ativas ORDER BY atualizado_em DESC""")
+            salvas = cursor.fetchall()
+
+            # Respeita MAX_SESSOES como usar_sessao: voltam as mais recentes, as demais ficam só na tabela
+            with self.lock_sessoes:
+                ocupadas = set(self.sessoes)
+            estados = {}
+            for id_sessao, nome_fiscal, data_trabalho, intervalo_atual, intervalos_por_linha in salvas:
+                if id_sessao not in ocupadas and len(ocupadas) >= self.max_sessoes:
+                    logger.warning(f"⚠️ Limite de {self.max_sessoes} sessões atingido, sessão '{id_sessao}' não restaurada")
+                    continue
+                ocupadas.add(id_sessao)
+                estado = EstadoSessao(id_sessao)
+                estado.fiscal_atual = nome_fiscal
+                estado.data_atual = data_trabalho.isoformat() if hasattr(data_trabalho, 'isoformat') else str(data_trabalho)
+                estado.intervalo_atual = intervalo_atual
+                estado.intervalos_por_linha.update(json.loads(intervalos_por_linha or '{}'))
+                estados[(estado.fiscal_atual, estado.data_atual)] = estado
+
+            if estados:
+                condicao = ' OR '.join(['(nome_fiscal = %s AND data_trabalho = %s)'] * len(estados))
+                cursor.execute(f"""SELECT {COLUNAS_SAIDA} FROM saida_carros
+                                   WHERE {condicao}
+                                   ORDER BY linha ASC, horario_saida ASC""",
+                               [valor for chave in estados for valor in chave])
+                por_quadro = {chave: [] for chave in estados}
+                for registro in ler_saidas(cursor.fetchall()):
+                    data = registro.data_trabalho
+                    chave = (registro.nome_fiscal, data.isoformat() if hasattr(data, 'isoformat') else str(data))
+                    if chave in por_quadro:
+                        por_quadro[chave].append(registro)
+                for chave, estado in estados.items():
+                    estado.cache_quadro = self.montar_cache_quadro(chave, por_quadro[chave])
+
+            cursor.close()
+            conexao.close()
+
+            with self.lock_sessoes:
+                for estado in estados.values():
+                    self.sessoes[estado.id] = estado
+
+            logger.info(f"🗂️ {len(estados)} sessão(ões) restaurada(s) em {1000 * (relogio.monotonic() - inicio):.0f} ms")
+            return len(estados)
+
+        except Exception as e:
+            logger.warning(f"⚠️ Sessões salvas não foram restauradas: {str(e)}")
+            return 0
 
-        print(f"Cabeçalho definido: {self.fiscal_atual} - {self.data_atual}")
+    # ========== 🆕 CACHE DO QUADRO DA SESSÃO ==========
+
+    def registrar_mutacao(self, tipo='quadro_alterado', dados=None):
+        """Sobe a versão do quadro e avisa os ouvintes.
+
+        Chamar depois de TODA alteração que muda o que os painéis mostram.
+        `tipo` e `dados` descrevem a alteração (ex.: 'saida_confirmada', {'id': 12}).
+        """
+        with self.lock:
+            self.versao_quadro += 1
+            versao = self.versao_quadro
+            with self.lock_sessoes:
+                self.versao_global += 1
+            id_sessao = self.sessao_atual().id
+
+            for ouvinte in self.ouvintes_mutacao:
+                try:
+                    ouvinte(tipo, dados or {}, versao, id_sessao)
+                except Exception as e:
+                    logger.error(f"❌ Erro ao avisar ouvinte do quadro: {str(e)}")
+
+    def adicionar_ouvinte_mutacao(self, ouvinte):
+        """🆕 NOVO: Registra uma função chamada a cada alteração do quadro (de qualquer sessão)"""
+        with self.lock_sessoes:
+            self.ouvintes_mutacao.append(ouvinte)
+
+    def obter_etag_quadro(self):
+        """ETag correspondente à versão atual do quadro (da sessão)"""
+        estado = self.sessao_atual()
+        return f'"{self.id_instancia}-{estado.id}-{estado.versao_quadro}"'
+
+    def montar_cache_quadro(self, chave, registros):
+        """Monta o cache a partir da lista de registros (ordenada por linha e horário)
+
+        🆕 Junto vai a agenda de saídas por linha, usada por calcular_proximo_horario_linha:
+        {linha: {'pendentes': [horários em ordem], 'ultimo_confirmado': horário ou None}}
+        Como os registros já vêm ordenados, o "último" de cada fila é sempre o maior horário.
+        """
+        por_linha = {}
+        agenda = {}
+        for registro in registros:
+            linha = registro.linha
+            por_linha.setdefault(linha, []).append(registro)
+
+            fila = agenda.setdefault(linha, {'pendentes': [], 'ultimo_confirmado': None})
+            horario = para_time(registro.horario_saida)
+            if horario is None:
+                continue
+            if registro.saida_confirmada:
+                fila['ultimo_confirmado'] = horario
+            else:
+                fila['pendentes'].append(horario)
+
+        return {'chave': chave, 'registros': registros, 'por_linha': por_linha, 'agenda': agenda,
+                'por_id': {registro.id: registro for registro in registros}}
+
+    def obter_quadro(self):
+        """Retorna o cache do quadro da sessão atual, buscando no banco só quando não há cache válido"""
+        fiscal, data = self.obter_cabecalho()
+        if not fiscal or not data:
+            return None
+
+        cache = self.cache_quadro
+        if cache is not None and cache['chave'] == (fiscal, data):
+            return cache
+
+        geracao = self.cache_geracao
+
+        conexao = self.connect()
+        cursor = conexao.cursor()
+
+        cursor.execute(self.SQL_QUADRO_SESSAO, (fiscal, data))
+        registros = ler_saidas(cursor.fetchall())
+
+        cursor.close()
+        conexao.close()
+
+        cache = self.montar_cache_quadro((fiscal, data), registros)
+
+        with self.lock:
+            # Se alguém alterou o quadro enquanto buscávamos, não guardar dados velhos
+            if geracao == self.cache_geracao:
+                self.cache_quadro = cache
+
+        logger.debug(f"📦 Quadro carregado do banco: {len(registros)} carros")
+        return cache
+
+    def adicionar_ao_cache_quadro(self, chave, novos, tipo, dados):
+        """Write-through de um INSERT: coloca os carros novos (lista) no cache sem buscar o quadro de novo"""
+        with self.lock:
+            self.cache_geracao += 1
+            self.registrar_mutacao(tipo, dados)
+            cache = self.cache_quadro
+            if cache is None or cache['chave'] != chave or not all(isinstance(r.data_trabalho, date) for r in novos):
+                self.cache_quadro = None
+                return
+
+            registros = sorted(cache['registros'] + novos,
+                               key=lambda r: (r.linha, r.horario_saida or timedelta(0)))
+            self.cache_quadro = self.montar_cache_quadro(cache['chave'], registros)
+
+    def invalidar_cache_quadro(self, tipo='quadro_alterado', dados=None):
+        """Descarta o cache do quadro (a próxima leitura busca no banco)"""
+        with self.lock:
+            self.cache_geracao += 1
+            self.cache_quadro = None
+            self.registrar_mutacao(tipo, dados)
+
+    def invalidar_todas_sessoes(self, tipo='quadro_alterado', dados=None):
+        """🆕 NOVO: Descarta o cache do quadro de todas as sessões (ex.: edição no histórico)"""
+        for estado in self.listar_sessoes():
+            with self.na_sessao(estado):
+                self.invalidar_cache_quadro(tipo, dados)
+
+    def sessoes_do_registro(self, id_registro):
+        """🆕 NOVO: Sessões cujo quadro pode ter o registro
+
+        A que tem o registro no cache; se nenhuma tem, as sessões abertas ainda sem cache.
+        """
+        return self.sessoes_dos_registros([id_registro])
+
+    def sessoes_dos_registros(self, ids):
+        """🆕 NOVO: Como sessoes_do_registro, para vários ids (sessões sem cache entram se algum id não foi achado)"""
+        ids = {int(i) for i in ids}
+        abertas = [e for e in self.listar_sessoes() if e.fiscal_atual]
+        com_registro = []
+        achados = set()
+        for estado in abertas:
+            cache = estado.cache_quadro
+            if cache is not None and not ids.isdisjoint(cache['por_id']):
+                com_registro.append(estado)
+                achados.update(ids.intersection(cache['por_id']))
+        if achados == ids:
+            return com_registro
+        return com_registro + [e for e in abertas if e.cache_quadro is None]
+
+    def registros_em_cache(self, ids):
+        """🆕 NOVO: {id: SaidaCarro} dos ids que estão no quadro (em cache) de alguma sessão"""
+        encontrados = {}
+        for estado in self.listar_sessoes():
+            cache = estado.cache_quadro
+            if cache is not None:
+                for id_registro in ids:
+                    registro = cache['por_id'].get(int(id_registro))
+                    if registro is not None:
+                        encontrados[int(id_registro)] = registro
+        return encontrados
+
+    def atualizar_cache_quadro(self, id_registro, tipo, alterar=None, remover=False):
+        """Write-through: aplica no cache uma alteração já gravada no banco
+
+        `alterar` é um dict {campo: novo_valor} (campos de SaidaCarro).
+        🆕 Vale para a sessão que mostra o registro, que não precisa ser a de quem fez a alteração.
+        """
+        for estado in self.sessoes_do_registro(id_registro):
+            with self.na_sessao(estado):
+                self.atualizar_cache_quadro_da_sessao(id_registro, tipo, alterar, remover)
+
+    def atualizar_cache_quadro_da_sessao(self, id_registro, tipo, alterar=None, remover=False):
+        """Parte de atualizar_cache_quadro que mexe no cache da sessão atual"""
+        self.atualizar_cache_quadro_lote_da_sessao({int(id_registro): alterar}, tipo, {'id': int(id_registro)}, remover)
+
+    def atualizar_cache_quadro_lote_da_sessao(self, alteracoes, tipo, dados, remover=False):
+        """🆕 NOVO: Write-through de vários registros no cache da sessão atual, montando o quadro uma vez só
+
+        `alteracoes` é {id: {campo: novo_valor}} (com remover=True só os ids importam).
+        """
+        with self.lock:
+            self.cache_geracao += 1
+            self.registrar_mutacao(tipo, dados)
+            cache = self.cache_quadro
+            if cache is None:
+                return
+
+            registros = []
+            for registro in cache['registros']:
+                if registro.id in alteracoes:
+                    if remover:
+                        continue
+                    registro = registro.alterado(**alteracoes[registro.id])
+                registros.append(registro)
+
+            self.cache_quadro = self.montar_cache_quadro(cache['chave'], registros)
+
+    def obter_registro_do_cache(self, id_registro):
+        """Registro da sessão atual direto do cache (None se não estiver lá)"""
+        cache = self.cache_quadro
+        if cache is None:
+            return None
+        return cache['por_id'].get(int(id_registro))
+
+    # ========== 🆕 CADASTRO DE LINHAS ==========
+
+    CAMPOS_LINHA = ('nome', 'intervalo_padrao', 'hora_inicio', 'hora_fim', 'capacidade', 'ativa', 'ordem')
+
+    def obter_linhas(self):
+        """Cadastro de linhas {nome: config}, do cache (lê a tabela só se ainda não carregou)
+
+        Não altere o dict devolvido: ele é o próprio cache. Se o banco falhar, devolve a última leitura
+        boa (ou propaga o erro, se nunca leu): com {} toda linha viraria "não reconhecida".
+        """
+        linhas = self.cache_linhas
+        if linhas is not None:
+            return linhas
+
+        with self.lock_linhas:
+            geracao = self.cache_linhas_geracao
+        try:
+            conexao = self.connect()
+            cursor = conexao.cursor()
+            cursor.execute(f"SELECT {', '.join(self.CAMPOS_LINHA)} FROM linhas ORDER BY ordem ASC, nome ASC")
+            linhas = {}
+            for valores in cursor.fetchall():
+                config = dict(zip(self.CAMPOS_LINHA, valores))
+                for campo in ('hora_inicio', 'hora_fim'):
+                    if config[campo] is not None:
+                        config[campo] = para_time(config[campo]).strftime('%H:%M')
+                config['ativa'] = bool(config['ativa'])
+                linhas[config['nome']] = config
+            cursor.close()
+            conexao.close()
+        except Exception as e:
+            if self.ultimas_linhas is None:
+                raise
+            logger.error(f"❌ Erro ao carregar linhas, usando o último cadastro lido: {str(e)}")
+            return self.ultimas_linhas
+
+        with self.lock_linhas:
+            self.ultimas_linhas = linhas
+            # Se alguém alterou o cadastro enquanto líamos, essa leitura já está velha
+            if self.cache_linhas_geracao == geracao:
+                self.cache_linhas = linhas
+        logger.debug(f"🚏 {len(linhas)} linha(s) carregada(s)")
+        return linhas
+
+    def linhas_ativas(self):
+        """Nomes das linhas em operação, na ordem de exibição"""
+        return [nome for nome, config in self.obter_linhas().items() if config['ativa']]
+
+    def invalidar_cache_linhas(self, nome_linha):
+        """Descarta o cadastro em memória e avisa os quadros (intervalo padrão pode ter mudado)"""
+        with self.lock_linhas:
+            self.cache_linhas = None
+            self.cache_linhas_geracao += 1
+        for estado in self.listar_sessoes():
+            with self.na_sessao(estado):
+                self.registrar_mutacao('linhas_alteradas', {'linha': nome_linha})
+
+    def salvar_linha(self, nome, intervalo_padrao=8, hora_inicio=None, hora_fim=None, capacidade=None,
+                     ativa=True, ordem=0):
+        """Cria ou altera uma linha do cadastro"""
+        nome = (nome or '').strip()
+        if not nome or len(nome) > 100:
+            return {'status': 'erro', 'mensagem': 'Nome da linha deve ter entre 1 e 100 caracteres'}
+        if not isinstance(intervalo_padrao, int) or intervalo_padrao < 1 or intervalo_padrao > 60:
+            return {'status': 'erro', 'mensagem': 'Intervalo deve ser entre 1 e 60 minutos'}
+        if capacidade is not None and capacidade < 1:
+            return {'status': 'erro', 'mensagem': 'Capacidade deve ser maior que zero'}
+
+        try:
+            horas = [datetime.strptime(hora, '%H:%M').time() if hora else None for hora in (hora_inicio, hora_fim)]
+        except ValueError:
+            return {'status': 'erro', 'mensagem': 'Horário de operação deve estar no formato HH:MM'}
+        if None not in horas and horas[0] >= horas[1]:
+            return {'status': 'erro', 'mensagem': 'Início da operação deve ser antes do fim'}
+
+        try:
+            conexao = self.connect()
+            cursor = conexao.cursor()
+            cursor.execute(
+                """REPLACE INTO linhas (nome, intervalo_padrao, hora_inicio, hora_fim, capacidade, ativa, ordem)
+                   VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+                (nome, intervalo_padrao, horas[0], horas[1], capacidade, bool(ativa), ordem))
+            conexao.commit()
+            cursor.close()
+            conexao.close()
+        except Exception as e:
+            logger.error(f"❌ Erro ao salvar linha: {str(e)}")
+            return {'status': 'erro', 'mensagem': f'Erro ao salvar linha: {str(e)}'}
+
+        self.invalidar_cache_linhas(nome)
+        logger.info(f"🚏 Linha salva: {nome} ({intervalo_padrao} min)")
+        return {'status': 'sucesso', 'linha': self.obter_linhas().get(nome),
+                'mensagem': f'Linha "{nome}" salva com sucesso'}
+
+    def remover_linha(self, nome):
+        """Tira uma linha do cadastro (as saídas já registradas nela continuam no histórico)"""
+        try:
+            conexao = self.connect()
+            cursor = conexao.cursor()
+            cursor.execute("DELETE FROM linhas WHERE nome = %s", (nome,))
+            removidas = cursor.rowcount
+            conexao.commit()
+            cursor.close()
+            conexao.close()
+        except Exception as e:
+            logger.error(f"❌ Erro ao remover linha: {str(e)}")
+            return {'status': 'erro', 'mensagem': f'Erro ao remover linha: {str(e)}'}
+
+        if not removidas:
+            return {'status': 'erro', 'mensagem': f'Linha "{nome}" não encontrada'}
+
+        self.invalidar_cache_linhas(nome)
+        logger.info(f"🗑️ Linha removida: {nome}")
+        return {'status': 'sucesso', 'mensagem': f'Linha "{nome}" removida'}
 
     # 🆕 NOVAS FUNÇÕES: Gestão de Intervalos por Linha
 
     def obter_intervalo_linha(self, nome_linha):
-        """Retorna o intervalo específico de uma linha"""
-        return self.intervalos_por_linha.get(nome_linha, 8)  # Default 8 min
+        """Retorna o intervalo específico de uma linha (🆕 o da sessão ou, se não mudou, o padrão do cadastro)"""
+        intervalo = self.intervalos_por_linha.get(nome_linha)
+        if intervalo is not None:
+            return intervalo
+        config = self.obter_linhas().get(nome_linha)
+        return config['intervalo_padrao'] if config else 8  # Default 8 min
+
+    def verificar_vaga_linha(self, nome_linha, horario, aguardando):
+        """🆕 NOVO: Aplica o cadastro da linha a mais um carro saindo em `horario`, com `aguardando` na fila
+
+        Antes de hora_inicio o carro sai em hora_inicio. Depois de hora_fim, ou com `capacidade`
+        carros já aguardando, levanta LinhaSemVaga. Retorna o horário (ajustado).
+        """
+        config = self.obter_linhas().get(nome_linha) or {}
+
+        capacidade = config.get('capacidade')
+        if capacidade is not None and aguardando >= capacidade:
+            raise LinhaSemVaga(f'Linha "{nome_linha}" já tem {aguardando} carro(s) aguardando '
+                               f'(capacidade {capacidade})')
+
+        if config.get('hora_inicio'):
+            inicio = datetime.strptime(config['hora_inicio'], '%H:%M').time()
+            if horario < inicio:
+                horario = inicio
+        if config.get('hora_fim'):
+            fim = datetime.strptime(config['hora_fim'], '%H:%M').time()
+            if horario > fim:
+                raise LinhaSemVaga(f'Linha "{nome_linha}" opera até {config["hora_fim"]}: '
+                                   f'não há saída às {horario.strftime("%H:%M")}')
+        return horario
+
+    def intervalos_das_linhas(self):
+        """🆕 NOVO: {linha: intervalo} das linhas ativas (o da sessão onde ela mudou, senão o padrão)"""
+        return {nome: self.obter_intervalo_linha(nome) for nome in self.linhas_ativas()}
 
     def definir_intervalo_linha(self, nome_linha, novo_intervalo):
         """🔧 CORRIGIDO: Define intervalo específico para uma linha SEM ALTERAR HORÁRIOS DRASTICAMENTE"""
-        try:
-            if not isinstance(novo_intervalo, int) or novo_intervalo < 1 or novo_intervalo > 60:
-                return {'status': 'erro', 'mensagem': 'Intervalo deve ser entre 1 e 60 minutos'}
+        with self.lock:
+            try:
+                if not isinstance(novo_intervalo, int) or novo_intervalo < 1 or novo_intervalo > 60:
+                    return {'status': 'erro', 'mensagem': 'Intervalo deve ser entre 1 e 60 minutos'}
 
-            if nome_linha not in self.intervalos_por_linha:
-                return {'status': 'erro', 'mensagem': f'Linha "{nome_linha}" não reconhecida'}
+                if nome_linha not in self.obter_linhas():
+                    return {'status': 'erro', 'mensagem': f'Linha "{nome_linha}" não reconhecida'}
 
-            print(f"🔧 CORRIGIDO: Definindo intervalo para {nome_linha}: {novo_intervalo} minutos")
+                logger.info(f"🔧 CORRIGIDO: Definindo intervalo para {nome_linha}: {novo_intervalo} minutos")
 
-            # Salvar intervalo antigo para log
-            intervalo_antigo = self.intervalos_por_linha[nome_linha]
-            self.intervalos_por_linha[nome_linha] = novo_intervalo
+                # Salvar intervalo antigo para log
+                intervalo_antigo = self.obter_intervalo_linha(nome_linha)
+                self.intervalos_por_linha[nome_linha] = novo_intervalo
+                self.registrar_mutacao('intervalo_alterado', {'linha': nome_linha, 'intervalo': novo_intervalo})
+                self.salvar_sessao()
 
-            # 🔧 CORREÇÃO BUG 1: Recalcular horários SEM JOGAR PARA O FUTURO
-            carros_atualizados = self.recalcular_horarios_linha_especifica_corrigido(nome_linha, intervalo_antigo,
-                                                                                     novo_intervalo)
+                # 🔧 CORREÇÃO BUG 1: Recalcular horários SEM JOGAR PARA O FUTURO
+                carros_atualizados = self.recalcular_horarios_linha_especifica_corrigido(nome_linha, intervalo_antigo,
+                                                                                         novo_intervalo)
 
-            return {
-                'status': 'sucesso',
-                'linha': nome_linha,
-                'intervalo_antigo': intervalo_antigo,
-                'intervalo_novo': novo_intervalo,
-                'carros_atualizados': carros_atualizados,
-                'mensagem': f'Intervalo da linha "{nome_linha}" alterado para {novo_intervalo} minutos. {carros_atualizados} carros atualizados.'
-            }
+                return {
+                    'status': 'sucesso',
+                    'linha': nome_linha,
+                    'intervalo_antigo': intervalo_antigo,
+                    'intervalo_novo': novo_intervalo,
+                    'carros_atualizados': carros_atualizados,
+                    'mensagem': f'Intervalo da linha "{nome_linha}" alterado para {novo_intervalo} minutos. {carros_atualizados} carros atualizados.'
+                }
 
-        except Exception as e:
-            print(f"❌ Erro ao definir intervalo da linha: {str(e)}")
-            return {'status': 'erro', 'mensagem': f'Erro: {str(e)}'}
+            except Exception as e:
+                logger.error(f"❌ Erro ao definir intervalo da linha: {str(e)}")
+                return {'status': 'erro', 'mensagem': f'Erro: {str(e)}'}
 
     def recalcular_horarios_linha_especifica_corrigido(self, nome_linha, intervalo_antigo, novo_intervalo):
         """🔧 CORREÇÃO BUG 1: Recalcula horários mantendo o primeiro carro e ajustando apenas os intervalos"""
         try:
             if not self.fiscal_atual or not self.data_atual:
-                print("❌ Cabeçalho não definido, não é possível recalcular")
+                logger.error("❌ Cabeçalho não definido, não é possível recalcular")
                 return 0
 
             conexao = self.connect()
             cursor = conexao.cursor()
 
             # Buscar carros PENDENTES DA LINHA ESPECÍFICA ordenados por horário
-            sql_pendentes = """SELECT id, numero_carro, horario_saida FROM saida_carros 
-                              WHERE nome_fiscal = %s AND data_trabalho = %s 
-                              AND linha = %s AND saida_confirmada = FALSE
-                              ORDER BY horario_saida ASC"""
-
             valores = (self.fiscal_atual, self.data_atual, nome_linha)
-            cursor.execute(sql_pendentes, valores)
+            cursor.execute(self.SQL_PENDENTES_LINHA, valores)
             carros_pendentes = cursor.fetchall()
 
-            print(f"🔍 CORREÇÃO BUG 1: Carros PENDENTES da linha {nome_linha}: {len(carros_pendentes)}")
+            logger.debug(f"🔍 CORREÇÃO BUG 1: Carros PENDENTES da linha {nome_linha}: {len(carros_pendentes)}")
 
             if not carros_pendentes:
-                print(f"✅ Nenhum carro pendente da linha {nome_linha} para recalcular")
+                logger.debug(f"✅ Nenhum carro pendente da linha {nome_linha} para recalcular")
                 cursor.close()
                 conexao.close()
                 return 0
 
-            carros_atualizados = 0
-
             # 🔧 ESTRATÉGIA CORRIGIDA: Manter o primeiro horário, recalcular os seguintes
-            for i, (id_carro, numero_carro, horario_antigo) in enumerate(carros_pendentes):
-                if i == 0:
-                    # MANTER o primeiro carro no mesmo horário
-                    print(
-                        f"🔧 Mantendo PRIMEIRO carro ID {id_carro} (Carro {numero_carro}) no horário original: {horario_antigo}")
-                    continue
-
-                # Para os demais carros: usar o horário do primeiro + (posição * novo_intervalo)
-                primeiro_horario = carros_pendentes[0][2]  # horário do primeiro carro
-
-                # Converter primeiro_horario para datetime se necessário
-                if isinstance(primeiro_horario, timedelta):
-                    total_seconds = int(primeiro_horario.total_seconds())
-                    hours = total_seconds // 3600
-                    minutes = (total_seconds % 3600) // 60
-                    primeiro_horario = time(hours, minutes, 0)
-
-                if isinstance(primeiro_horario, time):
-                    primeiro_datetime = datetime.combine(datetime.now().date(), primeiro_horario)
-                    novo_horario_datetime = primeiro_datetime + timedelta(minutes=i * novo_intervalo)
-                    novo_horario_time = novo_horario_datetime.time().replace(second=0, microsecond=0)
-
-                    print(f"🔧 CORRIGIDO: ID {id_carro} (Carro {numero_carro}): {horario_antigo} → {novo_horario_time}")
-
-                    # Atualizar horário
-                    sql_update = """UPDATE saida_carros 
-                                   SET horario_saida = %s 
-                                   WHERE id = %s"""
-
-                    cursor.execute(sql_update, (novo_horario_time, id_carro))
-
-                    if cursor.rowcount == 1:
-                        carros_atualizados += 1
-                        print(f"✅ ID {id_carro} atualizado com sucesso")
+            # 🆕 Todos os horários novos vão em UM único UPDATE (antes era um UPDATE por carro)
+            novos_horarios = self.montar_horarios_recalculados(carros_pendentes, novo_intervalo)
+            carros_atualizados = self.atualizar_horarios_em_lote(cursor, novos_horarios)
 
             # Commit das alterações
             conexao.commit()
-            print(f"💾 CORREÇÃO BUG 1: Linha {nome_linha}: {carros_atualizados} carros atualizados corretamente")
+            self.invalidar_cache_quadro('horarios_recalculados', {'linha': nome_linha})
+            logger.info(f"💾 CORREÇÃO BUG 1: Linha {nome_linha}: {carros_atualizados} carros atualizados corretamente")
 
             cursor.close()
             conexao.close()
@@ -146,7 +1062,7 @@ class DatabaseManager:
             return carros_atualizados
 
         except Exception as e:
-            print(f"❌ ERRO ao recalcular horários da linha {nome_linha}: {str(e)}")
+            logger.error(f"❌ ERRO ao recalcular horários da linha {nome_linha}: {str(e)}")
             try:
                 conexao.rollback()
                 cursor.close()
@@ -155,134 +1071,121 @@ class DatabaseManager:
                 pass
             return 0
 
-    def calcular_proximo_horario_linha(self, nome_linha):
-        """🔧 CORRIGIDO: Calcula próximo horário baseado no ÚLTIMO carro DA LINHA com lógica corrigida"""
-        try:
-            conexao = self.connect()
-            cursor = conexao.cursor()
+    def montar_horarios_recalculados(self, carros_pendentes, novo_intervalo):
+        """🆕 NOVO: Calcula os novos horários dos carros pendentes (sem tocar no banco)
 
-            print(f"🔍 CORRIGIDO: Calculando próximo horário para linha: {nome_linha}")
-            print(f"🔍 Fiscal: {self.fiscal_atual}, Data: {self.data_atual}")
+        `carros_pendentes` são tuplas (id, numero_carro, horario_saida) ordenadas por horário.
+        O primeiro carro MANTÉM o horário; o carro na posição i sai em primeiro + i * novo_intervalo.
+        Retorna lista de (id, novo_horario) só para os carros a partir do segundo.
+        """
+        if not carros_pendentes:
+            return []
 
-            # 🔧 CORREÇÃO BUG 2: Verificar se há carros na sessão atual primeiro
-            sql_todos_carros = """SELECT COUNT(*) FROM saida_carros 
-                                 WHERE nome_fiscal = %s AND data_trabalho = %s"""
+        primeiro_horario = para_time(carros_pendentes[0][2])
+        logger.debug(f"🔧 Mantendo PRIMEIRO carro ID {carros_pendentes[0][0]} (Carro {carros_pendentes[0][1]}) no horário original: {primeiro_horario}")
 
-            cursor.execute(sql_todos_carros, (self.fiscal_atual, self.data_atual))
-            total_carros_sessao = cursor.fetchone()[0]
+        if not isinstance(primeiro_horario, time):
+            return []
 
-            print(f"🔍 CORREÇÃO BUG 2: Total de carros na sessão atual: {total_carros_sessao}")
+        primeiro_datetime = datetime.combine(datetime.now().date(), primeiro_horario)
+        novos_horarios = []
+        for i, (id_carro, numero_carro, horario_antigo) in enumerate(carros_pendentes[1:], start=1):
+            novo_horario = (primeiro_datetime + timedelta(minutes=i * novo_intervalo)).time().replace(second=0, microsecond=0)
+            logger.debug("🔧 CORRIGIDO: ID %s (Carro %s): %s → %s", id_carro, numero_carro, horario_antigo, novo_horario,
+                         extra=AMOSTRAR)
+            novos_horarios.append((id_carro, novo_horario))
 
-            # Se não há carros na sessão, começar do zero
-            if total_carros_sessao == 0:
-                agora = datetime.now()
-                primeiro_horario = agora + timedelta(minutes=10)
-                resultado = primeiro_horario.time().replace(second=0, microsecond=0)
-                print(f"🆕 CORREÇÃO BUG 2: Primeira sessão, começando em: {resultado}")
-                cursor.close()
-                conexao.close()
-                return resultado
+        return novos_horarios
 
-            # 🎯 PASSO 1: Verificar se há carros AGUARDANDO na linha
-            sql_aguardando = """SELECT horario_saida FROM saida_carros 
-                               WHERE nome_fiscal = %s AND data_trabalho = %s AND linha = %s
-                               AND saida_confirmada = FALSE
-                               ORDER BY horario_saida DESC 
-                               LIMIT 1"""
+    def atualizar_horarios_em_lote(self, cursor, novos_horarios, tamanho_lote=500):
+        """🆕 NOVO: Grava vários horários com UPDATE ... SET horario_saida = CASE id ... END
 
-            valores = (self.fiscal_atual, self.data_atual, nome_linha)
-            cursor.execute(sql_aguardando, valores)
-            ultimo_aguardando = cursor.fetchone()
+        Roda dentro da transação de quem chamou (o commit é de quem chamou).
+        Retorna quantos carros tiveram o horário realmente alterado (rowcount do MySQL).
+        """
+        carros_atualizados = 0
 
-            print(f"🔍 Último carro AGUARDANDO da linha {nome_linha}: {ultimo_aguardando}")
+        for inicio in range(0, len(novos_horarios), tamanho_lote):
+            lote = novos_horarios[inicio:inicio + tamanho_lote]
 
-            # Se há carro aguardando, usar ele + intervalo
-            if ultimo_aguardando and ultimo_aguardando[0]:
-                ultimo_horario = ultimo_aguardando[0]
+            casos = " ".join(["WHEN %s THEN %s"] * len(lote))
+            marcadores = ", ".join(["%s"] * len(lote))
+            sql_update = f"""UPDATE saida_carros 
+                            SET horario_saida = CASE id {casos} END 
+                            WHERE id IN ({marcadores})"""
 
-                # Converter timedelta para time se necessário
-                if isinstance(ultimo_horario, timedelta):
-                    total_seconds = int(ultimo_horario.total_seconds())
-                    hours = total_seconds // 3600
-                    minutes = (total_seconds % 3600) // 60
-                    ultimo_horario = time(hours, minutes, 0)
-                    print(f"🔧 Convertido timedelta para time: {ultimo_horario}")
+            valores = []
+            for id_carro, novo_horario in lote:
+                valores.extend((id_carro, novo_horario))
+            valores.extend(id_carro for id_carro, _ in lote)
 
-                if isinstance(ultimo_horario, time):
-                    ultimo_datetime = datetime.combine(datetime.now().date(), ultimo_horario)
-                    intervalo_linha = self.obter_intervalo_linha(nome_linha)
-                    proximo_datetime = ultimo_datetime + timedelta(minutes=intervalo_linha)
-                    proximo_horario = proximo_datetime.time().replace(second=0, microsecond=0)
-                    print(
-                        f"⏰ {nome_linha}: Último aguardando ({ultimo_horario}) + {intervalo_linha}min = {proximo_horario}")
-                    cursor.close()
-                    conexao.close()
-                    return proximo_horario
+            cursor.execute(sql_update, valores)
+            carros_atualizados += cursor.rowcount
+
+        return carros_atualizados
 
-            # 🎯 PASSO 2: Se NÃO há carros aguardando, verificar último CONFIRMADO
-            sql_confirmado = """SELECT horario_saida FROM saida_carros 
-                               WHERE nome_fiscal = %s AND data_trabalho = %s AND linha = %s
-                               AND saida_confirmada = TRUE
-                               ORDER BY horario_saida DESC 
-                               LIMIT 1"""
+    def calcular_proximo_horario_linha(self, nome_linha):
+        """🔧 CORRIGIDO: Calcula próximo horário baseado no ÚLTIMO carro DA LINHA com lógica corrigida
 
-            cursor.execute(sql_confirmado, valores)
-            ultimo_confirmado = cursor.fetchone()
+        🆕 Responde pela agenda em memória (cache do quadro), sem consultar o banco:
+        o último aguardando e o último confirmado de cada linha já ficam guardados.
+        🆕 Respeita o horário de operação e a capacidade do cadastro (LinhaSemVaga se não couber).
+        """
+        return self.verificar_vaga_linha(nome_linha, self.horario_pela_agenda(nome_linha),
+                                         self.carros_aguardando_linha(nome_linha))
 
-            print(f"🔍 Último carro CONFIRMADO da linha {nome_linha}: {ultimo_confirmado}")
+    def carros_aguardando_linha(self, nome_linha):
+        """🆕 NOVO: Quantos carros da linha estão AGUARDANDO na sessão (pela agenda em memória)"""
+        quadro = self.obter_quadro()
+        if quadro is None:
+            return 0
+        return len(quadro['agenda'].get(nome_linha, {'pendentes': []})['pendentes'])
 
+    def horario_pela_agenda(self, nome_linha):
+        """Próximo horário da linha só pela agenda (último aguardando ou confirmado + intervalo)"""
+        try:
+            quadro = self.obter_quadro()
             agora = datetime.now()
-            intervalo_linha = self.obter_intervalo_linha(nome_linha)
-            print(f"🔍 Intervalo da linha {nome_linha}: {intervalo_linha} minutos")
-            print(f"🔍 Horário atual: {agora.strftime('%H:%M:%S')}")
 
-            if ultimo_confirmado and ultimo_confirmado[0]:
-                ultimo_horario = ultimo_confirmado[0]
+            # 🔧 CORREÇÃO BUG 2: Se não há carros na sessão, começar do zero
+            if quadro is None or not quadro['registros']:
+                resultado = (agora + timedelta(minutes=10)).time().replace(second=0, microsecond=0)
+                logger.debug(f"🆕 CORREÇÃO BUG 2: Primeira sessão, começando em: {resultado}")
+                return resultado
 
-                # Converter timedelta para time se necessário
-                if isinstance(ultimo_horario, timedelta):
-                    total_seconds = int(ultimo_horario.total_seconds())
-                    hours = total_seconds // 3600
-                    minutes = (total_seconds % 3600) // 60
-                    ultimo_horario = time(hours, minutes, 0)
-                    print(f"🔧 Convertido timedelta para time: {ultimo_horario}")
+            fila = quadro['agenda'].get(nome_linha, {'pendentes': [], 'ultimo_confirmado': None})
+            intervalo_linha = self.obter_intervalo_linha(nome_linha)
 
-                if isinstance(ultimo_horario, time):
-                    ultimo_datetime = datetime.combine(datetime.now().date(), ultimo_horario)
-                    horario_esperado_datetime = ultimo_datetime + timedelta(minutes=intervalo_linha)
-                    horario_esperado = horario_esperado_datetime.time()
-
-                    print(f"🔍 Último confirmado: {ultimo_horario}")
-                    print(f"🔍 Horário esperado seria: {horario_esperado}")
-
-                    # 🔧 CORREÇÃO BUG 3: Se passou do tempo, usar agora + intervalo (não mais 1 dia depois)
-                    if agora.time() > horario_esperado:
-                        print(
-                            f"⚡ CORREÇÃO BUG 3: Carro atrasado! Horário atual ({agora.strftime('%H:%M')}) > esperado ({horario_esperado})")
-                        print(f"⚡ Usando AGORA + {intervalo_linha} minutos (evitando dia seguinte)")
-                        proximo_datetime = agora + timedelta(minutes=intervalo_linha)
-                        proximo_horario = proximo_datetime.time().replace(second=0, microsecond=0)
-                        print(f"⏰ CORRIGIDO: Novo horário é {proximo_horario} (baseado no horário atual)")
-                        cursor.close()
-                        conexao.close()
-                        return proximo_horario
-                    else:
-                        print(f"✅ Dentro do prazo, usando horário esperado: {horario_esperado}")
-                        cursor.close()
-                        conexao.close()
-                        return horario_esperado.replace(second=0, microsecond=0)
+            # 🎯 PASSO 1: Se há carro AGUARDANDO na linha, usar o último + intervalo
+            if fila['pendentes']:
+                ultimo_horario = fila['pendentes'][-1]
+                ultimo_datetime = datetime.combine(agora.date(), ultimo_horario)
+                proximo_horario = (ultimo_datetime + timedelta(minutes=intervalo_linha)).time().replace(second=0, microsecond=0)
+                logger.debug(f"⏰ {nome_linha}: Último aguardando ({ultimo_horario}) + {intervalo_linha}min = {proximo_horario}")
+                return proximo_horario
+
+            # 🎯 PASSO 2: Se NÃO há carros aguardando, usar o último CONFIRMADO
+            ultimo_horario = fila['ultimo_confirmado']
+            if ultimo_horario is not None:
+                ultimo_datetime = datetime.combine(agora.date(), ultimo_horario)
+                horario_esperado = (ultimo_datetime + timedelta(minutes=intervalo_linha)).time()
+
+                # 🔧 CORREÇÃO BUG 3: Se passou do tempo, usar agora + intervalo (não mais 1 dia depois)
+                if agora.time() > horario_esperado:
+                    proximo_horario = (agora + timedelta(minutes=intervalo_linha)).time().replace(second=0, microsecond=0)
+                    logger.debug(f"⚡ CORREÇÃO BUG 3: {nome_linha} atrasada, usando AGORA + {intervalo_linha}min = {proximo_horario}")
+                    return proximo_horario
 
-            # 🎯 PASSO 3: Primeiro carro da linha - usar horário atual + 10 minutos
-            proximo_datetime = agora + timedelta(minutes=10)
-            proximo_horario = proximo_datetime.time().replace(second=0, microsecond=0)
-            print(f"⏰ PRIMEIRO carro da linha {nome_linha}: {proximo_horario} (agora + 10 minutos)")
+                logger.debug(f"✅ {nome_linha}: Dentro do prazo, usando horário esperado: {horario_esperado}")
+                return horario_esperado.replace(second=0, microsecond=0)
 
-            cursor.close()
-            conexao.close()
+            # 🎯 PASSO 3: Primeiro carro da linha - usar horário atual + 10 minutos
+            proximo_horario = (agora + timedelta(minutes=10)).time().replace(second=0, microsecond=0)
+            logger.debug(f"⏰ PRIMEIRO carro da linha {nome_linha}: {proximo_horario} (agora + 10 minutos)")
             return proximo_horario
 
         except Exception as e:
-            print(f"❌ Erro ao calcular próximo horário da linha: {e}")
+            logger.error(f"❌ Erro ao calcular próximo horário da linha: {e}")
             agora = datetime.now()
             return (agora + timedelta(minutes=10)).time().replace(second=0, microsecond=0)
 
@@ -290,90 +1193,189 @@ class DatabaseManager:
     def inserir_dados_motorista(self, numero_carro, nome_motorista, linha_carro, horario_saida=None):
         """
         Insere carro com horário automático POR LINHA se não fornecido
-        """
-        if not self.fiscal_atual or not self.data_atual:
-            print(f"❌ Defina o cabeçalho (fiscal e data) antes de prosseguir!")
-            return False
 
-        try:
-            # Se horário não fornecido, calcular por linha específica
-            if horario_saida is None:
-                horario_saida = self.calcular_proximo_horario_linha(linha_carro)
-                print(f"🕐 Horário calculado para linha {linha_carro}: {horario_saida}")
-
-            # Garantir que horário sempre tenha segundos = 00
-            if isinstance(horario_saida, str):
-                horario_obj = datetime.strptime(horario_saida, '%H:%M').time()
-            else:
-                horario_obj = horario_saida
-
-            horario_final = horario_obj.replace(second=0, microsecond=0)
-            print(f"🕐 Horário final: {horario_final} (segundos zerados)")
-
-            conexao = self.connect()
-            cursor = conexao.cursor()
+        🆕 Retorna o horário gravado (datetime.time) ou False em caso de erro,
+        assim quem chama não precisa calcular o horário de novo.
+        """
+        with self.lock:
+            if not self.fiscal_atual or not self.data_atual:
+                logger.error(f"❌ Defina o cabeçalho (fiscal e data) antes de prosseguir!")
+                return False
 
-            # Inserir carro (saida_confirmada = FALSE por padrão)
-            sql = """INSERT INTO saida_carros
-            (nome_fiscal, data_trabalho, linha, numero_carro, nome_motorista, horario_saida, saida_confirmada)
-            VALUES (%s, %s, %s, %s, %s, %s, FALSE)"""
+            try:
+                # Se horário não fornecido, calcular por linha específica
+                if horario_saida is None:
+                    horario_saida = self.calcular_proximo_horario_linha(linha_carro)
+                    logger.debug(f"🕐 Horário calculado para linha {linha_carro}: {horario_saida}")
 
-            valores = (self.fiscal_atual, self.data_atual, linha_carro, numero_carro, nome_motorista, horario_final)
+                # Garantir que horário sempre tenha segundos = 00
+                if isinstance(horario_saida, str):
+                    horario_obj = datetime.strptime(horario_saida, '%H:%M').time()
+                else:
+                    horario_obj = horario_saida
 
-            cursor.execute(sql, valores)
-            conexao.commit()
+                horario_final = horario_obj.replace(second=0, microsecond=0)
+                logger.debug(f"🕐 Horário final: {horario_final} (segundos zerados)")
 
-            cursor.close()
-            conexao.close()
+                conexao = self.connect()
+                cursor = conexao.cursor()
 
-            print(f"✅ Salvo: {numero_carro} - {nome_motorista} - {linha_carro} - {horario_final} (AGUARDANDO)")
-            return True
+                # Inserir carro (saida_confirmada = FALSE por padrão)
+                sql = """INSERT INTO saida_carros
+                (nome_fiscal, data_trabalho, linha, numero_carro, nome_motorista, horario_saida, saida_confirmada)
+                VALUES (%s, %s, %s, %s, %s, %s, FALSE)"""
 
-        except Exception as e:
-            print(f"❌ Erro ao inserir dados: {str(e)}")
-            return False
+                valores = (self.fiscal_atual, self.data_atual, linha_carro, numero_carro, nome_motorista, horario_final)
 
-    # 🆕 NOVA FUNÇÃO: Listar carros separados por linha
-    def listar_carros_por_linha(self):
-        """Lista carros da sessão atual SEPARADOS por linha"""
-        if not self.fiscal_atual or not self.data_atual:
-            print("❌ Cabeçalho não definido!")
-            return {}
+                cursor.execute(sql, valores)
+                id_novo = cursor.lastrowid
+                self.indexar_busca(cursor, [(id_novo, self.fiscal_atual, numero_carro, nome_motorista)])
+                conexao.commit()
 
-        try:
-            conexao = self.connect()
-            cursor = conexao.cursor()
+                cursor.close()
+                conexao.close()
 
-            sql = """SELECT * FROM saida_carros 
-                     WHERE nome_fiscal = %s AND data_trabalho = %s
-                     ORDER BY linha ASC, horario_saida ASC"""
-            valores = (self.fiscal_atual, self.data_atual)
+                # Mesmo formato de um registro lido do banco (data como date, horário como timedelta)
+                try:
+                    data_trabalho = date.fromisoformat(str(self.data_atual))
+                except ValueError:
+                    data_trabalho = self.data_atual  # formato inesperado: o cache é descartado
+                registro_novo = SaidaCarro(id_novo, self.fiscal_atual, data_trabalho, linha_carro, numero_carro,
+                                           nome_motorista, para_timedelta(horario_final), datetime.now())
+                self.adicionar_ao_cache_quadro((self.fiscal_atual, self.data_atual), [registro_novo], 'carro_adicionado', {
+                    'id': id_novo,
+                    'linha': linha_carro,
+                    'numero': numero_carro,
+                    'motorista': nome_motorista,
+                    'horario': str(horario_final)
+                })
+
+                logger.info(f"✅ Salvo: {numero_carro} - {nome_motorista} - {linha_carro} - {horario_final} (AGUARDANDO)")
+                return horario_final
+
+            except LinhaSemVaga:
+                raise  # quem chama mostra o motivo (horário de operação/capacidade)
+            except Exception as e:
+                logger.error(f"❌ Erro ao inserir dados: {str(e)}")
+                return False
 
-            cursor.execute(sql, valores)
-            todos_registros = cursor.fetchall()
+    def inserir_lote_motoristas(self, carros):
+        """🆕 NOVO: Cadastra vários carros de uma vez: [(numero_carro, nome_motorista, linha), ...]
 
-            cursor.close()
-            conexao.close()
+        Os horários saem em sequência por linha (o primeiro como em inserir_dados_motorista, os seguintes
+        somando o intervalo da linha), todos calculados em memória. Um único INSERT de várias linhas,
+        numa transação só. Retorna {'status', 'carros': [{id, numero, motorista, linha, horario}], ...}.
+        """
+        if not carros:
+            return {'status': 'erro', 'mensagem': 'Nenhum carro informado'}
+        if len(carros) > self.MAX_LOTE:
+            return {'status': 'erro', 'mensagem': f'Máximo de {self.MAX_LOTE} carros por lote'}
+
+        linhas = self.obter_linhas()
+        for posicao, (numero_carro, nome_motorista, linha_carro) in enumerate(carros, 1):
+            if not numero_carro or not nome_motorista or not linha_carro:
+                return {'status': 'erro', 'mensagem': f'Carro {posicao}: número, motorista e linha são obrigatórios'}
+            if linha_carro not in linhas:
+                return {'status': 'erro', 'mensagem': f'Carro {posicao}: linha "{linha_carro}" não reconhecida'}
+
+        with self.lock:
+            if not self.fiscal_atual or not self.data_atual:
+                logger.error(f"❌ Defina o cabeçalho (fiscal e data) antes de prosseguir!")
+                return {'status': 'erro', 'mensagem': 'Defina o cabeçalho antes de adicionar carros!'}
 
-            # Separar por linha
-            carros_por_linha = {}
+            conexao = None
+            try:
+                # Horários: último de cada linha (já calculado) + intervalo da linha
+                # 🆕 Cada carro do lote conta na capacidade e precisa caber no horário de operação da linha
+                hoje = datetime.now().date()
+                ultimos = {}
+                aguardando = {}
+                horarios = []
+                for _, _, linha_carro in carros:
+                    if linha_carro in ultimos:
+                        proximo = ultimos[linha_carro] + timedelta(minutes=self.obter_intervalo_linha(linha_carro))
+                        horario = self.verificar_vaga_linha(linha_carro, proximo.time(), aguardando[linha_carro])
+                        proximo = datetime.combine(proximo.date(), horario)
+                    else:
+                        proximo = datetime.combine(hoje, self.calcular_proximo_horario_linha(linha_carro))
+                        aguardando[linha_carro] = self.carros_aguardando_linha(linha_carro)
+                    ultimos[linha_carro] = proximo
+                    aguardando[linha_carro] += 1
+                    horarios.append(proximo.time().replace(second=0, microsecond=0))
+
+                conexao = self.connect()
+                cursor = conexao.cursor()
+
+                marcadores = ', '.join(['(%s, %s, %s, %s, %s, %s, FALSE)'] * len(carros))
+                valores = []
+                for (numero_carro, nome_motorista, linha_carro), horario in zip(carros, horarios):
+                    valores.extend((self.fiscal_atual, self.data_atual, linha_carro, numero_carro, nome_motorista, horario))
+
+                cursor.execute(f"""INSERT INTO saida_carros
+                (nome_fiscal, data_trabalho, linha, numero_carro, nome_motorista, horario_saida, saida_confirmada)
+                VALUES {marcadores}""", valores)
+
+                # Num INSERT de várias linhas o lastrowid é o id da primeira. Os seguintes não são
+                # garantidamente primeiro_id + 1, + 2... (auto_increment_increment > 1 em réplicas,
+                # innodb_autoinc_lock_mode=2), então relemos os ids na mesma transação, na ordem do INSERT
+                cursor.execute("""SELECT id FROM saida_carros
+                                  WHERE id >= %s AND nome_fiscal = %s AND data_trabalho = %s
+                                  ORDER BY id LIMIT %s""",
+                               (cursor.lastrowid, self.fiscal_atual, self.data_atual, len(carros)))
+                ids = [linha_id for (linha_id,) in cursor.fetchall()]
+                if len(ids) != len(carros):
+                    raise RuntimeError(f'esperava {len(carros)} ids do lote, vieram {len(ids)}')
+                self.indexar_busca(cursor, [(id_novo, self.fiscal_atual, numero_carro, nome_motorista)
+                                            for id_novo, (numero_carro, nome_motorista, _) in zip(ids, carros)])
+                conexao.commit()
 
-            for registro in todos_registros:
-                linha = registro[3]  # linha está na posição 3
+                cursor.close()
+                conexao.close()
 
-                if linha not in carros_por_linha:
-                    carros_por_linha[linha] = []
+                try:
+                    data_trabalho = date.fromisoformat(str(self.data_atual))
+                except ValueError:
+                    data_trabalho = self.data_atual  # formato inesperado: o cache é descartado
+                agora = datetime.now()
+                novos = [SaidaCarro(id_novo, self.fiscal_atual, data_trabalho, linha_carro, numero_carro,
+                                    nome_motorista, para_timedelta(horario), agora)
+                         for id_novo, (numero_carro, nome_motorista, linha_carro), horario in zip(ids, carros, horarios)]
+                cadastrados = [{'id': id_novo, 'numero': numero_carro, 'motorista': nome_motorista,
+                                'linha': linha_carro, 'horario': str(horario)[:5]}
+                               for id_novo, (numero_carro, nome_motorista, linha_carro), horario in zip(ids, carros, horarios)]
+                self.adicionar_ao_cache_quadro((self.fiscal_atual, self.data_atual), novos, 'carros_adicionados',
+                                               {'ids': ids, 'total': len(ids)})
+
+                logger.info(f"✅ Lote salvo: {len(ids)} carros em {len(ultimos)} linha(s) (AGUARDANDO)")
+                return {'status': 'sucesso', 'carros': cadastrados, 'total': len(cadastrados)}
+
+            except LinhaSemVaga as e:
+                logger.warning(f"⚠️ Lote recusado: {str(e)}")
+                return {'status': 'erro', 'mensagem': str(e)}
+            except Exception as e:
+                logger.error(f"❌ Erro ao inserir lote: {str(e)}")
+                if conexao is not None:
+                    conexao.close()  # volta ao pool, que desfaz a transação pela metade
+                return {'status': 'erro', 'mensagem': f'Erro ao inserir lote: {str(e)}'}
 
-                carros_por_linha[linha].append(registro)
+    # 🆕 NOVA FUNÇÃO: Listar carros separados por linha
+    def listar_carros_por_linha(self):
+        """Lista carros da sessão atual SEPARADOS por linha (🆕 servido do cache do quadro)"""
+        fiscal, data = self.obter_cabecalho()
+        if not fiscal or not data:
+            logger.error("❌ Cabeçalho não definido!")
+            return {}
 
-            print(f"📊 Carros separados por linha:")
-            for linha, carros in carros_por_linha.items():
-                print(f"  {linha}: {len(carros)} carros")
+        try:
+            quadro = self.obter_quadro()
+            if quadro is None:
+                return {}
 
-            return carros_por_linha
+            # Cópia rasa: o dict do cache é o mesmo para todas as threads (os registros são imutáveis)
+            return {linha: list(registros) for linha, registros in quadro['por_linha'].items()}
 
         except Exception as e:
-            print(f"❌ Erro ao listar carros por linha: {str(e)}")
+            logger.error(f"❌ Erro ao listar carros por linha: {str(e)}")
             return {}
 
     # ========== MANTER TODAS AS FUNÇÕES ORIGINAIS INTACTAS ==========
@@ -386,8 +1388,8 @@ class DatabaseManager:
             conexao = self.connect()
             cursor = conexao.cursor()
 
-            print(f"🔍 CORRIGIDO: Calculando próximo horário GERAL...")
-            print(f"🔍 Fiscal: {self.fiscal_atual}, Data: {self.data_atual}")
+            logger.debug(f"🔍 CORRIGIDO: Calculando próximo horário GERAL...")
+            logger.debug(f"🔍 Fiscal: {self.fiscal_atual}, Data: {self.data_atual}")
 
             # 🔧 CORREÇÃO BUG 2: Verificar se há carros na sessão atual primeiro
             sql_todos_carros = """SELECT COUNT(*) FROM saida_carros 
@@ -396,14 +1398,14 @@ class DatabaseManager:
             cursor.execute(sql_todos_carros, (self.fiscal_atual, self.data_atual))
             total_carros_sessao = cursor.fetchone()[0]
 
-            print(f"🔍 CORREÇÃO BUG 2 (GERAL): Total de carros na sessão atual: {total_carros_sessao}")
+            logger.debug(f"🔍 CORREÇÃO BUG 2 (GERAL): Total de carros na sessão atual: {total_carros_sessao}")
 
             # Se não há carros na sessão, começar do zero
             if total_carros_sessao == 0:
                 agora = datetime.now()
                 primeiro_horario = agora + timedelta(minutes=10)
                 resultado = primeiro_horario.time().replace(second=0, microsecond=0)
-                print(f"🆕 CORREÇÃO BUG 2 (GERAL): Primeira sessão, começando em: {resultado}")
+                logger.debug(f"🆕 CORREÇÃO BUG 2 (GERAL): Primeira sessão, começando em: {resultado}")
                 cursor.close()
                 conexao.close()
                 return resultado
@@ -432,7 +1434,7 @@ class DatabaseManager:
                     hours = total_seconds // 3600
                     minutes = (total_seconds % 3600) // 60
                     ultimo_horario = time(hours, minutes, 0)
-                    print(f"🔧 Convertido timedelta para time: {ultimo_horario}")
+                    logger.debug(f"🔧 Convertido timedelta para time: {ultimo_horario}")
 
                 if isinstance(ultimo_horario, time):
                     ultimo_datetime = datetime.combine(datetime.now().date(), ultimo_horario)
@@ -441,24 +1443,24 @@ class DatabaseManager:
                     # 🔧 CORREÇÃO BUG 3: Verificar se não está muito no futuro
                     agora = datetime.now()
                     if proximo_datetime.time() < agora.time():  # Se horário calculado já passou
-                        print(f"⚡ CORREÇÃO BUG 3 (GERAL): Horário calculado já passou, usando agora + intervalo")
+                        logger.debug(f"⚡ CORREÇÃO BUG 3 (GERAL): Horário calculado já passou, usando agora + intervalo")
                         proximo_datetime = agora + timedelta(minutes=self.intervalo_atual)
 
                     proximo_horario = proximo_datetime.time().replace(second=0, microsecond=0)
-                    print(f"⏰ CORRETO: Último ({ultimo_horario}) + {self.intervalo_atual}min = {proximo_horario}")
+                    logger.debug(f"⏰ CORRETO: Último ({ultimo_horario}) + {self.intervalo_atual}min = {proximo_horario}")
                     return proximo_horario
                 else:
-                    print(f"❌ Tipo inesperado de horário: {type(ultimo_horario)} - {ultimo_horario}")
+                    logger.warning(f"❌ Tipo inesperado de horário: {type(ultimo_horario)} - {ultimo_horario}")
 
             # Primeiro carro do dia - usar horário atual + 10 minutos
             agora = datetime.now()
             proximo_datetime = agora + timedelta(minutes=10)
             proximo_horario = proximo_datetime.time().replace(second=0, microsecond=0)
-            print(f"⏰ PRIMEIRO carro do dia: {proximo_horario} (agora + 10 minutos)")
+            logger.debug(f"⏰ PRIMEIRO carro do dia: {proximo_horario} (agora + 10 minutos)")
             return proximo_horario
 
         except Exception as e:
-            print(f"❌ Erro ao calcular próximo horário: {e}")
+            logger.error(f"❌ Erro ao calcular próximo horário: {e}")
             agora = datetime.now()
             return (agora + timedelta(minutes=10)).time().replace(second=0, microsecond=0)
 
@@ -468,69 +1470,162 @@ class DatabaseManager:
 
     def listar_registros_sessao_atual(self):
         """Lista apenas registros da sessão atual (com cabeçalho definido) - COM STATUS DE CONFIRMAÇÃO"""
-        if not self.fiscal_atual or not self.data_atual:
-            print("❌ Cabeçalho não definido!")
+        fiscal, data = self.obter_cabecalho()
+        if not fiscal or not data:
+            logger.error("❌ Cabeçalho não definido!")
+            return []
+
+        try:
+            quadro = self.obter_quadro()
+            if quadro is None:
+                return []
+
+            # 🆕 Mesmo cache do quadro, só que ordenado por horário (sorted é estável)
+            return sorted(quadro['registros'], key=lambda registro: registro.horario_saida or timedelta(0))
+
+        except Exception as e:
+            logger.error(f"❌ Erro ao listar registros da sessão: {str(e)}")
             return []
 
+    def limitar_pagina(self, limite):
+        """🆕 NOVO: Tamanho de página válido (padrão quando não informado, nunca acima do máximo)"""
         try:
+            limite = int(limite) if limite else self.TAMANHO_PAGINA_PADRAO
+        except (TypeError, ValueError):
+            limite = self.TAMANHO_PAGINA_PADRAO
+        return max(1, min(limite, self.TAMANHO_PAGINA_MAXIMO))
+
+    def listar_todos_registros(self, limite=None, cursor_pagina=None, contar=False):
+        """Lista TODOS os registros sem filtro - COM STATUS DE CONFIRMAÇÃO
+
+        🆕 Paginado por cursor (id decrescente): cada chamada lê no máximo `limite` registros.
+        Retorna {'status', 'registros', 'proximo_cursor', 'total_registros'}.
+        """
+        try:
+            limite = self.limitar_pagina(limite)
             conexao = self.connect()
             cursor = conexao.cursor()
 
-            sql = """SELECT * FROM saida_carros 
-                     WHERE nome_fiscal = %s AND data_trabalho = %s
-                     ORDER BY horario_saida ASC"""
-            valores = (self.fiscal_atual, self.data_atual)
+            sql = f"SELECT {COLUNAS_SAIDA} FROM saida_carros"
+            valores = []
+            if cursor_pagina:
+                ultimo_id, = decodificar_cursor(cursor_pagina, 1)
+                sql += " WHERE id < %s"
+                valores.append(int(ultimo_id))
+            sql += " ORDER BY id DESC LIMIT %s"
+            valores.append(limite + 1)
 
             cursor.execute(sql, valores)
-            resultado = cursor.fetchall()
+            resultado = ler_saidas(cursor.fetchall())
+
+            total_registros = None
+            if contar:
+                cursor.execute("SELECT COUNT(*) FROM saida_carros")
+                total_registros = cursor.fetchone()[0]
 
             cursor.close()
             conexao.close()
 
-            print(f"Listando registros da sessão atual! Total: {len(resultado)}")
-            return resultado
+            proximo_cursor = None
+            if len(resultado) > limite:
+                resultado = resultado[:limite]
+                proximo_cursor = codificar_cursor([resultado[-1].id])
 
-        except Exception as e:
-            print(f"❌ Erro ao listar registros da sessão: {str(e)}")
-            return []
+            logger.debug(f"Listando registros: {len(resultado)} nesta página")
+            return {
+                'status': 'sucesso',
+                'registros': resultado,
+                'proximo_cursor': proximo_cursor,
+                'total_registros': total_registros
+            }
 
-    def listar_todos_registros(self):
-        """Lista TODOS os registros sem filtro - COM STATUS DE CONFIRMAÇÃO"""
-        conexao = self.connect()
-        cursor = conexao.cursor()
+        except ValueError as e:
+            return {'status': 'erro', 'mensagem': str(e)}
+        except Exception as e:
+            logger.error(f"❌ Erro ao listar registros: {str(e)}")
+            return {'status': 'erro', 'mensagem': f'Erro ao listar registros: {str(e)}'}
 
-        sql = "SELECT * FROM saida_carros ORDER BY id DESC"
-        cursor.execute(sql)
-        resultado = cursor.fetchall()
+    def deletar_registro(self, id_registro):
+        """Remove um registro do banco de dados"""
+        resultado = self.deletar_registros([id_registro])
+        return resultado['status'] == 'sucesso' and bool(resultado['removidos'])
 
-        cursor.close()
-        conexao.close()
+    def deletar_registros(self, ids):
+        """🆕 NOVO: Remove vários registros com um único DELETE ... WHERE id IN (...)
 
-        print(f"Listando TODOS os registros! Total: {len(resultado)}")
-        return resultado
+        A data de cada registro (para refazer o resumo diário) vem do quadro em cache; só os ids que não
+        estão em nenhum quadro (ex.: histórico) são consultados antes, na mesma conexão.
+        Retorna {'status', 'removidos': [ids], 'nao_encontrados': [ids]}.
+        """
+        try:
+            ids = ids_do_lote(ids)
+        except ValueError:
+            return {'status': 'erro', 'mensagem': 'IDs devem ser números inteiros'}
+        if not ids:
+            return {'status': 'erro', 'mensagem': 'Nenhum ID informado'}
+        if len(ids) > self.MAX_LOTE:
+            return {'status': 'erro', 'mensagem': f'Máximo de {self.MAX_LOTE} registros por lote'}
+
+        datas = {id_registro: registro.data_trabalho for id_registro, registro in self.registros_em_cache(ids).items()}
+        em_cache = set(datas)
+        conexao = None
+        try:
+            conexao = self.connect()
+            cursor = conexao.cursor()
 
-    def deletar_registro(self, id_registro):
-        """Remove um registro do banco de dados"""
-        conexao = self.connect()
-        cursor = conexao.cursor()
+            fora_do_cache = [i for i in ids if i not in datas]
+            if fora_do_cache:
+                marcadores = ', '.join(['%s'] * len(fora_do_cache))
+                cursor.execute(f"SELECT id, data_trabalho FROM saida_carros WHERE id IN ({marcadores})", fora_do_cache)
+                datas.update(cursor.fetchall())
+
+            removidos = [i for i in ids if i in datas]
+            if removidos:
+                marcadores = ', '.join(['%s'] * len(removidos))
+                cursor.execute(f"DELETE FROM saida_carros WHERE id IN ({marcadores})", removidos)
+                if cursor.rowcount != len(removidos):
+                    # Algum já tinha sumido (cache velho ou remoção ao mesmo tempo): desfaz, pergunta ao banco
+                    # quem ainda existe (travando essas linhas) e remove exatamente esses
+                    logger.warning(f"⚠️ {len(removidos)} registros a remover, {cursor.rowcount} removidos")
+                    conexao.rollback()
+                    cursor.execute(f"SELECT id, data_trabalho FROM saida_carros WHERE id IN ({marcadores}) FOR UPDATE",
+                                   removidos)
+                    datas = dict(cursor.fetchall())
+                    removidos = [i for i in ids if i in datas]
+                    if removidos:
+                        cursor.execute(f"DELETE FROM saida_carros WHERE id IN "
+                                       f"({', '.join(['%s'] * len(removidos))})", removidos)
+                self.remover_da_busca(cursor, removidos)
+            conexao.commit()
 
-        sql = """SELECT * FROM saida_carros WHERE id = (%s)"""
-        cursor.execute(sql, (id_registro,))
-        registro = cursor.fetchone()
-        if not registro:
-            print(f"Registro com o ID {id_registro} não encontrado!")
             cursor.close()
             conexao.close()
-            return False
-
-        sql = """DELETE FROM saida_carros WHERE id = %s"""
-        cursor.execute(sql, (id_registro,))
-        conexao.commit()
-
-        cursor.close()
-        conexao.close()
-        print(f"Registro com id: {id_registro} deletado!")
-        return True
+        except Exception as e:
+            logger.error(f"❌ Erro ao remover registros: {str(e)}")
+            if conexao is not None:
+                conexao.close()  # volta ao pool, que desfaz a transação pela metade
+            return {'status': 'erro', 'mensagem': f'Erro ao remover registros: {str(e)}'}
+
+        nao_encontrados = [i for i in ids if i not in datas]
+        for id_registro in nao_encontrados:
+            logger.warning(f"Registro com o ID {id_registro} não encontrado!")
+
+        # O que estava no quadro mas o banco já não tinha também sai do cache (não conta como removido)
+        sair_do_quadro = removidos + [i for i in nao_encontrados if i in em_cache]
+        if sair_do_quadro:
+            estados = self.sessoes_dos_registros(sair_do_quadro)
+            for estado in estados:
+                with self.na_sessao(estado):
+                    self.atualizar_cache_quadro_lote_da_sessao(
+                        dict.fromkeys(sair_do_quadro), 'carro_removido',
+                        {'id': sair_do_quadro[0]} if len(sair_do_quadro) == 1 else {'ids': sair_do_quadro},
+                        remover=True)
+
+        if removidos:
+            self.atualizar_resumo_datas_historico(*(datas[i] for i in removidos))
+            logger.info(f"Registro(s) com id: {', '.join(map(str, removidos))} deletado(s)!")
+
+        return {'status': 'sucesso', 'removidos': removidos, 'nao_encontrados': nao_encontrados}
 
     # ========== FUNCIONALIDADE: CONFIRMAR SAÍDA AUTOMÁTICA ==========
 
@@ -551,78 +1646,143 @@ class DatabaseManager:
             cursor.close()
             conexao.close()
 
-            print("✅ Coluna 'saida_confirmada' adicionada com sucesso!")
+            logger.info("✅ Coluna 'saida_confirmada' adicionada com sucesso!")
             return True
 
         except Exception as e:
-            print(f"❌ Erro ao adicionar coluna: {str(e)}")
+            logger.error(f"❌ Erro ao adicionar coluna: {str(e)}")
             if "Duplicate column name" in str(e) or "duplicate column name" in str(e).lower():
-                print("✅ Coluna já existe, continuando...")
+                logger.info("✅ Coluna já existe, continuando...")
                 return True
             return False
 
     def confirmar_saida_carro(self, id_carro):
-        """Marca um carro como tendo sua saída confirmada AUTOMATICAMENTE"""
+        """Marca um carro como tendo sua saída confirmada AUTOMATICAMENTE
+
+        🆕 Guarda também o momento da confirmação (horario_confirmacao) e o atraso em segundos
+        em relação ao horário de saída marcado. Confirmar de novo não muda o momento gravado.
+        """
+        resultado = self.confirmar_saidas([id_carro])
+        return resultado['status'] == 'sucesso' and bool(resultado['confirmados'])
+
+    def confirmar_saidas(self, ids):
+        """🆕 NOVO: Confirma a saída de vários carros com um único UPDATE ... WHERE id IN (...)
+
+        Mesmas regras de confirmar_saida_carro. A data de cada carro (para refazer o resumo diário de
+        dias já fechados) vem do quadro em cache; os ids fora de qualquer quadro são consultados na mesma
+        transação, e todos só quando o UPDATE acha menos carros do que pedidos.
+        Retorna {'status', 'confirmados', 'nao_encontrados'}.
+        """
+        try:
+            ids = ids_do_lote(ids)
+        except ValueError:
+            return {'status': 'erro', 'mensagem': 'IDs devem ser números inteiros'}
+        if not ids:
+            return {'status': 'erro', 'mensagem': 'Nenhum ID informado'}
+        if len(ids) > self.MAX_LOTE:
+            return {'status': 'erro', 'mensagem': f'Máximo de {self.MAX_LOTE} registros por lote'}
+
+        datas = {id_carro: registro.data_trabalho for id_carro, registro in self.registros_em_cache(ids).items()}
+        conexao = None
         try:
             conexao = self.connect()
             cursor = conexao.cursor()
 
-            sql = """
+            agora = datetime.now().replace(microsecond=0)
+            marcadores = ', '.join(['%s'] * len(ids))
+
+            sql = f"""
             UPDATE saida_carros 
-            SET saida_confirmada = TRUE 
-            WHERE id = %s
+            SET saida_confirmada = TRUE,
+                horario_confirmacao = COALESCE(horario_confirmacao, %s),
+                atraso_segundos = COALESCE(atraso_segundos,
+                                           TIMESTAMPDIFF(SECOND, TIMESTAMP(data_trabalho, horario_saida), %s))
+            WHERE id IN ({marcadores})
             """
 
-            cursor.execute(sql, (id_carro,))
+            cursor.execute(sql, [agora, agora] + ids)
+            linhas_afetadas = cursor.rowcount  # linhas encontradas (o conector liga FOUND_ROWS)
+
+            # Faltou algum: o banco decide quem existe. Senão, só falta a data dos que não estão em cache
+            consultar = ids if linhas_afetadas < len(ids) else [i for i in ids if i not in datas]
+            if consultar:
+                cursor.execute(f"SELECT id, data_trabalho FROM saida_carros WHERE id IN "
+                               f"({', '.join(['%s'] * len(consultar))})", consultar)
+                encontrados = dict(cursor.fetchall())
+                datas = encontrados if consultar is ids else {**datas, **encontrados}
+            confirmados = [i for i in ids if i in datas]
             conexao.commit()
 
-            linhas_afetadas = cursor.rowcount
             cursor.close()
             conexao.close()
-
-            if linhas_afetadas > 0:
-                print(f"✅ Saída confirmada AUTOMATICAMENTE para carro ID: {id_carro}")
-                return True
-            else:
-                print(f"❌ Carro ID {id_carro} não encontrado")
-                return False
-
         except Exception as e:
-            print(f"❌ Erro ao confirmar saída: {str(e)}")
-            return False
+            logger.error(f"❌ Erro ao confirmar saída: {str(e)}")
+            if conexao is not None:
+                conexao.close()  # volta ao pool, que desfaz a transação pela metade
+            return {'status': 'erro', 'mensagem': f'Erro ao confirmar saída: {str(e)}'}
+
+        nao_encontrados = [i for i in ids if i not in set(confirmados)]
+        for id_carro in nao_encontrados:
+            logger.error(f"❌ Carro ID {id_carro} não encontrado")
+
+        if confirmados:
+            # Mesma conta do UPDATE, para o cache ficar igual ao banco (🆕 da sessão que mostra o carro)
+            for estado in self.sessoes_dos_registros(confirmados):
+                with self.na_sessao(estado), self.lock:
+                    alteracoes = {}
+                    for id_carro in confirmados:
+                        alterar = {'saida_confirmada': 1}
+                        registro = self.obter_registro_do_cache(id_carro)
+                        if registro is not None and registro.horario_confirmacao is None:
+                            alterar['horario_confirmacao'] = agora
+                            if isinstance(registro.data_trabalho, date) and registro.horario_saida is not None:
+                                previsto = datetime.combine(registro.data_trabalho, para_time(registro.horario_saida))
+                                alterar['atraso_segundos'] = int((agora - previsto).total_seconds())
+                        alteracoes[id_carro] = alterar
+                    self.atualizar_cache_quadro_lote_da_sessao(
+                        alteracoes, 'saida_confirmada',
+                        {'id': confirmados[0]} if len(confirmados) == 1 else {'ids': confirmados})
+            # Carro de dia já fechado (ex.: histórico): o resumo das estatísticas precisa ser refeito
+            self.atualizar_resumo_datas_historico(*(datas[i] for i in confirmados))
+            logger.info(f"✅ Saída confirmada AUTOMATICAMENTE para carro(s) ID: {', '.join(map(str, confirmados))}")
+
+        return {'status': 'sucesso', 'confirmados': confirmados, 'nao_encontrados': nao_encontrados}
 
     # ========== FUNCIONALIDADE ORIGINAL: CONTROLE DE INTERVALO ==========
 
     def definir_intervalo(self, novo_intervalo):
         """🔧 CORRIGIDO: Define novo intervalo entre carros e recalcula horários dos carros pendentes SEM JOGAR PARA O FUTURO"""
-        try:
-            if not isinstance(novo_intervalo, int) or novo_intervalo < 1 or novo_intervalo > 60:
-                print("❌ Intervalo deve ser um número entre 1 e 60 minutos")
-                return {'status': 'erro', 'mensagem': 'Intervalo deve ser entre 1 e 60 minutos'}
-
-            print(f"🔧 CORRIGIDO: Definindo novo intervalo GERAL: {novo_intervalo} minutos")
-            intervalo_antigo = self.intervalo_atual
-            self.intervalo_atual = novo_intervalo
-
-            # 🔧 CORREÇÃO BUG 1: Recalcular horários SEM JOGAR PARA O FUTURO
-            carros_atualizados = self.recalcular_horarios_carros_pendentes_corrigido(intervalo_antigo, novo_intervalo)
-
-            return {
-                'status': 'sucesso',
-                'intervalo': novo_intervalo,
-                'carros_atualizados': carros_atualizados,
-                'mensagem': f'Intervalo alterado para {novo_intervalo} minutos. {carros_atualizados} carros atualizados.'
-            }
+        with self.lock:
+            try:
+                if not isinstance(novo_intervalo, int) or novo_intervalo < 1 or novo_intervalo > 60:
+                    logger.error("❌ Intervalo deve ser um número entre 1 e 60 minutos")
+                    return {'status': 'erro', 'mensagem': 'Intervalo deve ser entre 1 e 60 minutos'}
+
+                logger.info(f"🔧 CORRIGIDO: Definindo novo intervalo GERAL: {novo_intervalo} minutos")
+                intervalo_antigo = self.intervalo_atual
+                self.intervalo_atual = novo_intervalo
+                self.registrar_mutacao('intervalo_alterado', {'linha': None, 'intervalo': novo_intervalo})
+                self.salvar_sessao()
+
+                # 🔧 CORREÇÃO BUG 1: Recalcular horários SEM JOGAR PARA O FUTURO
+                carros_atualizados = self.recalcular_horarios_carros_pendentes_corrigido(intervalo_antigo, novo_intervalo)
+
+                return {
+                    'status': 'sucesso',
+                    'intervalo': novo_intervalo,
+                    'carros_atualizados': carros_atualizados,
+                    'mensagem': f'Intervalo alterado para {novo_intervalo} minutos. {carros_atualizados} carros atualizados.'
+                }
 
-        except Exception as e:
-            print(f"❌ Erro ao definir intervalo: {str(e)}")
-            return {'status': 'erro', 'mensagem': f'Erro ao definir intervalo: {str(e)}'}
+            except Exception as e:
+                logger.error(f"❌ Erro ao definir intervalo: {str(e)}")
+                return {'status': 'erro', 'mensagem': f'Erro ao definir intervalo: {str(e)}'}
 
     def recalcular_horarios_carros_pendentes_corrigido(self, intervalo_antigo, novo_intervalo):
         """🔧 CORREÇÃO BUG 1: Recalcula horários mantendo primeiro carro e ajustando apenas intervalos"""
         try:
             if not self.fiscal_atual or not self.data_atual:
-                print("❌ Cabeçalho não definido, não é possível recalcular")
+                logger.error("❌ Cabeçalho não definido, não é possível recalcular")
                 return 0
 
             conexao = self.connect()
@@ -637,55 +1797,23 @@ class DatabaseManager:
             cursor.execute(sql_pendentes, (self.fiscal_atual, self.data_atual))
             carros_pendentes = cursor.fetchall()
 
-            print(f"🔍 CORREÇÃO BUG 1: Carros PENDENTES para recalcular (TODAS AS LINHAS): {len(carros_pendentes)}")
+            logger.debug(f"🔍 CORREÇÃO BUG 1: Carros PENDENTES para recalcular (TODAS AS LINHAS): {len(carros_pendentes)}")
 
             if not carros_pendentes:
-                print("✅ Nenhum carro pendente para recalcular")
+                logger.debug("✅ Nenhum carro pendente para recalcular")
                 cursor.close()
                 conexao.close()
                 return 0
 
-            carros_atualizados = 0
-
             # 🔧 ESTRATÉGIA CORRIGIDA: Manter o primeiro horário, recalcular os seguintes
-            for i, (id_carro, numero_carro, horario_antigo) in enumerate(carros_pendentes):
-                if i == 0:
-                    # MANTER o primeiro carro no mesmo horário
-                    print(
-                        f"🔧 Mantendo PRIMEIRO carro ID {id_carro} (Carro {numero_carro}) no horário original: {horario_antigo}")
-                    continue
-
-                # Para os demais carros: usar o horário do primeiro + (posição * novo_intervalo)
-                primeiro_horario = carros_pendentes[0][2]  # horário do primeiro carro
-
-                # Converter primeiro_horario para datetime se necessário
-                if isinstance(primeiro_horario, timedelta):
-                    total_seconds = int(primeiro_horario.total_seconds())
-                    hours = total_seconds // 3600
-                    minutes = (total_seconds % 3600) // 60
-                    primeiro_horario = time(hours, minutes, 0)
-
-                if isinstance(primeiro_horario, time):
-                    primeiro_datetime = datetime.combine(datetime.now().date(), primeiro_horario)
-                    novo_horario_datetime = primeiro_datetime + timedelta(minutes=i * novo_intervalo)
-                    novo_horario_time = novo_horario_datetime.time().replace(second=0, microsecond=0)
-
-                    print(f"🔧 CORRIGIDO: ID {id_carro} (Carro {numero_carro}): {horario_antigo} → {novo_horario_time}")
-
-                    # Atualizar horário
-                    sql_update = """UPDATE saida_carros 
-                                   SET horario_saida = %s 
-                                   WHERE id = %s"""
-
-                    cursor.execute(sql_update, (novo_horario_time, id_carro))
-
-                    if cursor.rowcount == 1:
-                        carros_atualizados += 1
-                        print(f"✅ ID {id_carro} atualizado com sucesso")
+            # 🆕 Todos os horários novos vão em UM único UPDATE (antes era um UPDATE por carro)
+            novos_horarios = self.montar_horarios_recalculados(carros_pendentes, novo_intervalo)
+            carros_atualizados = self.atualizar_horarios_em_lote(cursor, novos_horarios)
 
             # Commit das alterações
             conexao.commit()
-            print(f"💾 CORREÇÃO BUG 1: {carros_atualizados} carros atualizados corretamente (GERAL)")
+            self.invalidar_cache_quadro('horarios_recalculados', {'linha': None})
+            logger.info(f"💾 CORREÇÃO BUG 1: {carros_atualizados} carros atualizados corretamente (GERAL)")
 
             cursor.close()
             conexao.close()
@@ -693,7 +1821,7 @@ class DatabaseManager:
             return carros_atualizados
 
         except Exception as e:
-            print(f"❌ ERRO CRÍTICO ao recalcular horários: {str(e)}")
+            logger.error(f"❌ ERRO CRÍTICO ao recalcular horários: {str(e)}")
             # Em caso de erro, fazer rollback
             try:
                 conexao.rollback()
@@ -716,205 +1844,615 @@ class DatabaseManager:
             # Contar linhas diferentes na sessão
             linhas_unicas = set()
             for registro in registros:
-                if len(registro) > 3 and registro[3]:  # linha está na posição 3
-                    linhas_unicas.add(registro[3])
+                if registro.linha:
+                    linhas_unicas.add(registro.linha)
 
             linhas_texto = f"{len(linhas_unicas)} linha(s)" if linhas_unicas else "Nenhuma linha"
 
-            print(f"📊 Sessão atual - Intervalo: {self.intervalo_atual} minutos")
+            logger.debug(f"📊 Sessão atual - Intervalo: {self.intervalo_atual} minutos")
             return {
                 'fiscal': self.fiscal_atual,
                 'data': self.data_atual,
                 'linhas': linhas_texto,
                 'total_carros': len(registros),
                 'intervalo_atual': self.intervalo_atual,
-                'intervalos_por_linha': self.intervalos_por_linha,  # 🆕 NOVO
+                'intervalos_por_linha': self.intervalos_das_linhas(),  # 🆕 NOVO
                 'ativa': True
             }
         except Exception as e:
-            print(f"❌ Erro ao obter sessão atual: {str(e)}")
+            logger.error(f"❌ Erro ao obter sessão atual: {str(e)}")
             return None
 
     def finalizar_dia(self):
         """Finaliza o dia atual, salvando todos os dados e limpando a sessão."""
-        if not self.fiscal_atual or not self.data_atual:
-            print("❌ Nenhuma sessão ativa para finalizar!")
-            return {
-                'status': 'erro',
-                'mensagem': 'Nenhuma sessão ativa para finalizar!'
-            }
+        with self.lock:
+            if not self.fiscal_atual or not self.data_atual:
+                logger.error("❌ Nenhuma sessão ativa para finalizar!")
+                return {
+                    'status': 'erro',
+                    'mensagem': 'Nenhuma sessão ativa para finalizar!'
+                }
 
-        try:
-            registros_hoje = self.listar_registros_sessao_atual()
-            total_registros = len(registros_hoje)
+            try:
+                registros_hoje = self.listar_registros_sessao_atual()
+                total_registros = len(registros_hoje)
+
+                # 🆕 O dia fechado entra no resumo das estatísticas
+                self.atualizar_resumo_diario(self.data_atual)
+
+                dados_finalizados = {
+                    'fiscal': self.fiscal_atual,
+                    'data': self.data_atual,
+                    'total_carros': total_registros,
+                    'registros': registros_hoje
+                }
+
+                # Limpar variáveis de sessão
+                self.invalidar_cache_quadro('sessao_finalizada')
+                self.fiscal_atual = None
+                self.data_atual = None
+                self.linha_atual = None  # Sempre None agora
+                self.intervalo_atual = 8  # Resetar para padrão
+
+                # 🆕 NOVO: Resetar intervalos por linha (voltam ao padrão de cada linha)
+                self.intervalos_por_linha = {}
+                self.salvar_sessao()  # sem cabeçalho: tira a sessão da tabela
+
+                logger.info(f"✅ Dia finalizado com sucesso! {total_registros} carros cadastrados.")
+
+                return {
+                    'status': 'sucesso',
+                    'mensagem': f'Dia finalizado! {total_registros} carros foram cadastrados.',
+                    'dados': dados_finalizados
+                }
 
-            dados_finalizados = {
-                'fiscal': self.fiscal_atual,
-                'data': self.data_atual,
-                'total_carros': total_registros,
-                'registros': registros_hoje
-            }
+            except Exception as e:
+                logger.error(f"❌ Erro ao finalizar dia: {str(e)}")
+                return {
+                    'status': 'erro',
+                    'mensagem': f'Erro ao finalizar dia: {str(e)}'
+                }
 
-            # Limpar variáveis de sessão
-            self.fiscal_atual = None
-            self.data_atual = None
-            self.linha_atual = None  # Sempre None agora
-            self.intervalo_atual = 8  # Resetar para padrão
+    # ========== CONSULTAS E ESTATÍSTICAS ==========
 
-            # 🆕 NOVO: Resetar intervalos por linha
-            self.intervalos_por_linha = {
-                'Centro x Vila Verde': 8,
-                'Centro x Rasa': 8
-            }
+    def consultar_por_data(self, data_consulta, limite=None, cursor_pagina=None, contar=False):
+        """Consulta todos os registros de uma data específica - COM STATUS DE CONFIRMAÇÃO."""
+        # 🆕 Mesma consulta (e mesma paginação) dos filtros, só com a data
+        return self.consultar_por_filtros({'data_especifica': data_consulta}, limite, cursor_pagina, contar)
+
+    def montar_filtros_consulta(self, filtros):
+        """🆕 NOVO: Monta o WHERE dos filtros do histórico → (sql, valores)"""
+        sql = " WHERE 1=1"
+        valores = []
+
+        if filtros.get('data_especifica'):
+            # Intervalo [dia, dia+1) em vez de DATE(data_trabalho) = dia, para usar o índice por data
+            sql += " AND data_trabalho >= %s AND data_trabalho < %s + INTERVAL 1 DAY"
+            valores.extend([filtros['data_especifica'], filtros['data_especifica']])
+
+        if filtros.get('data_inicio'):
+            sql += " AND data_trabalho >= %s"
+            valores.append(filtros['data_inicio'])
+
+        if filtros.get('data_fim'):
+            sql += " AND data_trabalho < %s + INTERVAL 1 DAY"
+            valores.append(filtros['data_fim'])
+
+        if filtros.get('fiscal'):
+            sql += " AND nome_fiscal LIKE %s"
+            valores.append(f"%{filtros['fiscal']}%")
+
+        if filtros.get('linha'):
+            sql += " AND linha LIKE %s"
+            valores.append(f"%{filtros['linha']}%")
+
+        if filtros.get('numero_carro'):
+            sql += " AND numero_carro LIKE %s"
+            valores.append(f"%{filtros['numero_carro']}%")
+
+        if filtros.get('nome_motorista'):
+            sql += " AND nome_motorista LIKE %s"
+            valores.append(f"%{filtros['nome_motorista']}%")
+
+        return sql, valores
+
+    def montar_consulta_historico(self, filtros, limite, cursor_pagina=None):
+        """🆕 NOVO: SELECT de uma página do histórico (limite + 1 linhas, para saber se há mais) → (sql, valores)"""
+        filtro_sql, filtro_valores = self.montar_filtros_consulta(filtros)
+        sql = f"SELECT {COLUNAS_SAIDA} FROM saida_carros" + filtro_sql
+        valores = list(filtro_valores)
+
+        if cursor_pagina:
+            # Continua depois do último registro da página anterior.
+            # Horário NULL vai no cursor como null: no ORDER BY ASC do MySQL os NULL vêm ANTES de qualquer
+            # horário, então depois de um NULL ainda faltam os outros NULL do dia (id maior) e todos os horários.
+            data_cursor, segundos_cursor, id_cursor = decodificar_cursor(cursor_pagina, 3)
+            if segundos_cursor is None:
+                sql += """ AND (data_trabalho < %s
+                              OR (data_trabalho = %s AND (horario_saida IS NOT NULL
+                                  OR (horario_saida IS NULL AND id > %s))))"""
+                valores.extend([data_cursor, data_cursor, int(id_cursor)])
+            else:
+                segundos_cursor = int(segundos_cursor)
+                horario_cursor = f"{segundos_cursor // 3600:02d}:{segundos_cursor % 3600 // 60:02d}:{segundos_cursor % 60:02d}"
+                # horario_saida > / = %s nunca é verdade para NULL: esses já saíram antes deste horário
+                sql += """ AND (data_trabalho < %s
+                              OR (data_trabalho = %s AND (horario_saida > %s
+                                  OR (horario_saida = %s AND id > %s))))"""
+                valores.extend([data_cursor, data_cursor, horario_cursor, horario_cursor, int(id_cursor)])
+
+        sql += self.ORDEM_HISTORICO + " LIMIT %s"
+        valores.append(limite + 1)
+        return sql, valores
+
+    def consultar_por_filtros(self, filtros, limite=None, cursor_pagina=None, contar=False):
+        """Consulta registros com múltiplos filtros - COM STATUS DE CONFIRMAÇÃO.
+
+        🆕 Paginado por cursor na ordem (data DESC, horário ASC, id ASC).
+        Retorna {'status', 'registros', 'proximo_cursor', 'total_registros'}.
+        """
+        try:
+            limite = self.limitar_pagina(limite)
+            conexao = self.connect()
+            cursor = conexao.cursor()
 
-            print(f"✅ Dia finalizado com sucesso! {total_registros} carros cadastrados.")
+            sql, valores = self.montar_consulta_historico(filtros, limite, cursor_pagina)
+            cursor.execute(sql, valores)
+            resultado = ler_saidas(cursor.fetchall())
+
+            total_registros = None
+            if contar:
+                filtro_sql, filtro_valores = self.montar_filtros_consulta(filtros)
+                cursor.execute("SELECT COUNT(*) FROM saida_carros" + filtro_sql, filtro_valores)
+                total_registros = cursor.fetchone()[0]
+
+            cursor.close()
+            conexao.close()
 
+            proximo_cursor = None
+            if len(resultado) > limite:
+                resultado = resultado[:limite]
+                ultimo = resultado[-1]
+                horario = para_timedelta(ultimo.horario_saida)
+                proximo_cursor = codificar_cursor([
+                    (ultimo.data_trabalho.isoformat() if hasattr(ultimo.data_trabalho, 'isoformat')
+                     else str(ultimo.data_trabalho)),
+                    int(horario.total_seconds()) if horario is not None else None,  # NULL continua NULL
+                    ultimo.id
+                ])
+
+            logger.info(f"🔍 Consulta com filtros: {len(resultado)} registros nesta página")
             return {
                 'status': 'sucesso',
-                'mensagem': f'Dia finalizado! {total_registros} carros foram cadastrados.',
-                'dados': dados_finalizados
+                'registros': resultado,
+                'proximo_cursor': proximo_cursor,
+                'total_registros': total_registros
             }
 
+        except ValueError as e:
+            return {'status': 'erro', 'mensagem': str(e)}
         except Exception as e:
-            print(f"❌ Erro ao finalizar dia: {str(e)}")
-            return {
-                'status': 'erro',
-                'mensagem': f'Erro ao finalizar dia: {str(e)}'
-            }
+            logger.error(f"❌ Erro ao consultar com filtros: {str(e)}")
+            return {'status': 'erro', 'mensagem': f'Erro ao consultar dados: {str(e)}'}
 
-    # ========== CONSULTAS E ESTATÍSTICAS ==========
+    def exportar_registros(self, filtros, tamanho_lote=1000):
+        """🆕 NOVO: Gerador com o histórico filtrado, em lotes de `tamanho_lote` registros (SaidaCarro)
 
-    def consultar_por_data(self, data_consulta):
-        """Consulta todos os registros de uma data específica - COM STATUS DE CONFIRMAÇÃO."""
+        Usa cursor SEM buffer: o MySQL vai mandando as linhas conforme são lidas, então a
+        memória fica do tamanho de um lote, seja um dia ou um ano de histórico.
+        Ordem cronológica (data, horário), que é a ordem do índice por data - não precisa ordenar antes.
+        🆕 A conexão é própria (não sai do pool) e só existem EXPORTACOES_SIMULTANEAS ao mesmo tempo;
+        acima disso o primeiro next() levanta ExportacoesEsgotadas.
+        """
+        if not self.vagas_exportacao.acquire(timeout=self.pool.tempo_espera):
+            raise ExportacoesEsgotadas("Muitas exportações ao mesmo tempo, tente de novo em instantes")
+
+        conexao = None
+        leu_tudo = False
+        try:
+            conexao = mysql.connector.connect(**self.config)
+            cursor = conexao.cursor(buffered=False)
+
+            filtro_sql, valores = self.montar_filtros_consulta(filtros)
+            sql = f"SELECT {COLUNAS_SAIDA} FROM saida_carros" + filtro_sql + self.ORDEM_EXPORTACAO
+            cursor.execute(sql, valores)
+
+            total = 0
+            while True:
+                lote = cursor.fetchmany(tamanho_lote)
+                if not lote:
+                    break
+                total += len(lote)
+                yield ler_saidas(lote)
+
+            leu_tudo = True
+            cursor.close()
+            logger.info(f"📤 Exportação concluída: {total} registros")
+
+        finally:
+            if conexao is not None:
+                if not leu_tudo:
+                    logger.info("📤 Exportação encerrada antes do fim (resultado não lido descartado)")
+                # Conexão só desta exportação: fecha de verdade, sobrando resultado ou não
+                self.pool.fechar_silenciosamente(conexao)
+            self.vagas_exportacao.release()
+
+    # ========== 🆕 RESUMO DIÁRIO (ESTATÍSTICAS) ==========
+    # resumo_diario guarda, por dia × linha × fiscal: saídas, confirmadas e a soma/quantidade dos
+    # intervalos entre saídas (intervalo médio = soma / quantidade). É recalculado por dia inteiro
+    # quando a sessão é finalizada e quando o histórico é editado; o dia da sessão aberta é lido ao vivo.
+
+    # Mesmo agrupamento usado para gravar o resumo e para ler o dia da sessão aberta
+    SQL_RESUMO_POR_DIA = """SELECT DATE(data_trabalho), COALESCE(linha, ''), COALESCE(nome_fiscal, ''),
+                                   COUNT(*), COALESCE(SUM(saida_confirmada), 0),
+                                   COALESCE(TIME_TO_SEC(MAX(horario_saida)) - TIME_TO_SEC(MIN(horario_saida)), 0),
+                                   GREATEST(COUNT(horario_saida) - 1, 0)
+                            FROM saida_carros
+                            WHERE data_trabalho >= %s AND data_trabalho < %s + INTERVAL 1 DAY
+                            GROUP BY DATE(data_trabalho), COALESCE(linha, ''), COALESCE(nome_fiscal, '')"""
+
+    def atualizar_resumo_diario(self, data_inicio, data_fim=None):
+        """Recalcula o resumo dos dias [data_inicio, data_fim] a partir de saida_carros. Retorna True/False."""
+        data_fim = data_fim or data_inicio
         try:
             conexao = self.connect()
             cursor = conexao.cursor()
 
-            sql = """SELECT * FROM saida_carros 
-                     WHERE DATE(data_trabalho) = %s 
-                     ORDER BY horario_saida ASC"""
+            # Apaga e regrava o dia inteiro: cobre carros removidos, trocados de linha ou de data
+            cursor.execute("""DELETE FROM resumo_diario 
+                              WHERE data_trabalho >= %s AND data_trabalho < %s + INTERVAL 1 DAY""",
+                           (data_inicio, data_fim))
+            cursor.execute("""INSERT INTO resumo_diario (data_trabalho, linha, nome_fiscal, total_saidas, confirmadas,
+                                                         soma_intervalos_segundos, quantidade_intervalos) 
+                              """ + self.SQL_RESUMO_POR_DIA, (data_inicio, data_fim))
+            grupos = cursor.rowcount
+            conexao.commit()
+            self.invalidar_cache_estatisticas(str(data_inicio), str(data_fim))
+
+            cursor.close()
+            conexao.close()
+
+            logger.info(f"📊 Resumo diário atualizado ({data_inicio} a {data_fim}): {grupos} grupos")
+            return True
+
+        except Exception as e:
+            logger.error(f"❌ Erro ao atualizar resumo diário: {str(e)}")
+            return False
 
-            cursor.execute(sql, (data_consulta,))
-            resultado = cursor.fetchall()
+    def atualizar_resumo_datas_historico(self, *datas):
+        """Atualiza o resumo das datas alteradas, menos as das sessões abertas (essas são lidas ao vivo)"""
+        datas_abertas = self.datas_sessoes_abertas()
+        for data in {str(d)[:10] for d in datas if d}:
+            if data not in datas_abertas:
+                self.atualizar_resumo_diario(data)
 
+    def backfill_resumo_diario(self):
+        """Recalcula o resumo de TODO o histórico, de 31 em 31 dias. Retorna True/False."""
+        try:
+            conexao = self.connect()
+            cursor = conexao.cursor()
+            cursor.execute("SELECT MIN(data_trabalho), MAX(data_trabalho) FROM saida_carros")
+            primeira, ultima = cursor.fetchone()
             cursor.close()
             conexao.close()
 
-            print(f"📅 Consultando data {data_consulta}: {len(resultado)} registros encontrados")
-            return resultado
+            if primeira is None:
+                logger.info("📊 Nenhum registro para resumir")
+                return True
+
+            primeira = date.fromisoformat(str(primeira)[:10])
+            ultima = date.fromisoformat(str(ultima)[:10])
+            logger.info(f"📊 Recalculando resumo diário de {primeira} a {ultima}...")
+
+            inicio = primeira
+            while inicio <= ultima:
+                fim = min(inicio + timedelta(days=30), ultima)
+                if not self.atualizar_resumo_diario(inicio.isoformat(), fim.isoformat()):
+                    return False
+                inicio = fim + timedelta(days=1)
+            return True
 
         except Exception as e:
-            print(f"❌ Erro ao consultar por data: {str(e)}")
-            return []
+            logger.error(f"❌ Erro no backfill do resumo diário: {str(e)}")
+            return False
+
+    def atualizar_resumos_pendentes(self):
+        """Resume os dias com carros cadastrados depois do último resumo (ex.: sessão perdida num restart)
 
-    def consultar_por_filtros(self, filtros):
-        """Consulta registros com múltiplos filtros - COM STATUS DE CONFIRMAÇÃO."""
+        Roda uma vez na subida do servidor.
+        """
         try:
             conexao = self.connect()
             cursor = conexao.cursor()
+            cursor.execute("SELECT MAX(atualizado_em) FROM resumo_diario")
+            ultimo_resumo = cursor.fetchone()[0]
 
-            sql = "SELECT * FROM saida_carros WHERE 1=1"
-            valores = []
+            if ultimo_resumo is None:
+                cursor.close()
+                conexao.close()
+                return self.backfill_resumo_diario()
 
-            if filtros.get('data_especifica'):
-                sql += " AND DATE(data_trabalho) = %s"
-                valores.append(filtros['data_especifica'])
+            cursor.execute("SELECT DISTINCT DATE(data_trabalho) FROM saida_carros WHERE data_registro > %s",
+                           (ultimo_resumo,))
+            datas = [linha[0] for linha in cursor.fetchall()]
+            cursor.close()
+            conexao.close()
 
-            if filtros.get('data_inicio'):
-                sql += " AND DATE(data_trabalho) >= %s"
-                valores.append(filtros['data_inicio'])
+            for data in datas:
+                self.atualizar_resumo_diario(str(data)[:10])
+            return True
 
-            if filtros.get('data_fim'):
-                sql += " AND DATE(data_trabalho) <= %s"
-                valores.append(filtros['data_fim'])
+        except Exception as e:
+            logger.error(f"❌ Erro ao atualizar resumos pendentes: {str(e)}")
+            return False
 
-            if filtros.get('fiscal'):
-                sql += " AND nome_fiscal LIKE %s"
-                valores.append(f"%{filtros['fiscal']}%")
+    def agregar_resumos(self, data_inicio, data_fim, linhas):
+        """Junta as linhas (dia, linha, fiscal, total, confirmadas, soma_intervalos, qtd_intervalos)
+        no formato de resposta do /estatisticas"""
+        total_carros = 0
+        total_confirmadas = 0
+        por_fiscal = {}
+        por_linha = {}
+        por_dia = {}
+
+        for dia, linha, fiscal, total, confirmadas, soma_intervalos, quantidade_intervalos in linhas:
+            total, confirmadas = int(total), int(confirmadas)
+            total_carros += total
+            total_confirmadas += confirmadas
+
+            por_fiscal[fiscal] = por_fiscal.get(fiscal, 0) + total
+
+            dados_linha = por_linha.setdefault(linha, {'total': 0, 'confirmadas': 0, 'soma': 0, 'quantidade': 0})
+            dados_linha['total'] += total
+            dados_linha['confirmadas'] += confirmadas
+            dados_linha['soma'] += int(soma_intervalos or 0)
+            dados_linha['quantidade'] += int(quantidade_intervalos or 0)
+
+            dia = str(dia)[:10]
+            por_dia[dia] = por_dia.get(dia, 0) + total
+
+        return {
+            'periodo': {'inicio': data_inicio, 'fim': data_fim},
+            'total_carros': total_carros,
+            'total_confirmadas': total_confirmadas,
+            'por_fiscal': [{'fiscal': fiscal, 'total': total}
+                           for fiscal, total in sorted(por_fiscal.items(), key=lambda item: -item[1])],
+            'por_linha': [{'linha': linha, 'total': dados['total'], 'confirmadas': dados['confirmadas'],
+                           'intervalo_medio': round(dados['soma'] / dados['quantidade'] / 60, 1)
+                           if dados['quantidade'] else None}
+                          for linha, dados in sorted(por_linha.items(), key=lambda item: -item[1]['total'])],
+            'por_dia': [{'data': dia, 'total': total} for dia, total in sorted(por_dia.items(), reverse=True)]
+        }
 
-            if filtros.get('linha'):
-                sql += " AND linha LIKE %s"
-                valores.append(f"%{filtros['linha']}%")
+    def invalidar_cache_estatisticas(self, data_inicio=None, data_fim=None):
+        """Tira do cache os períodos que cruzam [data_inicio, data_fim] (sem datas: limpa tudo)"""
+        with self.lock_estatisticas:
+            self.cache_estatisticas_geracao += 1
+            if data_inicio is None:
+                self.cache_estatisticas.clear()
+                return
+            data_fim = data_fim or data_inicio
+            for chave in [c for c in self.cache_estatisticas if c[0] <= data_fim and data_inicio <= c[1]]:
+                del self.cache_estatisticas[chave]
 
-            if filtros.get('numero_carro'):
-                sql += " AND numero_carro LIKE %s"
-                valores.append(f"%{filtros['numero_carro']}%")
+    def obter_estatisticas_periodo(self, data_inicio, data_fim):
+        """Retorna estatísticas de um período específico.
 
-            if filtros.get('nome_motorista'):
-                sql += " AND nome_motorista LIKE %s"
-                valores.append(f"%{filtros['nome_motorista']}%")
+        🆕 Uma consulta só: lê o resumo_diario (uma linha por dia × linha × fiscal) e soma os dias
+        das sessões abertas ao vivo. Resultado fica no cache_estatisticas.
+        """
+        chave = (data_inicio, data_fim)
+        datas_abertas = self.datas_sessoes_abertas()
+        datas_ao_vivo = [d for d in datas_abertas if data_inicio <= d <= data_fim]
+        # Aberto = pode ganhar carros a qualquer momento (tem dia de sessão aberta ou hoje/futuro)
+        aberto = bool(datas_ao_vivo) or data_fim >= date.today().isoformat()
+
+        with self.lock_estatisticas:
+            entrada = self.cache_estatisticas.get(chave)
+            if entrada is not None:
+                # Uma sessão abriu/fechou/trocou de data: o período pode ter passado a ser "aberto"
+                valido = entrada['datas_abertas'] == datas_abertas and (entrada['expira_em'] is None or (
+                    relogio.monotonic() < entrada['expira_em'] and entrada['versao'] == self.versao_global))
+                if valido:
+                    self.cache_estatisticas.move_to_end(chave)
+                    return entrada['estatisticas']
+                del self.cache_estatisticas[chave]
+            geracao = self.cache_estatisticas_geracao
+            versao = self.versao_global
 
-            sql += " ORDER BY data_trabalho DESC, horario_saida ASC"
+        try:
+            conexao = self.connect()
+            cursor = conexao.cursor()
 
-            cursor.execute(sql, valores)
-            resultado = cursor.fetchall()
+            sql = self.SQL_RESUMO_PERIODO
+            valores = [data_inicio, data_fim]
+            if datas_ao_vivo:
+                sql += f" AND data_trabalho NOT IN ({', '.join(['%s'] * len(datas_ao_vivo))})"
+                valores.extend(datas_ao_vivo)
+
+            try:
+                cursor.execute(sql, valores)
+                linhas = cursor.fetchall()
+            except mysql.connector.Error as e:
+                if getattr(e, 'errno', None) != 1146:  # 1146 = tabela não existe (migração 4 ainda não rodou)
+                    raise
+                # Sem resumo: UMA passada agrupada no período todo, somada aqui no Python
+                logger.warning("⚠️ resumo_diario não existe, agrupando direto de saida_carros")
+                cursor.execute(self.SQL_RESUMO_POR_DIA, (data_inicio, data_fim))
+                linhas = cursor.fetchall()
+                datas_ao_vivo = []
+
+            # Dias das sessões abertas: ainda não foram resumidos, agrupa direto (poucas centenas de linhas, pelo índice)
+            for data_sessao in datas_ao_vivo:
+                cursor.execute(self.SQL_RESUMO_POR_DIA, (data_sessao, data_sessao))
+                linhas += cursor.fetchall()
 
             cursor.close()
             conexao.close()
 
-            print(f"🔍 Consulta com filtros: {len(resultado)} registros encontrados")
-            return resultado
+            estatisticas = self.agregar_resumos(data_inicio, data_fim, linhas)
+
+            with self.lock_estatisticas:
+                if geracao == self.cache_estatisticas_geracao:
+                    self.cache_estatisticas[chave] = {
+                        'estatisticas': estatisticas,
+                        'expira_em': relogio.monotonic() + self.cache_estatisticas_ttl if aberto else None,
+                        'versao': versao,
+                        'datas_abertas': datas_abertas
+                    }
+                    while len(self.cache_estatisticas) > self.cache_estatisticas_maximo:
+                        self.cache_estatisticas.popitem(last=False)
+
+            logger.info(f"📊 Estatísticas calculadas para {data_inicio} a {data_fim} ({len(linhas)} linhas de resumo)")
+            return estatisticas
 
         except Exception as e:
-            print(f"❌ Erro ao consultar com filtros: {str(e)}")
-            return []
+            logger.error(f"❌ Erro ao calcular estatísticas: {str(e)}")
+            return {}
 
-    def obter_estatisticas_periodo(self, data_inicio, data_fim):
-        """Retorna estatísticas de um período específico."""
+    # ========== 🆕 BUSCA (MOTORISTA, CARRO, FISCAL) ==========
+    # busca_termos guarda cada palavra normalizada (sem acento, minúscula) dos nomes e do número do carro,
+    # apontando para o registro. A busca é por prefixo ("jo" acha "João"), então usa a chave primária
+    # (termo, ...) em vez de varrer saida_carros com LIKE '%...%'.
+
+    CAMPOS_BUSCA = {'motorista': 'm', 'carro': 'c', 'fiscal': 'f'}
+
+    def termos_do_registro(self, id_registro, nome_fiscal, numero_carro, nome_motorista):
+        """Linhas (termo, campo, id_registro) de busca_termos para um registro"""
+        termos = set()
+        for termo in normalizar_termos(nome_motorista):
+            termos.add((termo, 'm', id_registro))
+        termos_carro = normalizar_termos(numero_carro)
+        for termo in termos_carro:
+            termos.add((termo, 'c', id_registro))
+        if len(termos_carro) > 1:
+            termos.add((''.join(termos_carro)[:60], 'c', id_registro))  # "A-12" também acha por "a12"
+        for termo in normalizar_termos(nome_fiscal):
+            termos.add((termo, 'f', id_registro))
+        return termos
+
+    def indexar_busca(self, cursor, registros):
+        """Coloca os termos de [(id, fiscal, numero_carro, motorista), ...] na busca (na transação de quem chamou)
+
+        Se falhar (ex.: migração 5 ainda não rodou) o cadastro segue normal; a busca se acerta com
+        `python database.py backfill-busca`.
+        """
+        linhas = []
+        for id_registro, nome_fiscal, numero_carro, nome_motorista in registros:
+            linhas.extend(self.termos_do_registro(id_registro, nome_fiscal, numero_carro, nome_motorista))
+        if not linhas:
+            return
+        try:
+            cursor.executemany("INSERT IGNORE INTO busca_termos (termo, campo, id_registro) VALUES (%s, %s, %s)",
+                               linhas)
+        except mysql.connector.Error as e:
+            logger.warning(f"⚠️ Índice de busca não atualizado: {str(e)}")
+
+    def remover_da_busca(self, cursor, ids):
+        """Tira os registros da busca (na transação de quem chamou)"""
+        if not ids:
+            return
+        try:
+            marcadores = ', '.join(['%s'] * len(ids))
+            cursor.execute(f"DELETE FROM busca_termos WHERE id_registro IN ({marcadores})", [int(i) for i in ids])
+        except mysql.connector.Error as e:
+            logger.warning(f"⚠️ Índice de busca não atualizado: {str(e)}")
+
+    def backfill_busca_termos(self, tamanho_lote=1000):
+        """Refaz busca_termos a partir de todo o histórico, em lotes por id. Retorna True/False."""
         try:
             conexao = self.connect()
             cursor = conexao.cursor()
 
-            # Total de carros no período
-            sql_total = """SELECT COUNT(*) FROM saida_carros 
-                          WHERE DATE(data_trabalho) BETWEEN %s AND %s"""
-            cursor.execute(sql_total, (data_inicio, data_fim))
-            total_carros = cursor.fetchone()[0]
-
-            # Carros por fiscal
-            sql_fiscal = """SELECT nome_fiscal, COUNT(*) as total 
-                           FROM saida_carros 
-                           WHERE DATE(data_trabalho) BETWEEN %s AND %s 
-                           GROUP BY nome_fiscal 
-                           ORDER BY total DESC"""
-            cursor.execute(sql_fiscal, (data_inicio, data_fim))
-            por_fiscal = cursor.fetchall()
-
-            # Carros por linha
-            sql_linha = """SELECT linha, COUNT(*) as total 
-                          FROM saida_carros 
-                          WHERE DATE(data_trabalho) BETWEEN %s AND %s 
-                          GROUP BY linha 
-                          ORDER BY total DESC"""
-            cursor.execute(sql_linha, (data_inicio, data_fim))
-            por_linha = cursor.fetchall()
-
-            # Carros por dia
-            sql_dia = """SELECT DATE(data_trabalho) as data, COUNT(*) as total 
-                        FROM saida_carros 
-                        WHERE DATE(data_trabalho) BETWEEN %s AND %s 
-                        GROUP BY DATE(data_trabalho) 
-                        ORDER BY data DESC"""
-            cursor.execute(sql_dia, (data_inicio, data_fim))
-            por_dia = cursor.fetchall()
+            cursor.execute("DELETE FROM busca_termos")
+            conexao.commit()
+
+            ultimo_id = 0
+            total = 0
+            while True:
+                cursor.execute("""SELECT id, nome_fiscal, numero_carro, nome_motorista FROM saida_carros 
+                                  WHERE id > %s ORDER BY id LIMIT %s""", (ultimo_id, tamanho_lote))
+                lote = cursor.fetchall()
+                if not lote:
+                    break
+                self.indexar_busca(cursor, lote)
+                conexao.commit()
+                ultimo_id = lote[-1][0]
+                total += len(lote)
 
             cursor.close()
             conexao.close()
 
-            estatisticas = {
-                'periodo': {'inicio': data_inicio, 'fim': data_fim},
-                'total_carros': total_carros,
-                'por_fiscal': [{'fiscal': row[0], 'total': row[1]} for row in por_fiscal],
-                'por_linha': [{'linha': row[0], 'total': row[1]} for row in por_linha],
-                'por_dia': [{'data': str(row[0]), 'total': row[1]} for row in por_dia]
-            }
+            logger.info(f"🔎 Índice de busca refeito: {total} registros")
+            return True
 
-            print(f"📊 Estatísticas calculadas para {data_inicio} a {data_fim}")
-            return estatisticas
+        except Exception as e:
+            logger.error(f"❌ Erro no backfill da busca: {str(e)}")
+            return False
+
+    def montar_consulta_busca(self, termos, limite, campo=None):
+        """🆕 NOVO: SELECT do ranking da busca (ids e pontos) para termos já normalizados → (sql, valores)"""
+        prefixos = [termo + '%' for termo in termos]
+        marcadores = ', '.join(['%s'] * len(termos))
+        encontrados = ' + '.join(['MAX(termo LIKE %s)'] * len(termos))
+        condicao = ' OR '.join(['termo LIKE %s'] * len(termos))
+
+        sql = f"""SELECT id_registro,
+                         {encontrados} AS palavras,
+                         SUM((CASE WHEN termo IN ({marcadores}) THEN 2 ELSE 1 END) *
+                             (CASE WHEN campo = 'f' THEN 1 ELSE 2 END)) AS pontos
+                  FROM busca_termos
+                  WHERE ({condicao})"""
+        valores = prefixos + termos + prefixos
+        if campo in self.CAMPOS_BUSCA:
+            sql += " AND campo = %s"
+            valores.append(self.CAMPOS_BUSCA[campo])
+        sql += """ GROUP BY id_registro
+                   HAVING palavras = %s
+                   ORDER BY pontos DESC, id_registro DESC
+                   LIMIT %s"""
+        valores.extend([len(termos), int(limite)])
+        return sql, valores
+
+    def buscar_registros(self, texto, limite=20, campo=None):
+        """Busca por nome do motorista, número do carro ou fiscal, com ranking
+
+        Todas as palavras precisam aparecer (como início de alguma palavra do registro).
+        Palavra inteira vale mais que prefixo; motorista/carro valem mais que fiscal; empate → mais recente.
+        Retorna {'status', 'registros': [(registro, pontos), ...]}.
+        """
+        termos = list(dict.fromkeys(normalizar_termos(texto)))
+        # Uma letra só casaria com metade do banco; vale apenas se for tudo que foi digitado
+        termos = [t for t in termos if len(t) >= 2] or termos[:1]
+        if not termos:
+            return {'status': 'sucesso', 'registros': []}
+
+        try:
+            conexao = self.connect()
+            cursor = conexao.cursor()
+
+            sql, valores = self.montar_consulta_busca(termos, limite, campo)
+            cursor.execute(sql, valores)
+            ranking = cursor.fetchall()
+
+            registros = []
+            if ranking:
+                marcadores_ids = ', '.join(['%s'] * len(ranking))
+                cursor.execute(f"SELECT {COLUNAS_SAIDA} FROM saida_carros WHERE id IN ({marcadores_ids})",
+                               [linha[0] for linha in ranking])
+                por_id = {registro.id: registro for registro in ler_saidas(cursor.fetchall())}
+                registros = [(por_id[id_registro], int(pontos)) for id_registro, _, pontos in ranking
+                             if id_registro in por_id]
+
+            cursor.close()
+            conexao.close()
+
+            logger.info(f"🔎 Busca '{texto}': {len(registros)} registros")
+            return {'status': 'sucesso', 'registros': registros}
 
         except Exception as e:
-            print(f"❌ Erro ao calcular estatísticas: {str(e)}")
-            return {}
+            logger.error(f"❌ Erro na busca: {str(e)}")
+            return {'status': 'erro', 'mensagem': f'Erro na busca: {str(e)}'}
 
     # ========== EDIÇÃO ==========
 
@@ -926,12 +2464,12 @@ class DatabaseManager:
             cursor = conexao.cursor()
 
             # Verificar se o registro existe antes de editar
-            sql_verificar = "SELECT * FROM saida_carros WHERE id = %s"
+            sql_verificar = "SELECT data_trabalho FROM saida_carros WHERE id = %s"
             cursor.execute(sql_verificar, (id_registro,))
-            registro = cursor.fetchone()
+            data_antiga = cursor.fetchone()
 
-            if not registro:
-                print(f"❌ Registro com ID {id_registro} não encontrado!")
+            if not data_antiga:
+                logger.error(f"❌ Registro com ID {id_registro} não encontrado!")
                 cursor.close()
                 conexao.close()
                 return False
@@ -944,10 +2482,10 @@ class DatabaseManager:
                     horario_obj = horario_saida
 
                 horario_final = horario_obj.replace(second=0, microsecond=0)
-                print(f"🕐 Horário de edição ajustado: {horario_saida} → {horario_final}")
+                logger.debug(f"🕐 Horário de edição ajustado: {horario_saida} → {horario_final}")
 
             except Exception as e:
-                print(f"❌ Erro ao processar horário na edição: {e}")
+                logger.error(f"❌ Erro ao processar horário na edição: {e}")
                 horario_final = horario_saida
 
             sql = """UPDATE saida_carros 
@@ -956,36 +2494,218 @@ class DatabaseManager:
                          linha = %s, 
                          numero_carro = %s, 
                          nome_motorista = %s, 
-                         horario_saida = %s 
+                         horario_saida = %s,
+                         atraso_segundos = TIMESTAMPDIFF(SECOND, TIMESTAMP(%s, %s), horario_confirmacao)
                      WHERE id = %s"""
 
-            valores = (nome_fiscal, data_trabalho, linha, numero_carro, nome_motorista, horario_final, id_registro)
+            # 🆕 Atraso refeito com a data/horário novos (fica NULL se a saída não foi confirmada)
+            valores = (nome_fiscal, data_trabalho, linha, numero_carro, nome_motorista, horario_final,
+                       data_trabalho, horario_final, id_registro)
 
             cursor.execute(sql, valores)
+            self.remover_da_busca(cursor, [id_registro])
+            self.indexar_busca(cursor, [(int(id_registro), nome_fiscal, numero_carro, nome_motorista)])
             conexao.commit()
+            # 🆕 A edição pode tirar o carro de um quadro aberto e colocar em outro
+            self.invalidar_todas_sessoes('carro_editado', {'id': int(id_registro)})
 
             cursor.close()
             conexao.close()
 
-            print(f"✅ Registro {id_registro} editado com sucesso!")
+            # 🆕 Edição no histórico: refaz o resumo do dia antigo e do novo
+            self.atualizar_resumo_datas_historico(data_antiga[0], data_trabalho)
+
+            logger.info(f"✅ Registro {id_registro} editado com sucesso!")
             return True
 
         except Exception as e:
-            print(f"❌ Erro ao editar registro: {str(e)}")
+            logger.error(f"❌ Erro ao editar registro: {str(e)}")
             return False
 
     # ========== UTILITÁRIOS ==========
 
+    # 🆕 NOVO: Migrações versionadas do banco, aplicadas em ordem e registradas em schema_migracoes.
+    # Cada passo é um comando SQL ou um método deste objeto que retorna True/False.
+    # NUNCA altere uma migração já publicada - crie uma nova versão.
+    MIGRACOES = [
+        (1, "Coluna saida_confirmada", [
+            adicionar_coluna_saida_confirmada,
+        ]),
+        (2, "Índice das consultas da sessão (fiscal, data, linha, confirmação, horário)", [
+            """CREATE INDEX idx_saida_sessao
+               ON saida_carros (nome_fiscal, data_trabalho, linha, saida_confirmada, horario_saida)""",
+        ]),
+        (3, "Índice das consultas de histórico por data", [
+            """CREATE INDEX idx_saida_data
+               ON saida_carros (data_trabalho, horario_saida)""",
+        ]),
+        (4, "Tabela resumo_diario (estatísticas por dia × linha × fiscal)", [
+            """CREATE TABLE resumo_diario (
+                   data_trabalho DATE NOT NULL,
+                   linha VARCHAR(100) NOT NULL,
+                   nome_fiscal VARCHAR(100) NOT NULL,
+                   total_saidas INT NOT NULL,
+                   confirmadas INT NOT NULL,
+                   soma_intervalos_segundos INT NOT NULL,
+                   quantidade_intervalos INT NOT NULL,
+                   atualizado_em DATETIME DEFAULT CURRENT_TIMESTAMP,
+                   PRIMARY KEY (data_trabalho, linha, nome_fiscal)
+               )""",
+            backfill_resumo_diario,
+        ]),
+        (5, "Tabela busca_termos (busca por prefixo sem acento: motorista, carro, fiscal)", [
+            """CREATE TABLE busca_termos (
+                   termo VARCHAR(60) NOT NULL,
+                   campo CHAR(1) NOT NULL,
+                   id_registro INT NOT NULL,
+                   PRIMARY KEY (termo, campo, id_registro),
+                   KEY idx_busca_registro (id_registro)
+               )""",
+            backfill_busca_termos,
+        ]),
+        (6, "Momento da confirmação de saída e atraso em relação ao horário marcado", [
+            "ALTER TABLE saida_carros ADD COLUMN horario_confirmacao DATETIME NULL",
+            "ALTER TABLE saida_carros ADD COLUMN atraso_segundos INT NULL",
+        ]),
+        (7, "Tabela sessoes_ativas (cabeçalho e intervalos de cada sessão, para sobreviver a um restart)", [
+            """CREATE TABLE sessoes_ativas (
+                   id_sessao VARCHAR(40) NOT NULL PRIMARY KEY,
+                   nome_fiscal VARCHAR(100) NOT NULL,
+                   data_trabalho DATE NOT NULL,
+                   intervalo_atual INT NOT NULL,
+                   intervalos_por_linha TEXT NOT NULL,
+                   atualizado_em DATETIME DEFAULT CURRENT_TIMESTAMP
+               )""",
+        ]),
+        (8, "Tabela linhas (cadastro das linhas: intervalo padrão, horário de operação e capacidade)", [
+            """CREATE TABLE linhas (
+                   nome VARCHAR(100) NOT NULL PRIMARY KEY,
+                   intervalo_padrao INT NOT NULL DEFAULT 8,
+                   hora_inicio TIME NULL,
+                   hora_fim TIME NULL,
+                   capacidade INT NULL,
+                   ativa BOOLEAN NOT NULL DEFAULT TRUE,
+                   ordem INT NOT NULL DEFAULT 0
+               )""",
+            """INSERT IGNORE INTO linhas (nome, intervalo_padrao, ordem)
+               VALUES ('Centro x Vila Verde', 8, 1), ('Centro x Rasa', 8, 2)""",
+        ]),
+    ]
+
+    # Erros que significam "já estava feito" (rodar a migração de novo não é problema)
+    ERROS_MIGRACAO_IGNORADOS = (
+        1060,  # Duplicate column name
+        1061,  # Duplicate key name
+        1050,  # Table already exists
+    )
+
+    def executar_migracoes(self):
+        """🆕 NOVO: Aplica as migrações que ainda não rodaram neste banco. Retorna True se ficou tudo em dia."""
+        try:
+            conexao = self.connect()
+            cursor = conexao.cursor()
+
+            cursor.execute("""CREATE TABLE IF NOT EXISTS schema_migracoes (
+                                versao INT PRIMARY KEY,
+                                descricao VARCHAR(200) NOT NULL,
+                                aplicada_em DATETIME DEFAULT CURRENT_TIMESTAMP
+                              )""")
+            conexao.commit()
+
+            cursor.execute("SELECT versao FROM schema_migracoes")
+            aplicadas = {linha[0] for linha in cursor.fetchall()}
+
+            pendentes = [m for m in self.MIGRACOES if m[0] not in aplicadas]
+            if not pendentes:
+                logger.info(f"✅ Banco em dia (versão {max(aplicadas) if aplicadas else 0})")
+                cursor.close()
+                conexao.close()
+                return True
+
+            for versao, descricao, passos in pendentes:
+                logger.info(f"🔧 Migração {versao}: {descricao}")
+
+                for passo in passos:
+                    if callable(passo):
+                        if not passo(self):
+                            raise RuntimeError(f"Passo '{passo.__name__}' da migração {versao} falhou")
+                        continue
+
+                    try:
+                        cursor.execute(passo)
+                    except mysql.connector.Error as e:
+                        if e.errno not in self.ERROS_MIGRACAO_IGNORADOS:
+                            raise
+                        logger.info(f"   ↪️ Já existia, seguindo: {e.msg}")
+
+                cursor.execute("INSERT INTO schema_migracoes (versao, descricao) VALUES (%s, %s)",
+                               (versao, descricao))
+                conexao.commit()
+                logger.info(f"✅ Migração {versao} aplicada")
+
+            cursor.close()
+            conexao.close()
+            return True
+
+        except Exception as e:
+            logger.error(f"❌ Erro nas migrações: {str(e)}")
+            return False
+
+    def consultas_quentes(self):
+        """🆕 Consultas mais frequentes, montadas pelos mesmos métodos/constantes que as executam,
+        e o índice que cada uma deveria usar (para verificar_indices) → {nome: (sql, valores, índice)}"""
+        dia = '2000-01-01'
+        return {
+            'quadro_da_sessao': (self.SQL_QUADRO_SESSAO, ('Fiscal', dia), 'idx_saida_sessao'),
+            'pendentes_da_linha': (self.SQL_PENDENTES_LINHA, ('Fiscal', dia, 'Linha'), 'idx_saida_sessao'),
+            'consulta_por_data': self.montar_consulta_historico({'data_especifica': dia},
+                                                                self.TAMANHO_PAGINA_PADRAO) + ('idx_saida_data',),
+            'consulta_por_data_pagina_2': self.montar_consulta_historico(
+                {'data_especifica': dia}, self.TAMANHO_PAGINA_PADRAO,
+                codificar_cursor([dia, 0, 0])) + ('idx_saida_data',),
+            'estatisticas_periodo': (self.SQL_RESUMO_PERIODO, (dia, '2000-01-31'), 'PRIMARY'),
+            'busca_por_prefixo': self.montar_consulta_busca(['joao'], 20) + ('PRIMARY',),
+        }
+
+    def verificar_indices(self):
+        """🆕 NOVO: Roda EXPLAIN nas consultas quentes e confere se usam o índice esperado
+
+        Retorna {nome: {'indice_usado', 'indice_esperado', 'tipo_acesso', 'filesort', 'ok'}}.
+        `filesort` diz se o ORDER BY precisou ordenar fora do índice (informativo, não entra no `ok`).
+        Com a tabela quase vazia o MySQL pode preferir varrer tudo; o resultado vale para tabelas com volume.
+        """
+        resultado = {}
+        conexao = self.connect()
+        cursor = conexao.cursor(dictionary=True)
+
+        for nome, (sql, parametros, esperado) in self.consultas_quentes().items():
+            cursor.execute("EXPLAIN " + sql, parametros)
+            plano = cursor.fetchall()[0]
+            usado = plano.get('key')
+            filesort = 'filesort' in (plano.get('Extra') or '')
+            resultado[nome] = {
+                'indice_usado': usado,
+                'indice_esperado': esperado,
+                'tipo_acesso': plano.get('type'),
+                'filesort': filesort,
+                'ok': usado == esperado
+            }
+            logger.info(f"{'✅' if usado == esperado else '⚠️'} {nome}: usa {usado or 'NENHUM índice'} "
+                        f"(esperado {esperado}, acesso {plano.get('type')}{', com filesort' if filesort else ''})")
+
+        cursor.close()
+        conexao.close()
+        return resultado
+
     def executar_migracao_inicial(self):
-        """Execute esta função UMA VEZ para preparar o banco de dados"""
-        print("🔧 Executando migração do banco de dados...")
-        resultado = self.adicionar_coluna_saida_confirmada()
+        """Prepara o banco de dados (🆕 agora roda todas as migrações pendentes, pode chamar sempre)"""
+        logger.info("🔧 Executando migração do banco de dados...")
+        resultado = self.executar_migracoes()
 
         if resultado:
-            print("✅ Migração concluída com sucesso!")
-            print("📝 Agora o sistema pode persistir confirmações de saída!")
+            logger.info("✅ Migração concluída com sucesso!")
         else:
-            print("❌ Erro na migração!")
+            logger.error("❌ Erro na migração!")
 
         return resultado
 
@@ -995,9 +2715,10 @@ class DatabaseManager:
             conexao = self.connect()
             cursor = conexao.cursor()
 
-            sql = "UPDATE saida_carros SET saida_confirmada = FALSE"
+            sql = "UPDATE saida_carros SET saida_confirmada = FALSE, horario_confirmacao = NULL, atraso_segundos = NULL"
             cursor.execute(sql)
             conexao.commit()
+            self.invalidar_todas_sessoes('quadro_alterado')
 
             # Contar quantos foram atualizados
             sql_count = "SELECT COUNT(*) FROM saida_carros"
@@ -1007,11 +2728,13 @@ class DatabaseManager:
             cursor.close()
             conexao.close()
 
-            print(f"🔄 CORREÇÃO: {total} carros agora estão como 'AGUARDANDO' (saida_confirmada = FALSE)")
+            self.backfill_resumo_diario()
+
+            logger.info(f"🔄 CORREÇÃO: {total} carros agora estão como 'AGUARDANDO' (saida_confirmada = FALSE)")
             return True
 
         except Exception as e:
-            print(f"❌ Erro ao resetar confirmações: {str(e)}")
+            logger.error(f"❌ Erro ao resetar confirmações: {str(e)}")
             return False
 
     def obter_intervalo_atual(self):
@@ -1020,14 +2743,29 @@ class DatabaseManager:
 
 
 if __name__ == '__main__':
+    import sys
+
+    configurar_logging()
     db = DatabaseManager()
     try:
         conexao = db.connect()
-        print("Conexão criada com sucesso!")
+        logger.info("Conexão criada com sucesso!")
         conexao.close()
 
-        # DESCOMENTE A LINHA ABAIXO PARA EXECUTAR A MIGRAÇÃO UMA VEZ:
-        # db.executar_migracao_inicial()
+        # 🆕 Comandos de manutenção:
+        #   python database.py migrar            → aplica as migrações pendentes
+        #   python database.py verificar-indices → EXPLAIN das consultas quentes
+        #   python database.py backfill-resumo   → recalcula o resumo_diario de todo o histórico
+        #   python database.py backfill-busca    → refaz o índice de busca (busca_termos)
+        comando = sys.argv[1] if len(sys.argv) > 1 else None
+        if comando == 'migrar':
+            db.executar_migracao_inicial()
+        elif comando == 'verificar-indices':
+            db.verificar_indices()
+        elif comando == 'backfill-resumo':
+            db.backfill_resumo_diario()
+        elif comando == 'backfill-busca':
+            db.backfill_busca_termos()
 
     except Exception as e:
-        print(f"Erro na conexão: {e}")
\ No newline at end of file
+        logger.error(f"Erro na conexão: {e}")
\ No newline at end of file
@@ -0,0 +1,83 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+# 🆕 NOVO: Logging do sistema (níveis + fila não bloqueante + amostragem)
+#
+# LOG_LEVEL      → DEBUG, INFO (padrão), WARNING, ERROR
+# LOG_AMOSTRAGEM → mensagens por registro (marcadas com AMOSTRAR) saem 1 a cada N (padrão 100)
+
+FORMATO = '%(asctime)s %(levelname)-7s [%(name)s] %(message)s'
+
+# Use em mensagens repetidas por registro: logger.debug("...", x, extra=AMOSTRAR)
+AMOSTRAR = {'amostrar': True}
+
+_ouvinte_fila = None
+_lock_configuracao = threading.Lock()
+
+
+class FiltroAmostragem(logging.Filter):
+    """Deixa passar só 1 a cada N mensagens marcadas com AMOSTRAR (contando por linha de código)"""
+
+    def __init__(self, taxa=100):
+        super().__init__()
+        self.taxa = max(1, taxa)
+        self.contadores = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, 'amostrar', False):
+            return True
+
+        chave = (record.pathname, record.lineno)
+        with self.lock:
+            contador = self.contadores.get(chave, 0)
+            self.contadores[chave] = contador + 1
+
+        if contador % self.taxa:
+            return False
+        if contador:
+            record.msg = f"{record.msg} (amostra 1/{self.taxa})"
+        return True
+
+
+def obter_logger(nome):
+    """Logger do sistema; todos ficam abaixo de 'prancheta'"""
+    return logging.getLogger(f'prancheta.{nome}')
+
+
+def configurar_logging(nivel=None, taxa_amostragem=None):
+    """Liga o logging: as mensagens vão para uma fila e uma thread separada escreve no stdout
+
+    Assim quem está atendendo a requisição nunca fica esperando o terminal/log do Render.
+    Pode ser chamada mais de uma vez; só a primeira configura.
+    """
+    global _ouvinte_fila
+
+    with _lock_configuracao:
+        if _ouvinte_fila is not None:
+            return
+
+        nivel = (nivel or os.environ.get('LOG_LEVEL', 'INFO')).upper()
+        if taxa_amostragem is None:
+            taxa_amostragem = int(os.environ.get('LOG_AMOSTRAGEM', 100))
+
+        saida = logging.StreamHandler(sys.stdout)
+        saida.setFormatter(logging.Formatter(FORMATO, datefmt='%H:%M:%S'))
+
+        fila = queue.SimpleQueue()
+        manipulador_fila = logging.handlers.QueueHandler(fila)
+        manipulador_fila.addFilter(FiltroAmostragem(taxa_amostragem))
+
+        raiz = logging.getLogger('prancheta')
+        raiz.setLevel(getattr(logging, nivel, logging.INFO))
+        raiz.addHandler(manipulador_fila)
+        raiz.propagate = False
+
+        _ouvinte_fila = logging.handlers.QueueListener(fila, saida, respect_handler_level=True)
+        _ouvinte_fila.start()
+        atexit.register(_ouvinte_fila.stop)
\ No newline at end of file
@@ -0,0 +1,55 @@
+import json
+
+try:
+    import orjson  # opcional: sem ele usa o json da biblioteca padrão (mesmo resultado, mais devagar)
+except ImportError:
+    orjson = None
+
+# 🆕 NOVO: JSON das respostas já em bytes, montado a partir de pedaços prontos
+#
+# Cada carro do quadro guarda o próprio JSON codificado (SaidaCarro.para_json_bytes). Como o registro
+# é trocado por outro quando muda, o pedaço nunca fica velho. A resposta do quadro só junta esses
+# pedaços com o pouco que muda a cada consulta (total, intervalo...), sem codificar os carros de novo.
+
+_codificador = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+class Fragmento(bytes):
+    """JSON já codificado (UTF-8); entra na resposta do jeito que está"""
+
+
+def codificar(valor):
+    """Valor Python → bytes JSON (UTF-8, sem espaços)"""
+    if orjson is not None:
+        return orjson.dumps(valor, option=orjson.OPT_NON_STR_KEYS)
+    return _codificador.encode(valor).encode('utf-8')
+
+
+def tem_fragmento(valor):
+    """True se há algum Fragmento dentro de `valor` (em qualquer nível de dicts e listas)"""
+    if isinstance(valor, Fragmento):
+        return True
+    if isinstance(valor, dict):
+        return any(tem_fragmento(item) for item in valor.values())
+    if isinstance(valor, (list, tuple)):
+        return any(tem_fragmento(item) for item in valor)
+    return False
+
+
+def montar(valor):
+    """Como `codificar`, mas aceita Fragmento em qualquer ponto de dicts e listas
+
+    Só as partes que contêm pedaços prontos são montadas aos poucos; o resto é codificado de uma vez.
+    """
+    if isinstance(valor, Fragmento):
+        return valor
+    if not tem_fragmento(valor):
+        return codificar(valor)
+
+    if isinstance(valor, dict):
+        return b'{' + b','.join(codificar(str(chave)) + b':' + montar(item)
+                                for chave, item in valor.items()) + b'}'
+
+    if all(isinstance(item, Fragmento) for item in valor):
+        return b'[' + b','.join(valor) + b']'
+    return b'[' + b','.join(montar(item) for item in valor) + b']'
\ No newline at end of file
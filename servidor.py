@@ -1,45 +1,364 @@
+import csv
+import gzip
+import io
+import hashlib
+import http.cookies
 import http.server
+import queue
+import selectors
+import socket
 import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
 from urllib.parse import urlparse, parse_qs
 import json
-from database import DatabaseManager
+import logging
+import math
+import analise
+import serializacao
+from database import DatabaseManager, ExportacoesEsgotadas, LinhaSemVaga
+from logs import configurar_logging, obter_logger
 import os
+import re
+
+try:
+    import brotli  # opcional: sem ele as páginas saem só em gzip
+except ImportError:
+    brotli = None
+
+logger = obter_logger('servidor')
+logger_acesso = obter_logger('acesso')
+
+
+class CacheArquivosEstaticos:
+    """🆕 NOVO: Páginas HTML guardadas em memória, já comprimidas em gzip (e brotli, se instalado)
+
+    O arquivo só é lido de novo quando muda no disco (data de modificação ou tamanho).
+    """
+
+    def __init__(self):
+        self.arquivos = {}
+        self.lock = threading.Lock()
+
+    def obter(self, caminho):
+        """Retorna o dict da página (conteúdo, variantes comprimidas, ETag, Last-Modified)"""
+        info = os.stat(caminho)  # FileNotFoundError sobe para quem chamou
+        assinatura = (info.st_mtime_ns, info.st_size)
+
+        entrada = self.arquivos.get(caminho)
+        if entrada is not None and entrada['assinatura'] == assinatura:
+            return entrada
+
+        with self.lock:
+            entrada = self.arquivos.get(caminho)
+            if entrada is not None and entrada['assinatura'] == assinatura:
+                return entrada
+
+            with open(caminho, 'rb') as arquivo:
+                conteudo = arquivo.read()
+
+            variantes = {'identity': conteudo, 'gzip': gzip.compress(conteudo, compresslevel=9)}
+            if brotli is not None:
+                variantes['br'] = brotli.compress(conteudo, quality=11)
+
+            entrada = {
+                'assinatura': assinatura,
+                'variantes': variantes,
+                'etag': 'W/"' + hashlib.sha1(conteudo).hexdigest()[:16] + '"',
+                'modificado_em': int(info.st_mtime),
+                'last_modified': formatdate(info.st_mtime, usegmt=True)
+            }
+            self.arquivos[caminho] = entrada
+
+        tamanhos = ", ".join(f"{nome}={len(dados)}B" for nome, dados in variantes.items())
+        logger.info(f"📄 {caminho} carregado em memória ({tamanhos})")
+        return entrada
+
+
+class CanalEventos:
+    """🆕 NOVO: Canal Server-Sent Events (GET /eventos)
+
+    Recebe as alterações do DatabaseManager (ouvinte de mutação) e empurra para
+    os painéis conectados (🆕 só os da sessão que mudou). Uma única thread faz os envios,
+    então os navegadores conectados não ocupam workers do pool.
+    🆕 Os sockets ficam sem bloqueio, cada um com seu buffer do que falta enviar: painel com a rede
+    travada não atrasa os outros; se acumular mais que `limite_pendente` bytes, é desconectado
+    (o EventSource reconecta sozinho e o painel busca o quadro de novo).
+    """
+
+    def __init__(self, max_clientes=200, intervalo_heartbeat=15, limite_pendente=64 * 1024):
+        self.max_clientes = max_clientes
+        self.intervalo_heartbeat = intervalo_heartbeat
+        self.limite_pendente = limite_pendente
+        self.clientes = {}  # {socket: {'sessao': id da sessão, 'pendente': bytearray, 'vigiado': bool}}
+        self.lock = threading.Lock()
+        self.fila = queue.Queue()
+
+        # Seletor: sockets com envio pendente (esperando poder escrever) + campainha para acordar a thread
+        self.seletor = selectors.DefaultSelector()
+        self.despertador, self.campainha = socket.socketpair()
+        self.despertador.setblocking(False)
+        self.campainha.setblocking(False)
+        self.seletor.register(self.despertador, selectors.EVENT_READ)
+
+        threading.Thread(target=self.loop_envio, name='eventos-sse', daemon=True).start()
+
+    def formatar(self, tipo, dados, versao):
+        """Monta a mensagem no formato SSE (o tipo vai dentro do JSON, o cliente usa onmessage)"""
+        corpo = json.dumps({"tipo": tipo, "dados": dados, "versao": versao}, ensure_ascii=False, default=str)
+        return f"id: {versao}\ndata: {corpo}\n\n".encode('utf-8')
+
+    def acordar(self):
+        """Tira a thread de envio do select (evento novo ou painel novo)"""
+        try:
+            self.campainha.send(b'\0')
+        except BlockingIOError:
+            pass  # já tem campainha tocada esperando
+
+    def publicar(self, tipo, dados, versao, id_sessao):
+        """Ouvinte do DatabaseManager - só enfileira, quem envia é a thread do canal"""
+        self.fila.put((self.formatar(tipo, dados, versao), id_sessao))
+        self.acordar()
+
+    def assinar(self, conexao, mensagem_inicial, id_sessao):
+        """Adiciona um navegador ao canal. Retorna False se o canal estiver lotado."""
+        with self.lock:
+            if len(self.clientes) >= self.max_clientes:
+                return False
+            conexao.setblocking(False)
+            self.clientes[conexao] = {'sessao': id_sessao, 'pendente': bytearray(mensagem_inicial), 'vigiado': False}
+            conectados = len(self.clientes)
+        self.acordar()
+
+        logger.info(f"📡 Painel conectado aos eventos ({conectados} conectados)")
+        return True
+
+    def loop_envio(self):
+        """Envia cada evento para os clientes da sessão; sem eventos, manda um comentário de heartbeat (para todos)"""
+        proximo_heartbeat = time.monotonic() + self.intervalo_heartbeat
+        while True:
+            self.seletor.select(timeout=max(0, proximo_heartbeat - time.monotonic()))
+            try:
+                while self.despertador.recv(4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+            mensagens = []
+            while True:
+                try:
+                    mensagens.append(self.fila.get_nowait())
+                except queue.Empty:
+                    break
+            if mensagens:
+                proximo_heartbeat = time.monotonic() + self.intervalo_heartbeat
+            elif time.monotonic() >= proximo_heartbeat:
+                mensagens.append((b': ping\n\n', None))  # heartbeat vai para todos
+                proximo_heartbeat = time.monotonic() + self.intervalo_heartbeat
+
+            with self.lock:
+                clientes = list(self.clientes.items())
+
+            desconectados = []
+            for conexao, cliente in clientes:
+                for mensagem, id_sessao in mensagens:
+                    if id_sessao in (None, cliente['sessao']):
+                        cliente['pendente'] += mensagem
+                if cliente['pendente'] and not self.enviar_pendente(conexao, cliente):
+                    desconectados.append((conexao, cliente))
+
+            if desconectados:
+                with self.lock:
+                    for conexao, cliente in desconectados:
+                        self.clientes.pop(conexao, None)
+                        if cliente['vigiado']:
+                            self.seletor.unregister(conexao)
+                        try:
+                            conexao.close()
+                        except OSError:
+                            pass
+                    conectados = len(self.clientes)
+                logger.info(f"📡 {len(desconectados)} painel(is) desconectado(s) dos eventos ({conectados} conectados)")
+
+    def enviar_pendente(self, conexao, cliente):
+        """Manda o que couber agora no socket, sem esperar. False = painel caiu ou ficou para trás demais"""
+        try:
+            enviados = conexao.send(cliente['pendente'])
+            del cliente['pendente'][:enviados]
+        except BlockingIOError:
+            pass
+        except OSError:
+            return False
+
+        if len(cliente['pendente']) > self.limite_pendente:
+            return False
+
+        # Sobrou algo: o seletor avisa quando o socket puder receber mais
+        vigiar = bool(cliente['pendente'])
+        if vigiar != cliente['vigiado']:
+            if vigiar:
+                self.seletor.register(conexao, selectors.EVENT_WRITE)
+            else:
+                self.seletor.unregister(conexao)
+            cliente['vigiado'] = vigiar
+        return True
 
 
 class MeuServidor(http.server.BaseHTTPRequestHandler):
     # Instância GLOBAL do DatabaseManager (compartilhada)
     db_global = DatabaseManager()
 
+    # 🆕 NOVO: index.html e motorista.html ficam em memória (e já comprimidos)
+    paginas = CacheArquivosEstaticos()
+
+    # 🆕 NOVO: Canal de eventos em tempo real, alimentado pelas alterações do banco
+    canal_eventos = CanalEventos(max_clientes=int(os.environ.get('SSE_MAX_CLIENTES', 200)))
+    db_global.adicionar_ouvinte_mutacao(canal_eventos.publicar)
+
+    # 🆕 NOVO: HTTP/1.1 com keep-alive - o celular reaproveita a conexão entre uma consulta e outra
+    protocol_version = 'HTTP/1.1'
+    # Segundos esperando o cliente mandar uma requisição (parado entre requisições também é o limite)
+    timeout = int(os.environ.get('KEEPALIVE_TIMEOUT', 15))
+    # Depois de tantas requisições na mesma conexão ela é fechada (o navegador abre outra)
+    max_requisicoes_conexao = int(os.environ.get('KEEPALIVE_MAX_REQUISICOES', 100))
+    # Cabeçalhos e corpo saem em dois envios: sem isso o Nagle segura o corpo numa conexão reaproveitada
+    disable_nagle_algorithm = True
+    fechar_apos_resposta = False
+
+    # 🆕 NOVO: Sessão do quadro de cada requisição: cabeçalho X-Sessao, ?sessao= ou cookie "sessao"
+    # (abrir /?sessao=ponto2 grava o cookie). Sem nada disso, sessão 'padrao'.
+    FORMATO_SESSAO = re.compile(r'^[A-Za-z0-9_-]{1,40}$')
+    sessao_pedida = None
+
     def __init__(self, *args, **kwargs):
         # Usar a instância global em vez de criar nova
         self.db = MeuServidor.db_global
         super().__init__(*args, **kwargs)
 
+    def handle(self):
+        """🆕 Atende a requisição e, se a conexão continuar aberta, libera o worker
+
+        Entre uma consulta e outra do painel a conexão espera no servidor (fora do pool);
+        quando a próxima requisição chega ela volta para um worker.
+        """
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self.tem_requisicao_pendente():
+            self.handle_one_request()
+
+        if not self.close_connection:
+            self.server.manter_aberta(self.request)
+
+    def tem_requisicao_pendente(self):
+        """True se a próxima requisição já chegou (ou já está no buffer de leitura)"""
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def parse_request(self):
+        """🆕 Conta as requisições da conexão; a última antes do limite avisa que vai fechar"""
+        if not super().parse_request():
+            return False
+        atendidas = self.server.contar_requisicao(self.request)
+        if atendidas >= self.max_requisicoes_conexao and not self.close_connection:
+            self.fechar_apos_resposta = True
+        return True
+
+    def end_headers(self):
+        if self.fechar_apos_resposta and not self.close_connection:
+            self.fechar_apos_resposta = False
+            self.send_header('Connection', 'close')  # também marca close_connection
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        """🆕 NOVO: Log de acesso vai para o logging (fila) em vez de escrever direto no stderr"""
+        logger_acesso.info("%s %s", self.address_string(), format % args)
+
     def enviar_cabecalhos_cors(self):
         """Adiciona cabeçalhos CORS para permitir requisições do frontend"""
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match, X-Sessao')
+        self.send_header('Access-Control-Expose-Headers', 'ETag')
 
     def do_OPTIONS(self):
         """Responde a requisições OPTIONS (necessário para CORS)"""
         self.send_response(200)
+        self.send_header('Content-Length', '0')
         self.enviar_cabecalhos_cors()
         self.end_headers()
 
-    def enviar_json(self, dados):
-        """Envia resposta em JSON"""
-        resposta = json.dumps(dados, ensure_ascii=False)
+    def enviar_json(self, dados, etag=None):
+        """Envia resposta em JSON (🆕 com ETag, se informado)
+
+        🆕 `dados` pode conter serializacao.Fragmento (JSON já codificado, ex.: carros do quadro)
+        """
+        resposta = serializacao.montar(dados)
 
         self.send_response(200)
         self.send_header('Content-type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(resposta)))
+        if etag and dados.get('status') != 'erro':
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
         self.enviar_cabecalhos_cors()
         self.end_headers()
-        self.wfile.write(resposta.encode('utf-8'))
+        self.wfile.write(resposta)
+
+    def responder_se_nao_modificado(self):
+        """🆕 NOVO: Responde 304 se o navegador já tem a versão atual do quadro
+
+        Retorna (respondeu, etag). O ETag é lido ANTES de montar os dados: se o quadro
+        mudar no meio, o cliente recebe dados novos com ETag velho e só busca de novo.
+        """
+        etag = self.db.obter_etag_quadro()
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.enviar_cabecalhos_cors()
+            self.end_headers()
+            return True, etag
+        return False, etag
+
+    def ler_sessao(self, parametros):
+        """🆕 NOVO: Id da sessão pedido na requisição (None = padrão)"""
+        candidatos = [self.headers.get('X-Sessao'), parametros.get('sessao', [None])[0]]
+        if self.headers.get('Cookie'):
+            try:
+                cookie = http.cookies.SimpleCookie(self.headers['Cookie']).get('sessao')
+            except http.cookies.CookieError:
+                cookie = None
+            candidatos.append(cookie.value if cookie else None)
+
+        for id_sessao in candidatos:
+            if id_sessao and self.FORMATO_SESSAO.match(id_sessao):
+                return id_sessao
+        return None
+
+    def entrar_na_sessao(self, parametros):
+        """🆕 NOVO: Liga esta thread à sessão da requisição; False (e resposta de erro) se não der"""
+        self.sessao_pedida = parametros.get('sessao', [None])[0]
+        if self.db.usar_sessao(self.ler_sessao(parametros)):
+            return True
+        self.enviar_json({"status": "erro", "mensagem": "Limite de sessões atingido, tente mais tarde"})
+        return False
 
     def do_GET(self):
         """Responde a requisições GET (páginas, dados)"""
-        caminho = self.path
+        # 🆕 Separa a query string (?limite=...&cursor=...) do caminho
+        url = urlparse(self.path)
+        caminho = url.path
+        parametros = parse_qs(url.query)
+
+        if not self.entrar_na_sessao(parametros):
+            return
 
         if caminho == '/' or caminho == '/index.html':
             # Página inicial - Painel do Presidente
@@ -51,8 +370,8 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
             # Retorna dados da sessão atual (não todos os registros)
             self.enviar_lista_carros_sessao()
         elif caminho == '/listar-todos':
-            # Retorna TODOS os dados do banco
-            self.enviar_lista_carros()
+            # Retorna TODOS os dados do banco (🆕 paginado: ?limite=&cursor=&contar=1)
+            self.enviar_lista_carros(parametros)
         elif caminho == '/sessao-atual':
             # Retorna informações da sessão atual
             self.enviar_sessao_atual()
@@ -65,32 +384,63 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
         elif caminho == '/intervalos-linhas':
             # 🆕 NOVO: Retorna intervalos de todas as linhas
             self.enviar_intervalos_todas_linhas()
+        elif caminho == '/eventos':
+            # 🆕 NOVO: Stream de eventos (SSE) com as alterações do quadro
+            self.abrir_canal_eventos()
+        elif caminho == '/buscar':
+            # 🆕 NOVO: Busca por motorista, carro ou fiscal (?q=joao&campo=motorista&limite=20)
+            self.enviar_busca(parametros)
+        elif caminho == '/exportar':
+            # 🆕 NOVO: Exporta o histórico filtrado em CSV ou JSON Lines (streaming)
+            self.exportar_historico(parametros)
+        elif caminho == '/metricas-pool':
+            # 🆕 NOVO: Métricas do pool de conexões com o banco
+            self.enviar_metricas_pool()
+        elif caminho == '/linhas':
+            # 🆕 NOVO: Cadastro de linhas (intervalo padrão, horário de operação, capacidade)
+            self.enviar_linhas(parametros)
         else:
             # Página não encontrada
             self.enviar_erro_404()
 
     def do_POST(self):
         """Responde a requisições POST (formulários)"""
-        caminho = self.path
-        tamanho = int(self.headers['Content-Length'])
+        url = urlparse(self.path)
+        caminho = url.path
+        tamanho = int(self.headers.get('Content-Length') or 0)
         dados = self.rfile.read(tamanho).decode('utf-8')
 
+        if not self.entrar_na_sessao(parse_qs(url.query)):
+            return
+
         if caminho == '/cabecalho':
             self.processar_cabecalho(dados)
         elif caminho == '/adicionar':
             self.processar_adicionar_carro(dados)
+        elif caminho == '/adicionar-lote':
+            # 🆕 NOVO: Vários carros numa requisição (numero, motorista e linha repetidos, na mesma ordem)
+            self.processar_adicionar_lote(dados)
         elif caminho == '/remover':
             self.processar_remover_carro(dados)
+        elif caminho == '/remover-lote':
+            # 🆕 NOVO: Remove vários carros (id repetido: id=1&id=2...)
+            self.processar_remover_lote(dados)
         elif caminho == '/finalizar-dia':
             self.processar_finalizar_dia(dados)
         elif caminho == '/consultar':
             self.processar_consultar(dados)
         elif caminho == '/estatisticas':
             self.processar_estatisticas(dados)
+        elif caminho == '/analise':
+            # 🆕 NOVO: Intervalos entre saídas por linha e pontualidade por motorista
+            self.processar_analise(dados)
         elif caminho == '/editar':
             self.processar_editar_registro(dados)
         elif caminho == '/confirmar-saida':
             self.processar_confirmar_saida(dados)
+        elif caminho == '/confirmar-saida-lote':
+            # 🆕 NOVO: Confirma a saída de vários carros (id repetido: id=1&id=2...)
+            self.processar_confirmar_saida_lote(dados)
         elif caminho == '/definir-intervalo':
             self.processar_definir_intervalo(dados)
         elif caminho == '/adicionar-motorista':
@@ -98,94 +448,155 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
         elif caminho == '/definir-intervalo-linha':
             # 🆕 NOVO: Define intervalo para linha específica
             self.processar_definir_intervalo_linha(dados)
+        elif caminho == '/salvar-linha':
+            # 🆕 NOVO: Cria ou altera uma linha do cadastro
+            self.processar_salvar_linha(dados)
+        elif caminho == '/remover-linha':
+            # 🆕 NOVO: Tira uma linha do cadastro
+            self.processar_remover_linha(dados)
         else:
             self.enviar_erro_404()
 
     def enviar_erro_404(self):
         """Envia erro 404"""
+        corpo = b'<h1>404 - Pagina nao encontrada</h1>'
         self.send_response(404)
         self.send_header('Content-type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(corpo)))
         self.enviar_cabecalhos_cors()
         self.end_headers()
-        self.wfile.write(b'<h1>404 - Pagina nao encontrada</h1>')
+        self.wfile.write(corpo)
 
     def servir_arquivo_html(self):
         """Serve o arquivo HTML estático do Presidente"""
         try:
-            with open('index.html', 'r', encoding='utf-8') as arquivo:
-                conteudo = arquivo.read()
-
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(conteudo.encode('utf-8'))
+            self.servir_pagina_estatica('index.html')
         except FileNotFoundError:
             self.send_error(404, "Arquivo index.html não encontrado")
 
     def servir_pagina_motorista(self):
         """Serve a página do motorista (interface simples)"""
         try:
-            with open('motorista.html', 'r', encoding='utf-8') as arquivo:
-                conteudo = arquivo.read()
-
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(conteudo.encode('utf-8'))
-            print("📱 Página do motorista servida")
+            self.servir_pagina_estatica('motorista.html')
+            logger.debug("📱 Página do motorista servida")
         except FileNotFoundError:
             self.send_error(404, "Arquivo motorista.html não encontrado")
 
-    def processar_registro_para_json(self, registro):
-        """Função centralizada para processar um registro do banco para JSON"""
-        # ESTRUTURA CONFIRMADA: 9 colunas
-        # (id, nome_fiscal, data_trabalho, linha, numero_carro, nome_motorista, horario_saida, data_registro, saida_confirmada)
-        #  0      1             2          3          4              5              6             7                8
-
-        data_trabalho = registro[2].strftime('%Y-%m-%d') if registro[2] else None
-        horario_saida = str(registro[6]) if registro[6] else None
-
-        # CORREÇÃO CRÍTICA: Verificar se saída foi confirmada
-        saida_confirmada = bool(registro[8]) if len(registro) > 8 and registro[8] is not None else False
-
-        # VERIFICAR HORÁRIO vs HORA ATUAL para status automático
-        from datetime import datetime, time
-        agora = datetime.now().time()
-
-        # Se tem horário de saída definido, comparar com hora atual
-        if registro[6] and isinstance(registro[6], time):
-            horario_carro = registro[6]
-            horario_passou = agora >= horario_carro
-        else:
-            horario_passou = False
+    def escolher_codificacao(self, variantes):
+        """🆕 NOVO: Escolhe br > gzip > sem compressão, conforme o Accept-Encoding do navegador
+
+        Uma codificação com q=0 (ou 0.0, 0.00...) foi recusada e não vale nem pelo '*'.
+        q malformado conta como recusa: na dúvida, vai sem compressão, que todo cliente aceita.
+        """
+        pesos = {}
+        for item in self.headers.get('Accept-Encoding', '').split(','):
+            partes = [p.strip() for p in item.split(';')]
+            if not partes[0]:
+                continue
+            peso = 1.0
+            for parametro in partes[1:]:
+                nome, _, valor = parametro.partition('=')
+                if nome.strip().lower() == 'q':
+                    try:
+                        peso = float(valor.strip())
+                    except ValueError:
+                        peso = 0.0
+                    if not 0 < peso <= 1:  # fora de (0, 1], inclusive nan
+                        peso = 0.0
+            pesos[partes[0].lower()] = peso
+
+        for codificacao in ('br', 'gzip'):
+            peso = pesos.get(codificacao, pesos.get('*', 0.0))
+            if codificacao in variantes and peso > 0:
+                return codificacao
+        return 'identity'
+
+    def pagina_nao_modificada(self, entrada):
+        """🆕 NOVO: GET condicional - o navegador já tem esta versão da página?"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            return entrada['etag'] in [etag.strip() for etag in if_none_match.split(',')]
+
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                return int(parsedate_to_datetime(if_modified_since).timestamp()) >= entrada['modificado_em']
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def servir_pagina_estatica(self, caminho):
+        """🆕 NOVO: Serve uma página do cache em memória, comprimida e com revalidação (304)"""
+        entrada = self.paginas.obter(caminho)
+
+        if self.pagina_nao_modificada(entrada):
+            self.send_response(304)
+            self.enviar_cookie_sessao()
+            self.send_header('ETag', entrada['etag'])
+            self.send_header('Last-Modified', entrada['last_modified'])
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
 
-        # LÓGICA DO STATUS:
-        # - Se confirmado manualmente = SAIU
-        # - Se não confirmado E horário passou = pode sair (mas ainda aguardando confirmação)
-        # - Se não confirmado E horário não passou = aguardando
-        status_real = "SAIU" if saida_confirmada else "AGUARDANDO"
+        codificacao = self.escolher_codificacao(entrada['variantes'])
+        corpo = entrada['variantes'][codificacao]
 
-        print(f"🔍 DEBUG: Carro {registro[4]} - Confirmado: {saida_confirmada} - Status: {status_real}")
+        self.send_response(200)
+        self.enviar_cookie_sessao()
+        self.send_header('Content-type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(corpo)))
+        if codificacao != 'identity':
+            self.send_header('Content-Encoding', codificacao)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('ETag', entrada['etag'])
+        self.send_header('Last-Modified', entrada['last_modified'])
+        # no-cache = pode guardar, mas pergunta antes de usar (resposta 304 é minúscula)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(corpo)
 
-        return {
-            "id": registro[0],
-            "fiscal": registro[1],
-            "data": data_trabalho,
-            "linha": registro[3],
-            "numero": registro[4],
-            "motorista": registro[5],
-            "horario": horario_saida,
-            "saida_confirmada": saida_confirmada,
-            "status": status_real
-        }
+    def enviar_cookie_sessao(self):
+        """🆕 NOVO: Página aberta com ?sessao=...: grava o cookie para as próximas requisições do navegador"""
+        if self.sessao_pedida and self.FORMATO_SESSAO.match(self.sessao_pedida):
+            self.send_header('Set-Cookie', f'sessao={self.sessao_pedida}; Path=/; Max-Age=31536000; SameSite=Lax')
 
-    def enviar_lista_carros(self):
-        """Envia lista de carros REAL do banco de dados"""
-        print("🔍 DEBUG: Função enviar_lista_carros() chamada")
+    def processar_registro_para_json(self, registro):
+        """Função centralizada para processar um registro do banco para JSON
+
+        🆕 O registro é um SaidaCarro, que monta o dict uma vez só e reaproveita nas próximas
+        leituras do quadro. O dict é compartilhado: para acrescentar campos, copie antes.
+        """
+        return registro.para_json()
+
+    def ler_paginacao(self, parametros):
+        """🆕 NOVO: Lê limite, cursor e contar (pedido do total) dos parâmetros da requisição"""
+        limite = parametros.get('limite', [''])[0]
+        cursor = parametros.get('cursor', [''])[0] or None
+        contar = parametros.get('contar', [''])[0].lower() in ('1', 'true', 'sim')
+        return limite, cursor, contar
+
+    def adicionar_paginacao(self, dados, pagina):
+        """🆕 NOVO: Coloca os dados da paginação na resposta"""
+        dados["proximo_cursor"] = pagina['proximo_cursor']
+        dados["tem_mais"] = pagina['proximo_cursor'] is not None
+        if pagina['total_registros'] is not None:
+            dados["total_registros"] = pagina['total_registros']
+        return dados
+
+    def enviar_lista_carros(self, parametros=None):
+        """Envia lista de carros REAL do banco de dados (🆕 uma página por vez)"""
+        logger.debug("🔍 Função enviar_lista_carros() chamada")
 
         try:
-            registros = self.db.listar_todos_registros()
-            print(f"🔍 DEBUG: Registros encontrados: {len(registros)}")
+            limite, cursor, contar = self.ler_paginacao(parametros or {})
+            pagina = self.db.listar_todos_registros(limite, cursor, contar)
+            if pagina['status'] != 'sucesso':
+                self.enviar_json({"status": "erro", "mensagem": pagina['mensagem'], "carros": []})
+                return
+
+            registros = pagina['registros']
+            logger.debug(f"🔍 Registros encontrados: {len(registros)}")
 
             # Converter para formato JSON amigável
             carros = []
@@ -193,15 +604,15 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
                 carro = self.processar_registro_para_json(registro)
                 carros.append(carro)
 
-            dados = {
+            dados = self.adicionar_paginacao({
                 "status": "ok",
                 "total": len(carros),
                 "carros": carros,
                 "intervalo_atual": self.db.obter_intervalo_atual()
-            }
+            }, pagina)
 
         except Exception as e:
-            print(f"🔍 DEBUG: ERRO capturado: {str(e)}")
+            logger.exception(f"❌ Erro ao listar carros: {str(e)}")
             dados = {
                 "status": "erro",
                 "mensagem": f"Erro ao buscar dados: {str(e)}",
@@ -212,23 +623,23 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
 
     def enviar_lista_carros_sessao(self):
         """Envia lista de carros da SESSÃO ATUAL apenas - COM STATUS DE CONFIRMAÇÃO"""
-        print("🔍 DEBUG: Função enviar_lista_carros_sessao() chamada")
+        respondeu, etag = self.responder_se_nao_modificado()
+        if respondeu:
+            return
+
+        logger.debug("🔍 Função enviar_lista_carros_sessao() chamada")
 
         try:
             # Buscar dados apenas da sessão atual
             registros = self.db.listar_registros_sessao_atual()
-            print(f"🔍 DEBUG: Registros da sessão atual: {len(registros)}")
+            logger.debug(f"🔍 Registros da sessão atual: {len(registros)}")
 
-            # Converter para formato JSON amigável
-            carros = []
-            for registro in registros:
-                print(f"🔍 DEBUG: Processando registro: {registro}")
-                carro = self.processar_registro_para_json(registro)
-                carros.append(carro)
+            # 🆕 Cada carro vai como JSON já codificado (guardado no registro até ele mudar)
+            carros = [registro.para_json_bytes() for registro in registros]
 
-            # Contar confirmados para debug
-            confirmados = sum(1 for c in carros if c['saida_confirmada'])
-            print(f"🔍 DEBUG: Carros confirmados: {confirmados}")
+            if logger.isEnabledFor(logging.DEBUG):
+                confirmados = sum(1 for registro in registros if registro.saida_confirmada)
+                logger.debug(f"🔍 Carros confirmados: {confirmados}")
 
             dados = {
                 "status": "ok",
@@ -239,18 +650,22 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
             }
 
         except Exception as e:
-            print(f"🔍 DEBUG: ERRO capturado: {str(e)}")
+            logger.exception(f"❌ Erro ao listar carros da sessão: {str(e)}")
             dados = {
                 "status": "erro",
                 "mensagem": f"Erro ao buscar dados da sessão: {str(e)}",
                 "carros": []
             }
 
-        self.enviar_json(dados)
+        self.enviar_json(dados, etag)
 
     def enviar_carros_por_linha(self):
         """🆕 NOVO: Envia carros da sessão atual SEPARADOS por linha"""
-        print("🔍 DEBUG: Função enviar_carros_por_linha() chamada")
+        respondeu, etag = self.responder_se_nao_modificado()
+        if respondeu:
+            return
+
+        logger.debug("🔍 Função enviar_carros_por_linha() chamada")
 
         try:
             carros_por_linha_raw = self.db.listar_carros_por_linha()
@@ -260,10 +675,7 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
             total_carros = 0
 
             for linha, registros in carros_por_linha_raw.items():
-                carros_linha = []
-                for registro in registros:
-                    carro = self.processar_registro_para_json(registro)
-                    carros_linha.append(carro)
+                carros_linha = [registro.para_json_bytes() for registro in registros]
 
                 carros_por_linha[linha] = {
                     "carros": carros_linha,
@@ -279,30 +691,30 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
                 "tipo": "separado_por_linha"
             }
 
-            print(f"🔍 DEBUG: Carros por linha processados:")
-            for linha, info in carros_por_linha.items():
-                print(f"    {linha}: {info['total']} carros (intervalo {info['intervalo']}min)")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("🔍 Carros por linha processados:")
+                for linha, info in carros_por_linha.items():
+                    logger.debug(f"    {linha}: {info['total']} carros (intervalo {info['intervalo']}min)")
 
         except Exception as e:
-            print(f"🔍 DEBUG: ERRO ao separar carros por linha: {str(e)}")
+            logger.exception(f"❌ Erro ao separar carros por linha: {str(e)}")
             dados = {
                 "status": "erro",
                 "mensagem": f"Erro ao buscar carros por linha: {str(e)}",
                 "carros_por_linha": {}
             }
 
-        self.enviar_json(dados)
+        self.enviar_json(dados, etag)
 
     def enviar_intervalos_todas_linhas(self):
         """🆕 NOVO: Envia intervalos específicos de todas as linhas"""
-        try:
-            intervalos = {}
-
-            # Linhas conhecidas
-            linhas_conhecidas = ['Centro x Vila Verde', 'Centro x Rasa']
+        respondeu, etag = self.responder_se_nao_modificado()
+        if respondeu:
+            return
 
-            for linha in linhas_conhecidas:
-                intervalos[linha] = self.db.obter_intervalo_linha(linha)
+        try:
+            # 🆕 Linhas do cadastro (tabela linhas)
+            intervalos = self.db.intervalos_das_linhas()
 
             dados = {
                 "status": "ok",
@@ -310,17 +722,129 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
                 "intervalo_geral": self.db.obter_intervalo_atual()
             }
 
-            print(f"📤 Enviando intervalos por linha: {intervalos}")
+            logger.debug(f"📤 Enviando intervalos por linha: {intervalos}")
 
         except Exception as e:
-            print(f"❌ Erro ao obter intervalos das linhas: {str(e)}")
+            logger.error(f"❌ Erro ao obter intervalos das linhas: {str(e)}")
             dados = {
                 "status": "erro",
                 "mensagem": f"Erro ao obter intervalos: {str(e)}"
             }
 
+        self.enviar_json(dados, etag)
+
+    def abrir_canal_eventos(self):
+        """🆕 NOVO: Abre o stream SSE e entrega o socket ao canal de eventos
+
+        O worker volta para o pool logo em seguida; o socket continua aberto
+        (o servidor não fecha conexões desacopladas) e passa a receber os eventos.
+        """
+        if len(self.canal_eventos.clientes) >= self.canal_eventos.max_clientes:
+            self.send_response(503)
+            self.send_header('Retry-After', '30')
+            self.send_header('Content-Length', '0')
+            self.enviar_cabecalhos_cors()
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        # Stream sem tamanho: termina quando a conexão fecha (não volta para o keep-alive)
+        self.send_header('Connection', 'close')
+        self.enviar_cabecalhos_cors()
+        self.end_headers()
+        self.wfile.flush()
+
+        # Primeira mensagem: versão atual, para o painel saber se precisa se atualizar
+        mensagem_inicial = b'retry: 3000\n\n' + self.canal_eventos.formatar(
+            'conectado', {}, self.db.versao_quadro)
+
+        self.close_connection = True
+        if self.canal_eventos.assinar(self.request, mensagem_inicial, self.db.sessao_atual().id):
+            self.server.desacoplar(self.request)
+
+    def enviar_metricas_pool(self):
+        """🆕 NOVO: Envia as métricas do pool de conexões (espera, em uso, criadas...)"""
+        try:
+            dados = {"status": "ok", "pool": self.db.pool.metricas()}
+        except Exception as e:
+            logger.error(f"❌ Erro ao obter métricas do pool: {str(e)}")
+            dados = {"status": "erro", "mensagem": f"Erro ao obter métricas do pool: {str(e)}"}
+
         self.enviar_json(dados)
 
+    def enviar_linhas(self, parametros):
+        """🆕 NOVO: Envia o cadastro de linhas, na ordem de exibição (?todas=1 inclui as inativas)"""
+        try:
+            todas = parametros.get('todas', [''])[0] == '1'
+            linhas = [config for config in self.db.obter_linhas().values() if todas or config['ativa']]
+            dados = {"status": "ok", "linhas": linhas, "total": len(linhas)}
+        except Exception as e:
+            logger.error(f"❌ Erro ao obter linhas: {str(e)}")
+            dados = {"status": "erro", "mensagem": f"Erro ao obter linhas: {str(e)}"}
+
+        self.enviar_json(dados)
+
+    def processar_salvar_linha(self, dados):
+        """🆕 NOVO: Cria ou altera uma linha (nome, intervalo, hora_inicio, hora_fim, capacidade, ativa, ordem)
+
+        Ao alterar, o campo que não veio no formulário fica como estava (campo vazio = limpar).
+        """
+        try:
+            parametros = parse_qs(dados, keep_blank_values=True)
+            nome = parametros.get('nome', [''])[0].strip()
+            atual = self.db.obter_linhas().get(nome, {})
+
+            def campo(chave, padrao=None):
+                if chave in parametros:
+                    return parametros[chave][0] or None
+                return atual.get(chave, padrao)
+
+            intervalo = parametros['intervalo'][0] if 'intervalo' in parametros else atual.get('intervalo_padrao', 8)
+            capacidade = campo('capacidade')
+            ativa = campo('ativa', True)
+
+            resultado = self.db.salvar_linha(
+                nome,
+                intervalo_padrao=int(intervalo),
+                hora_inicio=campo('hora_inicio'),
+                hora_fim=campo('hora_fim'),
+                capacidade=int(capacidade) if capacidade is not None else None,
+                ativa=ativa not in ('0', 'false', False),
+                ordem=int(campo('ordem', 0) or 0)
+            )
+
+            if resultado['status'] == 'sucesso':
+                resposta = {"status": "ok", "mensagem": resultado['mensagem'], "linha": resultado['linha']}
+            else:
+                resposta = {"status": "erro", "mensagem": resultado['mensagem']}
+
+        except ValueError:
+            resposta = {"status": "erro", "mensagem": "Intervalo, capacidade e ordem devem ser números válidos"}
+        except Exception as e:
+            logger.error(f"❌ ERRO ao salvar linha: {str(e)}")
+            resposta = {"status": "erro", "mensagem": f"Erro ao salvar linha: {str(e)}"}
+
+        self.enviar_json(resposta)
+
+    def processar_remover_linha(self, dados):
+        """🆕 NOVO: Remove uma linha do cadastro pelo nome"""
+        try:
+            nome = parse_qs(dados).get('nome', [''])[0]
+            if not nome:
+                resposta = {"status": "erro", "mensagem": "Linha não especificada"}
+            else:
+                resultado = self.db.remover_linha(nome)
+                resposta = {"status": "ok" if resultado['status'] == 'sucesso' else "erro",
+                            "mensagem": resultado['mensagem']}
+        except Exception as e:
+            logger.error(f"❌ ERRO ao remover linha: {str(e)}")
+            resposta = {"status": "erro", "mensagem": f"Erro ao remover linha: {str(e)}"}
+
+        self.enviar_json(resposta)
+
     def processar_definir_intervalo_linha(self, dados):
         """🆕 NOVO: Processa definição de intervalo para linha específica"""
         try:
@@ -328,7 +852,7 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
             linha = parametros.get('linha', [''])[0]
             novo_intervalo = int(parametros.get('intervalo', ['0'])[0])
 
-            print(f"⏱️ RECEBIDO: Definindo intervalo para linha '{linha}': {novo_intervalo} minutos")
+            logger.info(f"⏱️ RECEBIDO: Definindo intervalo para linha '{linha}': {novo_intervalo} minutos")
 
             if not linha:
                 resposta = {"status": "erro", "mensagem": "Linha não especificada"}
@@ -344,17 +868,17 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
                         "intervalo_novo": resultado['intervalo_novo'],
                         "carros_atualizados": resultado['carros_atualizados']
                     }
-                    print(
+                    logger.info(
                         f"✅ Intervalo da linha '{linha}' definido: {novo_intervalo} min, {resultado['carros_atualizados']} carros atualizados")
                 else:
                     resposta = {"status": "erro", "mensagem": resultado['mensagem']}
-                    print(f"❌ Erro ao definir intervalo da linha '{linha}': {resultado['mensagem']}")
+                    logger.error(f"❌ Erro ao definir intervalo da linha '{linha}': {resultado['mensagem']}")
 
         except ValueError:
             resposta = {"status": "erro", "mensagem": "Intervalo deve ser um número válido"}
-            print("❌ Erro: Intervalo não é um número válido")
+            logger.warning("❌ Erro: Intervalo não é um número válido")
         except Exception as e:
-            print(f"❌ ERRO CRÍTICO ao definir intervalo da linha: {str(e)}")
+            logger.error(f"❌ ERRO CRÍTICO ao definir intervalo da linha: {str(e)}")
             resposta = {"status": "erro", "mensagem": f"Erro ao definir intervalo da linha: {str(e)}"}
 
         self.enviar_json(resposta)
@@ -366,7 +890,7 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
             fiscal = parametros.get('fiscal', [''])[0]
             data = parametros.get('data', [''])[0]
 
-            print(f"📋 Cabeçalho recebido: Fiscal={fiscal}, Data={data}")
+            logger.info(f"📋 Cabeçalho recebido: Fiscal={fiscal}, Data={data}")
             self.db.cabecalho_prancheta(fiscal, data)
 
             resposta = {
@@ -376,7 +900,7 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
             }
 
         except Exception as e:
-            print(f"❌ ERRO ao processar cabeçalho: {str(e)}")
+            logger.error(f"❌ ERRO ao processar cabeçalho: {str(e)}")
             resposta = {"status": "erro", "mensagem": f"Erro ao salvar cabeçalho: {str(e)}"}
 
         self.enviar_json(resposta)
@@ -389,27 +913,27 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
             motorista = parametros.get('motorista', [''])[0]
             linha = parametros.get('linha', [''])[0]
 
-            print(f"🚗 RECEBIDO: Número={numero}, Motorista={motorista}, Linha={linha}")
+            logger.info(f"🚗 RECEBIDO: Número={numero}, Motorista={motorista}, Linha={linha}")
 
             # Verificar se cabeçalho está definido
             if not self.db.fiscal_atual or not self.db.data_atual:
-                print(f"❌ Cabeçalho não definido! Fiscal: {self.db.fiscal_atual}, Data: {self.db.data_atual}")
+                logger.warning(f"❌ Cabeçalho não definido! Fiscal: {self.db.fiscal_atual}, Data: {self.db.data_atual}")
                 resposta = {"status": "erro", "mensagem": "Defina o cabeçalho antes de adicionar carros!"}
                 self.enviar_json(resposta)
                 return
 
             # Inserir com horário automático POR LINHA
-            print(f"🔄 Chamando inserir_dados_motorista...")
+            logger.debug(f"🔄 Chamando inserir_dados_motorista...")
             resultado = self.db.inserir_dados_motorista(numero, motorista, linha)
-            print(f"🔄 Resultado do banco: {resultado}")
+            logger.debug(f"🔄 Resultado do banco: {resultado}")
 
             if resultado is False:
-                print(f"❌ Falha na inserção no banco")
+                logger.error(f"❌ Falha na inserção no banco")
                 resposta = {"status": "erro", "mensagem": "Erro ao inserir no banco de dados!"}
             else:
-                # Buscar o horário que foi calculado POR LINHA
-                horario_calculado = self.db.calcular_proximo_horario_linha(linha)
-                print(f"✅ Carro inserido com sucesso! Horário calculado para linha {linha}: {horario_calculado}")
+                # inserir_dados_motorista já devolve o horário calculado POR LINHA
+                horario_calculado = resultado
+                logger.info(f"✅ Carro inserido com sucesso! Horário calculado para linha {linha}: {horario_calculado}")
 
                 resposta = {
                     "status": "ok",
@@ -422,13 +946,15 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
                     }
                 }
 
-            print(f"📤 Enviando resposta: {resposta}")
+            logger.debug(f"📤 Enviando resposta: {resposta}")
             self.enviar_json(resposta)
 
+        except LinhaSemVaga as e:
+            # 🆕 Fora do horário de operação ou capacidade da linha esgotada (cadastro de linhas)
+            logger.warning(f"⚠️ Carro recusado: {str(e)}")
+            self.enviar_json({"status": "erro", "mensagem": str(e)})
         except Exception as e:
-            print(f"❌ ERRO CRÍTICO ao adicionar carro: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"❌ ERRO CRÍTICO ao adicionar carro: {str(e)}")
 
             resposta = {
                 "status": "erro",
@@ -436,13 +962,46 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
             }
             self.enviar_json(resposta)
 
+    def processar_adicionar_lote(self, dados):
+        """🆕 NOVO: Cadastra vários carros de uma vez (início do turno), com horários em sequência por linha
+
+        Formulário com os campos repetidos: numero=1&motorista=A&linha=X&numero=2&motorista=B&linha=X...
+        """
+        try:
+            parametros = parse_qs(dados, keep_blank_values=True)
+            numeros = parametros.get('numero', [])
+            motoristas = parametros.get('motorista', [])
+            linhas = parametros.get('linha', [])
+
+            if not (len(numeros) == len(motoristas) == len(linhas)):
+                resposta = {"status": "erro", "mensagem": "Cada carro precisa de número, motorista e linha"}
+            else:
+                logger.info(f"🚗 RECEBIDO: lote de {len(numeros)} carros")
+                resultado = self.db.inserir_lote_motoristas(list(zip(numeros, motoristas, linhas)))
+
+                if resultado['status'] == 'sucesso':
+                    resposta = {
+                        "status": "ok",
+                        "mensagem": f"{resultado['total']} carros adicionados com horário automático por linha.",
+                        "total": resultado['total'],
+                        "carros": resultado['carros']
+                    }
+                else:
+                    resposta = {"status": "erro", "mensagem": resultado['mensagem']}
+
+        except Exception as e:
+            logger.error(f"❌ ERRO ao adicionar lote: {str(e)}")
+            resposta = {"status": "erro", "mensagem": f"Erro interno do servidor: {str(e)}"}
+
+        self.enviar_json(resposta)
+
     def processar_remover_carro(self, dados):
         """Remove um carro do banco"""
         try:
             parametros = parse_qs(dados)
             id_carro = parametros.get('id', [''])[0]
 
-            print(f"🗑️ Removendo carro ID: {id_carro}")
+            logger.info(f"🗑️ Removendo carro ID: {id_carro}")
             sucesso = self.db.deletar_registro(id_carro)
 
             if sucesso:
@@ -451,18 +1010,65 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
                 resposta = {"status": "erro", "mensagem": "Carro não encontrado!"}
 
         except Exception as e:
-            print(f"❌ ERRO ao remover carro: {str(e)}")
+            logger.error(f"❌ ERRO ao remover carro: {str(e)}")
             resposta = {"status": "erro", "mensagem": f"Erro ao remover carro: {str(e)}"}
 
         self.enviar_json(resposta)
 
+    def processar_remover_lote(self, dados):
+        """🆕 NOVO: Remove vários carros numa requisição; responde o resultado de cada id"""
+        try:
+            ids = parse_qs(dados).get('id', [])
+            logger.info(f"🗑️ Removendo {len(ids)} carro(s) em lote")
+            resultado = self.db.deletar_registros(ids)
+
+            if resultado['status'] == 'sucesso':
+                resposta = {
+                    "status": "ok",
+                    "mensagem": f"{len(resultado['removidos'])} carro(s) removido(s)!",
+                    "resultados": [{"id": i, "status": "removido"} for i in resultado['removidos']] +
+                                  [{"id": i, "status": "nao_encontrado"} for i in resultado['nao_encontrados']]
+                }
+            else:
+                resposta = {"status": "erro", "mensagem": resultado['mensagem']}
+
+        except Exception as e:
+            logger.error(f"❌ ERRO ao remover carros em lote: {str(e)}")
+            resposta = {"status": "erro", "mensagem": f"Erro ao remover carros: {str(e)}"}
+
+        self.enviar_json(resposta)
+
+    def processar_confirmar_saida_lote(self, dados):
+        """🆕 NOVO: Confirma a saída de vários carros numa requisição (ex.: confirmações que ficaram
+        na fila do navegador durante uma queda de rede); responde o resultado de cada id"""
+        try:
+            ids = parse_qs(dados).get('id', [])
+            logger.debug(f"✅ Confirmando saída de {len(ids)} carro(s) em lote")
+            resultado = self.db.confirmar_saidas(ids)
+
+            if resultado['status'] == 'sucesso':
+                resposta = {
+                    "status": "ok",
+                    "mensagem": f"{len(resultado['confirmados'])} saída(s) confirmada(s)!",
+                    "resultados": [{"id": i, "status": "confirmado"} for i in resultado['confirmados']] +
+                                  [{"id": i, "status": "nao_encontrado"} for i in resultado['nao_encontrados']]
+                }
+            else:
+                resposta = {"status": "erro", "mensagem": resultado['mensagem']}
+
+        except Exception as e:
+            logger.error(f"❌ ERRO ao confirmar saídas em lote: {str(e)}")
+            resposta = {"status": "erro", "mensagem": f"Erro ao confirmar saídas: {str(e)}"}
+
+        self.enviar_json(resposta)
+
     def processar_confirmar_saida(self, dados):
         """Processa confirmação AUTOMÁTICA de saída de um carro"""
         try:
             parametros = parse_qs(dados)
             id_carro = parametros.get('id', [''])[0]
 
-            print(f"✅ Confirmando saída AUTOMÁTICA do carro ID: {id_carro}")
+            logger.debug(f"✅ Confirmando saída AUTOMÁTICA do carro ID: {id_carro}")
             sucesso = self.db.confirmar_saida_carro(id_carro)
 
             if sucesso:
@@ -471,12 +1077,12 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
                     "mensagem": "Saída confirmada automaticamente!",
                     "carro_id": id_carro
                 }
-                print(f"✅ Saída confirmada automaticamente para carro ID: {id_carro}")
+                logger.info(f"✅ Saída confirmada automaticamente para carro ID: {id_carro}")
             else:
                 resposta = {"status": "erro", "mensagem": "Erro ao confirmar saída - carro não encontrado!"}
 
         except Exception as e:
-            print(f"❌ ERRO ao confirmar saída: {str(e)}")
+            logger.error(f"❌ ERRO ao confirmar saída: {str(e)}")
             resposta = {"status": "erro", "mensagem": f"Erro ao confirmar saída: {str(e)}"}
 
         self.enviar_json(resposta)
@@ -487,12 +1093,12 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
             parametros = parse_qs(dados)
             novo_intervalo = int(parametros.get('intervalo', ['0'])[0])
 
-            print(f"⏱️ RECEBIDO: Definindo novo intervalo GERAL: {novo_intervalo} minutos")
-            print(f"⏱️ ANTES: Intervalo atual era: {self.db.obter_intervalo_atual()} minutos")
+            logger.info(f"⏱️ RECEBIDO: Definindo novo intervalo GERAL: {novo_intervalo} minutos")
+            logger.debug(f"⏱️ ANTES: Intervalo atual era: {self.db.obter_intervalo_atual()} minutos")
 
             resultado = self.db.definir_intervalo(novo_intervalo)
 
-            print(f"⏱️ DEPOIS: Intervalo atual agora é: {self.db.obter_intervalo_atual()} minutos")
+            logger.debug(f"⏱️ DEPOIS: Intervalo atual agora é: {self.db.obter_intervalo_atual()} minutos")
 
             if resultado['status'] == 'sucesso':
                 resposta = {
@@ -501,14 +1107,14 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
                     "intervalo": resultado['intervalo'],
                     "carros_atualizados": resultado['carros_atualizados']
                 }
-                print(
+                logger.info(
                     f"✅ Intervalo GERAL definido com sucesso: {novo_intervalo} min, {resultado['carros_atualizados']} carros atualizados")
             else:
                 resposta = {"status": "erro", "mensagem": resultado['mensagem']}
-                print(f"❌ Erro ao definir intervalo GERAL: {resultado['mensagem']}")
+                logger.error(f"❌ Erro ao definir intervalo GERAL: {resultado['mensagem']}")
 
         except Exception as e:
-            print(f"❌ ERRO CRÍTICO ao definir intervalo GERAL: {str(e)}")
+            logger.error(f"❌ ERRO CRÍTICO ao definir intervalo GERAL: {str(e)}")
             resposta = {"status": "erro", "mensagem": f"Erro ao definir intervalo: {str(e)}"}
 
         self.enviar_json(resposta)
@@ -521,9 +1127,9 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
                 "status": "ok",
                 "intervalo": intervalo
             }
-            print(f"📤 Enviando intervalo atual: {intervalo} minutos")
+            logger.debug(f"📤 Enviando intervalo atual: {intervalo} minutos")
         except Exception as e:
-            print(f"❌ Erro ao obter intervalo: {str(e)}")
+            logger.error(f"❌ Erro ao obter intervalo: {str(e)}")
             dados = {
                 "status": "erro",
                 "mensagem": f"Erro ao obter intervalo: {str(e)}"
@@ -534,69 +1140,198 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
     def processar_finalizar_dia(self, dados):
         """Processa finalização do dia"""
         try:
-            print("🏁 Finalizando dia...")
+            logger.info("🏁 Finalizando dia...")
             resultado = self.db.finalizar_dia()
 
             if resultado['status'] == 'sucesso':
+                # 🔧 CORRIGIDO: registros crus (date/timedelta) não passam no json.dumps
+                dados_dia = dict(resultado['dados'])
+                dados_dia['registros'] = [self.processar_registro_para_json(registro)
+                                          for registro in dados_dia['registros']]
                 resposta = {
                     "status": "ok",
                     "mensagem": resultado['mensagem'],
-                    "dados": resultado['dados']
+                    "dados": dados_dia
                 }
             else:
                 resposta = {"status": "erro", "mensagem": resultado['mensagem']}
 
         except Exception as e:
-            print(f"❌ ERRO ao finalizar dia: {str(e)}")
+            logger.error(f"❌ ERRO ao finalizar dia: {str(e)}")
             resposta = {"status": "erro", "mensagem": f"Erro ao finalizar dia: {str(e)}"}
 
         self.enviar_json(resposta)
 
+    def ler_filtros_consulta(self, parametros):
+        """Filtros do histórico vindos do formulário/URL (só os preenchidos)"""
+        filtros = {}
+        for campo in ('data_especifica', 'data_inicio', 'data_fim', 'fiscal', 'linha', 'numero_carro',
+                      'nome_motorista'):
+            if parametros.get(campo, [''])[0]:
+                filtros[campo] = parametros.get(campo, [''])[0]
+        return filtros
+
     def processar_consultar(self, dados):
         """Processa consultas com filtros"""
         try:
             parametros = parse_qs(dados)
-            filtros = {}
-
-            if parametros.get('data_especifica', [''])[0]:
-                filtros['data_especifica'] = parametros.get('data_especifica', [''])[0]
-            if parametros.get('data_inicio', [''])[0]:
-                filtros['data_inicio'] = parametros.get('data_inicio', [''])[0]
-            if parametros.get('data_fim', [''])[0]:
-                filtros['data_fim'] = parametros.get('data_fim', [''])[0]
-            if parametros.get('fiscal', [''])[0]:
-                filtros['fiscal'] = parametros.get('fiscal', [''])[0]
-            if parametros.get('linha', [''])[0]:
-                filtros['linha'] = parametros.get('linha', [''])[0]
-            if parametros.get('numero_carro', [''])[0]:
-                filtros['numero_carro'] = parametros.get('numero_carro', [''])[0]
-            if parametros.get('nome_motorista', [''])[0]:
-                filtros['nome_motorista'] = parametros.get('nome_motorista', [''])[0]
+            filtros = self.ler_filtros_consulta(parametros)
+
+            # 🆕 Paginação: limite, cursor (da resposta anterior) e contar=1 para o total
+            limite, cursor, contar = self.ler_paginacao(parametros)
 
             if len(filtros) == 1 and 'data_especifica' in filtros:
-                registros = self.db.consultar_por_data(filtros['data_especifica'])
+                pagina = self.db.consultar_por_data(filtros['data_especifica'], limite, cursor, contar)
             else:
-                registros = self.db.consultar_por_filtros(filtros)
+                pagina = self.db.consultar_por_filtros(filtros, limite, cursor, contar)
+
+            if pagina['status'] != 'sucesso':
+                self.enviar_json({"status": "erro", "mensagem": pagina['mensagem'], "carros": []})
+                return
 
             carros = []
-            for registro in registros:
+            for registro in pagina['registros']:
                 carro = self.processar_registro_para_json(registro)
                 carros.append(carro)
 
-            resposta = {
+            resposta = self.adicionar_paginacao({
                 "status": "ok",
                 "mensagem": f"Encontrados {len(carros)} registros",
                 "total": len(carros),
                 "carros": carros,
                 "filtros_aplicados": filtros
-            }
+            }, pagina)
 
         except Exception as e:
-            print(f"❌ ERRO ao consultar: {str(e)}")
+            logger.error(f"❌ ERRO ao consultar: {str(e)}")
             resposta = {"status": "erro", "mensagem": f"Erro ao consultar dados: {str(e)}", "carros": []}
 
         self.enviar_json(resposta)
 
+    def enviar_busca(self, parametros):
+        """🆕 NOVO: Resultado da busca, do mais relevante para o menos"""
+        try:
+            texto = parametros.get('q', [''])[0].strip()
+            campo = parametros.get('campo', [''])[0] or None
+            try:
+                limite = max(1, min(int(parametros.get('limite', ['20'])[0]), 100))
+            except ValueError:
+                limite = 20
+
+            if not texto:
+                self.enviar_json({"status": "erro", "mensagem": "Informe o que buscar (q)", "carros": []})
+                return
+
+            resultado = self.db.buscar_registros(texto, limite, campo)
+            if resultado['status'] != 'sucesso':
+                self.enviar_json({"status": "erro", "mensagem": resultado['mensagem'], "carros": []})
+                return
+
+            carros = []
+            for registro, pontos in resultado['registros']:
+                carro = dict(self.processar_registro_para_json(registro), relevancia=pontos)
+                carros.append(carro)
+
+            resposta = {"status": "ok", "busca": texto, "total": len(carros), "carros": carros}
+
+        except Exception as e:
+            logger.error(f"❌ ERRO na busca: {str(e)}")
+            resposta = {"status": "erro", "mensagem": f"Erro na busca: {str(e)}", "carros": []}
+
+        self.enviar_json(resposta)
+
+    def exportar_historico(self, parametros):
+        """🆕 NOVO: GET /exportar?formato=csv|jsonl&<mesmos filtros do /consultar>
+
+        Os registros vão direto do cursor do banco para a conexão, lote por lote
+        (chunked no HTTP/1.1, ou até fechar a conexão no HTTP/1.0): nada de montar a lista inteira.
+        Com chunked a conexão continua aberta (keep-alive) depois da exportação.
+        """
+        formato = parametros.get('formato', ['csv'])[0].lower()
+        if formato not in ('csv', 'jsonl'):
+            self.enviar_json({"status": "erro", "mensagem": "Formato deve ser csv ou jsonl"})
+            return
+
+        filtros = self.ler_filtros_consulta(parametros)
+        lotes = self.db.exportar_registros(filtros)
+
+        try:
+            # Primeiro lote antes dos cabeçalhos: se a consulta falhar ainda dá para responder com erro
+            primeiro_lote = next(lotes, [])
+        except ExportacoesEsgotadas as e:
+            logger.warning(f"⚠️ Exportação recusada: {str(e)}")
+            self.enviar_json({"status": "erro", "mensagem": str(e)})
+            return
+        except Exception as e:
+            lotes.close()
+            logger.error(f"❌ ERRO ao exportar: {str(e)}")
+            self.enviar_json({"status": "erro", "mensagem": f"Erro ao exportar dados: {str(e)}"})
+            return
+
+        chunked = self.protocol_version >= 'HTTP/1.1' and self.request_version >= 'HTTP/1.1'
+
+        self.send_response(200)
+        if formato == 'csv':
+            self.send_header('Content-type', 'text/csv; charset=utf-8')
+        else:
+            self.send_header('Content-type', 'application/x-ndjson; charset=utf-8')
+        self.send_header('Content-Disposition', f'attachment; filename="saidas.{formato}"')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.enviar_cabecalhos_cors()
+        self.end_headers()
+
+        def escrever(texto):
+            dados = texto.encode('utf-8')
+            if not dados:
+                return
+            if chunked:
+                self.wfile.write(b'%X\r\n%s\r\n' % (len(dados), dados))
+            else:
+                self.wfile.write(dados)
+
+        try:
+            if formato == 'csv':
+                buffer = io.StringIO()
+                escritor = csv.writer(buffer)
+                # BOM para o Excel abrir os acentos certo
+                buffer.write('\ufeff')
+                escritor.writerow(['id', 'fiscal', 'data', 'linha', 'numero', 'motorista', 'horario',
+                                   'saida_confirmada', 'status', 'horario_confirmacao', 'atraso_minutos'])
+                # Cabeçalho sai já, mesmo que o filtro não traga nenhum registro
+                escrever(buffer.getvalue())
+                buffer.seek(0)
+                buffer.truncate()
+
+            lote = primeiro_lote
+            while lote:
+                if formato == 'csv':
+                    for registro in lote:
+                        escritor.writerow(self.processar_registro_para_json(registro).values())
+                    escrever(buffer.getvalue())
+                    buffer.seek(0)
+                    buffer.truncate()
+                else:
+                    escrever(''.join(json.dumps(self.processar_registro_para_json(registro), ensure_ascii=False) + '\n'
+                                     for registro in lote))
+                lote = next(lotes, [])
+
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("📤 Exportação interrompida: cliente desconectou")
+            self.close_connection = True
+        except Exception as e:
+            # Cabeçalhos já foram: só resta cortar a resposta (o cliente percebe o download incompleto)
+            logger.error(f"❌ ERRO no meio da exportação: {str(e)}")
+            self.close_connection = True
+        finally:
+            lotes.close()
+
     def processar_estatisticas(self, dados):
         """Processa solicitação de estatísticas"""
         try:
@@ -615,26 +1350,65 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
                     resposta = {"status": "erro", "mensagem": "Erro ao calcular estatísticas"}
 
         except Exception as e:
-            print(f"❌ ERRO ao calcular estatísticas: {str(e)}")
+            logger.error(f"❌ ERRO ao calcular estatísticas: {str(e)}")
             resposta = {"status": "erro", "mensagem": f"Erro ao calcular estatísticas: {str(e)}"}
 
         self.enviar_json(resposta)
 
+    def processar_analise(self, dados):
+        """🆕 NOVO: Análise de intervalos/pontualidade do período (data_inicio, data_fim, tolerancia em minutos)"""
+        try:
+            parametros = parse_qs(dados)
+            data_inicio = parametros.get('data_inicio', [''])[0]
+            data_fim = parametros.get('data_fim', [''])[0]
+            tolerancia = float(parametros.get('tolerancia', ['2'])[0] or 2)
+            if not math.isfinite(tolerancia) or tolerancia < 0:
+                raise ValueError(tolerancia)  # nan/inf viraria NaN no JSON sem orjson
+
+            if not data_inicio or not data_fim:
+                resposta = {"status": "erro", "mensagem": "Data de início e fim são obrigatórias"}
+            else:
+                # Lê o período em lotes (cursor sem buffer) direto para as colunas da análise
+                lotes = self.db.exportar_registros({'data_inicio': data_inicio, 'data_fim': data_fim})
+                colunas = analise.montar_colunas(lotes)
+                with self.db.lock:
+                    intervalos = self.db.intervalos_das_linhas()
+
+                resultado = analise.analisar(colunas, intervalos, tolerancia)
+                resultado['periodo'] = {'inicio': data_inicio, 'fim': data_fim}
+                resposta = {"status": "ok", "mensagem": f"Análise de {resultado['total_saidas']} saídas",
+                            "analise": resultado}
+
+        except ValueError:
+            resposta = {"status": "erro", "mensagem": "Tolerância deve ser um número (minutos)"}
+        except ExportacoesEsgotadas as e:
+            logger.warning(f"⚠️ Análise recusada: {str(e)}")
+            resposta = {"status": "erro", "mensagem": str(e)}
+        except Exception as e:
+            logger.error(f"❌ ERRO na análise: {str(e)}")
+            resposta = {"status": "erro", "mensagem": f"Erro na análise: {str(e)}"}
+
+        self.enviar_json(resposta)
+
     def enviar_sessao_atual(self):
         """Envia informações da sessão atual"""
+        respondeu, etag = self.responder_se_nao_modificado()
+        if respondeu:
+            return
+
         try:
             sessao = self.db.obter_sessao_atual()
             if sessao:
                 dados = {"status": "ok", "sessao": sessao}
-                print(f"📤 Enviando sessão atual: {sessao['fiscal']} - {sessao['data']} - {sessao['linhas']}")
+                logger.debug(f"📤 Enviando sessão atual: {sessao['fiscal']} - {sessao['data']} - {sessao['linhas']}")
             else:
                 dados = {"status": "sem_sessao", "mensagem": "Nenhuma sessão ativa", "sessao": None}
-                print("📤 Nenhuma sessão ativa")
+                logger.debug("📤 Nenhuma sessão ativa")
         except Exception as e:
-            print(f"❌ Erro ao obter sessão: {str(e)}")
+            logger.error(f"❌ Erro ao obter sessão: {str(e)}")
             dados = {"status": "erro", "mensagem": f"Erro ao obter sessão: {str(e)}", "sessao": None}
 
-        self.enviar_json(dados)
+        self.enviar_json(dados, etag)
 
     def processar_editar_registro(self, dados):
         """Processa edição de um registro"""
@@ -648,8 +1422,8 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
             nome_motorista = parametros.get('nome_motorista', [''])[0]
             horario_saida = parametros.get('horario_saida', [''])[0]
 
-            print(f"✏️ Editando registro ID: {id_registro}")
-            print(f"✏️ Novos dados: {numero_carro} - {nome_motorista} - {linha} - {horario_saida}")
+            logger.info(f"✏️ Editando registro ID: {id_registro}")
+            logger.info(f"✏️ Novos dados: {numero_carro} - {nome_motorista} - {linha} - {horario_saida}")
 
             sucesso = self.db.editar_registros(
                 id_registro, nome_fiscal, data_trabalho, linha,
@@ -662,7 +1436,7 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
                 resposta = {"status": "erro", "mensagem": "Erro ao editar registro!"}
 
         except Exception as e:
-            print(f"❌ ERRO ao editar: {str(e)}")
+            logger.error(f"❌ ERRO ao editar: {str(e)}")
             resposta = {"status": "erro", "mensagem": f"Erro ao editar: {str(e)}"}
 
         self.enviar_json(resposta)
@@ -675,7 +1449,7 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
             motorista = parametros.get('motorista', [''])[0]
             linha = parametros.get('linha', [''])[0]
 
-            print(f"🚗 MOTORISTA CADASTRANDO: Número={numero}, Motorista={motorista}, Linha={linha}")
+            logger.info(f"🚗 MOTORISTA CADASTRANDO: Número={numero}, Motorista={motorista}, Linha={linha}")
 
             # Usar a mesma função do banco (inserir_dados_motorista) - agora com horários por linha
             resultado = self.db.inserir_dados_motorista(numero, motorista, linha)
@@ -686,18 +1460,21 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
                     "mensagem": "Sistema ainda não foi inicializado pelo presidente! Procure o fiscal."
                 }
             else:
-                # Calcular horário que foi definido PARA A LINHA ESPECÍFICA
-                horario_calculado = self.db.calcular_proximo_horario_linha(linha)
+                # inserir_dados_motorista já devolve o horário definido PARA A LINHA ESPECÍFICA
+                horario_calculado = resultado
                 resposta = {
                     "status": "ok",
                     "mensagem": f"Carro {numero} cadastrado com sucesso na linha {linha}!",
                     "horario": str(horario_calculado)[:5],  # Formato HH:MM
                     "dados": {"numero": numero, "motorista": motorista, "linha": linha}
                 }
-                print(f"✅ MOTORISTA: Carro {numero} cadastrado para linha {linha} às {horario_calculado}")
+                logger.info(f"✅ MOTORISTA: Carro {numero} cadastrado para linha {linha} às {horario_calculado}")
 
+        except LinhaSemVaga as e:
+            logger.warning(f"⚠️ MOTORISTA: Carro recusado: {str(e)}")
+            resposta = {"status": "erro", "mensagem": str(e)}
         except Exception as e:
-            print(f"❌ ERRO MOTORISTA ao adicionar carro: {str(e)}")
+            logger.error(f"❌ ERRO MOTORISTA ao adicionar carro: {str(e)}")
             resposta = {
                 "status": "erro",
                 "mensagem": f"Erro no sistema. Procure o fiscal responsável. (Erro: {str(e)})"
@@ -706,16 +1483,179 @@ class MeuServidor(http.server.BaseHTTPRequestHandler):
         self.enviar_json(resposta)
 
 
+class ServidorConcorrente(socketserver.TCPServer):
+    """🆕 NOVO: Servidor TCP que atende as requisições em um pool de threads
+
+    - `workers`: quantidade de threads atendendo requisições ao mesmo tempo
+    - `fila_maxima`: quantas conexões podem ficar esperando um worker livre.
+      Passando disso o servidor responde 503 na hora em vez de enfileirar
+      sem limite (o celular tenta de novo no próximo ciclo).
+    - 🆕 `tempo_ocioso` / `max_ociosas`: conexões keep-alive paradas entre uma requisição
+      e outra esperam num seletor, sem ocupar worker nem vaga, por até `tempo_ocioso`
+      segundos. Acima de `max_ociosas` a conexão é fechada em vez de ficar esperando.
+    """
+    allow_reuse_address = True
+
+    def __init__(self, endereco, handler, workers=8, fila_maxima=64, tempo_ocioso=15, max_ociosas=500):
+        self.workers = workers
+        self.fila_maxima = fila_maxima
+        # Backlog do listen() também fica limitado pela fila
+        self.request_queue_size = fila_maxima
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prancheta')
+        # Vagas = conexões sendo atendidas + conexões esperando na fila
+        self.vagas = threading.BoundedSemaphore(workers + fila_maxima)
+        # 🆕 Conexões que ficam abertas depois da requisição (stream /eventos)
+        self.desacopladas = set()
+        self.lock_desacopladas = threading.Lock()
+        # 🆕 Keep-alive: conexões esperando a próxima requisição {socket: (endereço, expira_em)}
+        self.tempo_ocioso = tempo_ocioso
+        self.max_ociosas = max_ociosas
+        self.manter_abertas = set()
+        self.ociosas = {}
+        self.requisicoes_por_conexao = {}
+        self.seletor = selectors.DefaultSelector()
+        super().__init__(endereco, handler)
+        threading.Thread(target=self.loop_ociosas, name='keep-alive', daemon=True).start()
+
+    def process_request(self, request, client_address):
+        """Entrega a conexão para o pool (ou recusa se a fila estiver cheia)"""
+        if not self.vagas.acquire(blocking=False):
+            logger.warning(f"⚠️ Fila cheia ({self.fila_maxima}), recusando conexão de {client_address[0]}")
+            self.recusar_conexao(request)
+            return
+
+        self.executor.submit(self.processar_no_worker, request, client_address)
+
+    def processar_no_worker(self, request, client_address):
+        """Executado dentro de uma thread do pool"""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self.lock_desacopladas:
+                desacoplada = request in self.desacopladas
+                self.desacopladas.discard(request)
+                manter_aberta = request in self.manter_abertas
+                self.manter_abertas.discard(request)
+            if manter_aberta:
+                self.estacionar(request, client_address)
+            elif not desacoplada:
+                self.shutdown_request(request)
+            self.vagas.release()
+
+    def desacoplar(self, request):
+        """🆕 NOVO: Marca a conexão para NÃO ser fechada no fim da requisição (quem fecha é o canal de eventos)"""
+        with self.lock_desacopladas:
+            self.desacopladas.add(request)
+            self.requisicoes_por_conexao.pop(request, None)
+
+    def contar_requisicao(self, request):
+        """🆕 NOVO: Soma uma requisição na conexão e retorna quantas ela já teve"""
+        with self.lock_desacopladas:
+            atendidas = self.requisicoes_por_conexao.get(request, 0) + 1
+            self.requisicoes_por_conexao[request] = atendidas
+        return atendidas
+
+    def manter_aberta(self, request):
+        """🆕 NOVO: No fim da requisição a conexão vai esperar a próxima (keep-alive) em vez de fechar"""
+        with self.lock_desacopladas:
+            self.manter_abertas.add(request)
+
+    def estacionar(self, request, client_address):
+        """Coloca a conexão no seletor até chegar outra requisição (ou vencer o tempo ocioso)"""
+        with self.lock_desacopladas:
+            if len(self.ociosas) < self.max_ociosas:
+                self.ociosas[request] = (client_address, time.monotonic() + self.tempo_ocioso)
+                try:
+                    self.seletor.register(request, selectors.EVENT_READ)
+                    return
+                except (OSError, ValueError):
+                    del self.ociosas[request]
+        self.shutdown_request(request)
+
+    def loop_ociosas(self):
+        """Thread do keep-alive: devolve ao pool as conexões que mandaram requisição e fecha as vencidas"""
+        while True:
+            try:
+                prontas = [chave.fileobj for chave, _ in self.seletor.select(timeout=1)]
+            except OSError:
+                return  # seletor fechado (server_close)
+
+            agora = time.monotonic()
+            with self.lock_desacopladas:
+                vencidas = [request for request, (_, expira_em) in self.ociosas.items()
+                            if expira_em <= agora and request not in prontas]
+                retiradas = []
+                for request in prontas + vencidas:
+                    endereco, _ = self.ociosas.pop(request, (None, None))
+                    if endereco is not None:
+                        self.seletor.unregister(request)
+                        retiradas.append((request, endereco))
+
+            for request, endereco in retiradas:
+                if request in vencidas:
+                    self.shutdown_request(request)
+                elif self.vagas.acquire(blocking=False):
+                    self.executor.submit(self.processar_no_worker, request, endereco)
+                else:
+                    logger.warning(f"⚠️ Fila cheia ({self.fila_maxima}), recusando conexão de {endereco[0]}")
+                    self.recusar_conexao(request)
+
+    def shutdown_request(self, request):
+        with self.lock_desacopladas:
+            self.requisicoes_por_conexao.pop(request, None)
+        super().shutdown_request(request)
+
+    def recusar_conexao(self, request):
+        """Responde 503 direto no socket, sem ocupar um worker"""
+        try:
+            request.sendall(b'HTTP/1.0 503 Service Unavailable\r\n'
+                            b'Content-Type: text/plain; charset=utf-8\r\n'
+                            b'Retry-After: 2\r\n'
+                            b'Content-Length: 0\r\n\r\n')
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        with self.lock_desacopladas:
+            ociosas = list(self.ociosas)
+            self.ociosas.clear()
+        for request in ociosas:
+            self.seletor.unregister(request)
+            self.shutdown_request(request)
+        self.seletor.close()
+
+
 if __name__ == '__main__':
-    PORT = int(os.environ.get('PORT', 8001))
+    configurar_logging()
 
-    with socketserver.TCPServer(("0.0.0.0", PORT), MeuServidor) as httpd:
-        print(f"🌐 Servidor rodando em http://localhost:{PORT}")
-        print("🔥 Aperte Ctrl+C para parar")
-        print("")
-        print("📍 PÁGINAS DISPONÍVEIS:")
-        print(f"   👑 PRESIDENTE: http://localhost:{PORT}/")
-        print(f"   🚗 MOTORISTA:  http://localhost:{PORT}/motorista")
+    PORT = int(os.environ.get('PORT', 8001))
+    WORKERS = int(os.environ.get('WORKERS', 8))
+    FILA_MAXIMA = int(os.environ.get('FILA_MAXIMA', 64))
+    MAX_OCIOSAS = int(os.environ.get('KEEPALIVE_MAX_CONEXOES', 500))
+
+    # 🆕 Deixa o banco em dia (índices, colunas novas) antes de começar a atender
+    if os.environ.get('MIGRAR_AO_INICIAR', '1') == '1':
+        MeuServidor.db_global.executar_migracoes()
+        # 🆕 Dias que ficaram sem resumo (sessão perdida num restart, por exemplo)
+        MeuServidor.db_global.atualizar_resumos_pendentes()
+
+    # 🆕 Sessões que estavam abertas antes do restart voltam com cabeçalho, intervalos e quadro
+    MeuServidor.db_global.carregar_sessoes_salvas()
+
+    with ServidorConcorrente(("0.0.0.0", PORT), MeuServidor, workers=WORKERS, fila_maxima=FILA_MAXIMA,
+                             tempo_ocioso=MeuServidor.timeout, max_ociosas=MAX_OCIOSAS) as httpd:
+        logger.info(f"🌐 Servidor rodando em http://localhost:{PORT}")
+        logger.info(f"🧵 {WORKERS} workers, fila máxima de {FILA_MAXIMA} conexões")
+        logger.info(f"🔁 Keep-alive: {MeuServidor.timeout}s ocioso, {MeuServidor.max_requisicoes_conexao} requisições por conexão")
+        logger.info("🔥 Aperte Ctrl+C para parar")
+        logger.info("📍 PÁGINAS DISPONÍVEIS:")
+        logger.info(f"   👑 PRESIDENTE: http://localhost:{PORT}/")
+        logger.info(f"   🚗 MOTORISTA:  http://localhost:{PORT}/motorista")
         '''print("")
         print("✅ FUNCIONALIDADES ATIVAS:")
         print("   📋 Cabeçalho simplificado (fiscal + data)")
@@ -734,4 +1674,4 @@ if __name__ == '__main__':
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
-            print("\n👋 Servidor parado!")
\ No newline at end of file
+            logger.info("👋 Servidor parado!")
\ No newline at end of file
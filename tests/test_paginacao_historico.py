@@ -0,0 +1,84 @@
+import sqlite3
+from datetime import timedelta
+
+import pytest
+
+pytest.importorskip('mysql.connector')  # database.py importa o conector no topo
+
+from database import DatabaseManager
+
+
+# SQLite também põe NULL antes de qualquer valor no ORDER BY ASC, como o MySQL
+sqlite3.register_converter('TIME', lambda valor: timedelta(seconds=sum(
+    int(parte) * fator for parte, fator in zip(valor.decode().split(':'), (3600, 60, 1)))))
+
+
+class ConexaoSqlite:
+    """Conexão mínima no formato do mysql.connector (placeholder %s) para exercitar o SQL do histórico"""
+
+    def __init__(self, conexao):
+        self.conexao = conexao
+
+    def cursor(self, **_):
+        return CursorSqlite(self.conexao.cursor())
+
+    def commit(self):
+        self.conexao.commit()
+
+    def close(self):
+        pass
+
+
+class CursorSqlite:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, valores=()):
+        self.cursor.execute(sql.replace('%s', '?'), list(valores))
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def close(self):
+        self.cursor.close()
+
+
+@pytest.fixture
+def db():
+    conexao = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES)
+    conexao.execute("""CREATE TABLE saida_carros (
+                           id INTEGER PRIMARY KEY, nome_fiscal TEXT, data_trabalho DATE, linha TEXT,
+                           numero_carro TEXT, nome_motorista TEXT, horario_saida TIME, data_registro TEXT,
+                           saida_confirmada INTEGER DEFAULT 0, horario_confirmacao TEXT, atraso_segundos INTEGER)""")
+    horarios = [None, '08:00:00', None, '00:00:00', '08:00:00', None, '09:30:00', None]
+    for i, horario in enumerate(horarios, 1):
+        conexao.execute("INSERT INTO saida_carros (id, nome_fiscal, data_trabalho, linha, numero_carro, "
+                        "nome_motorista, horario_saida) VALUES (?, 'Ana', ?, 'Linha', ?, 'Motorista', ?)",
+                        (i, '2026-10-18' if i <= 6 else '2026-10-17', str(i), horario))
+    conexao.commit()
+
+    banco = DatabaseManager()
+    banco.connect = lambda: ConexaoSqlite(conexao)
+    return banco
+
+
+@pytest.mark.parametrize('tamanho_pagina', [1, 2, 3])
+def test_paginacao_passa_por_horarios_nulos_sem_pular_nem_repetir(db, tamanho_pagina):
+    tudo = db.consultar_por_filtros({}, limite=100)
+    esperado = [registro.id for registro in tudo['registros']]
+    assert esperado == [1, 3, 6, 4, 2, 5, 8, 7]  # NULL primeiro, depois horário, empate por id
+
+    vistos = []
+    cursor_pagina = None
+    while True:
+        pagina = db.consultar_por_filtros({}, limite=tamanho_pagina, cursor_pagina=cursor_pagina)
+        assert pagina['status'] == 'sucesso'
+        vistos.extend(registro.id for registro in pagina['registros'])
+        cursor_pagina = pagina['proximo_cursor']
+        if cursor_pagina is None:
+            break
+
+    assert vistos == esperado
\ No newline at end of file